@@ -16,56 +16,63 @@ import logging
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.serving import run_simple
 import os, json, base64
-from firebase_admin import credentials, initialize_app
 
-sa_b64 = os.environ.get("SERVICE_ACCOUNT_JSON")
-if sa_b64:
-    try:
-        sa_json = json.loads(base64.b64decode(sa_b64).decode('utf-8'))
-        cred = credentials.Certificate(sa_json)
-        initialize_app(cred)
-        print("Firebase admin initialized from SERVICE_ACCOUNT_JSON")
-    except Exception as e:
-        print("Failed to init firebase admin from SERVICE_ACCOUNT_JSON:", e)
-else:
-    # fallback: either use local file (only for dev) or raise
-    local_path = os.path.join(os.getcwd(), 'serviceAccountKey.json')
-    if os.path.exists(local_path):
-        cred = credentials.Certificate(local_path)
-        initialize_app(cred)
-        print("Firebase admin initialized from local serviceAccountKey.json")
-    else:
-        print("No service account available; continuing without firebase_admin")
+LOG = logging.getLogger("composed-app")
+logging.basicConfig(level=logging.INFO)
 
+# Start-up (Firebase, importing the apps) happens in make_app(), not at import:
+# PDF extraction workers are spawned processes, which import this module again
+# as their parent's main module and must not repeat it.
 
-try:
-    # Import the existing Flask apps defined in the repository
-    from quiz import app as quiz_app
-except Exception as e:
-    raise RuntimeError("Failed to import quiz app: {}".format(e))
 
-try:
-    from chat import app as chat_app
-except Exception as e:
-    raise RuntimeError("Failed to import chat app: {}".format(e))
+def init_firebase():
+    from firebase_admin import credentials, initialize_app
 
-try:
-    from study import app as study_app
-except Exception as e:
-    raise RuntimeError("Failed to import study app: {}".format(e))
+    sa_b64 = os.environ.get("SERVICE_ACCOUNT_JSON")
+    if sa_b64:
+        try:
+            sa_json = json.loads(base64.b64decode(sa_b64).decode('utf-8'))
+            cred = credentials.Certificate(sa_json)
+            initialize_app(cred)
+            print("Firebase admin initialized from SERVICE_ACCOUNT_JSON")
+        except Exception as e:
+            print("Failed to init firebase admin from SERVICE_ACCOUNT_JSON:", e)
+    else:
+        # fallback: either use local file (only for dev) or raise
+        local_path = os.path.join(os.getcwd(), 'serviceAccountKey.json')
+        if os.path.exists(local_path):
+            cred = credentials.Certificate(local_path)
+            initialize_app(cred)
+            print("Firebase admin initialized from local serviceAccountKey.json")
+        else:
+            print("No service account available; continuing without firebase_admin")
 
-try:
-    from summarizer import app as summarizer_app
-except Exception as e:
-    # Summarizer is optional; log and continue if it fails to import
-    raise RuntimeError("Failed to import summarizer app: {}".format(e))
 
-LOG = logging.getLogger("composed-app")
-logging.basicConfig(level=logging.INFO)
+def make_app():
+    """Initialise Firebase, import the apps, compose them and return a WSGI application."""
+    init_firebase()
+    try:
+        # Import the existing Flask apps defined in the repository
+        from quiz import app as quiz_app
+    except Exception as e:
+        raise RuntimeError("Failed to import quiz app: {}".format(e))
 
+    try:
+        from chat import app as chat_app
+    except Exception as e:
+        raise RuntimeError("Failed to import chat app: {}".format(e))
+
+    try:
+        from study import app as study_app
+    except Exception as e:
+        raise RuntimeError("Failed to import study app: {}".format(e))
+
+    try:
+        from summarizer import app as summarizer_app
+    except Exception as e:
+        # Summarizer is optional; log and continue if it fails to import
+        raise RuntimeError("Failed to import summarizer app: {}".format(e))
 
-def make_app():
-    """Compose apps and return a WSGI application."""
     # We mount the quiz app at the root so its existing service-worker and
     # static routes continue to work unchanged. Chat and Study are mounted
     # under prefixes to avoid route collisions.
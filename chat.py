@@ -1,15 +1,16 @@
 import os
-import uuid
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_from_directory, abort
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
 from dotenv import load_dotenv
 
 # Local modules
 from utils.extractors import extract_text_from_image, extract_text_from_pdf
-from utils.ai_client import get_gemini_model, FORMATTING_INSTRUCTIONS
+from utils.ai_client import FORMATTING_INSTRUCTIONS
+from utils import gemini_gateway
+from utils.sse import format_event, sse_response
+from utils.blobstore import upload_store
 
 # Firebase
 import firebase_admin
@@ -17,7 +18,7 @@ from firebase_admin import credentials, firestore
 
 # ---------------- CONFIG ----------------
 load_dotenv()
-UPLOAD_FOLDER = "uploads"
+UPLOAD_FOLDER = upload_store.root
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
@@ -34,25 +35,56 @@ db = firestore.client()
 GENAI_KEY = os.getenv("GEMINI_API_KEY")
 if not GENAI_KEY:
     raise RuntimeError("GEMINI_API_KEY not found in .env")
-genai.configure(api_key=GENAI_KEY)
 
-app = Flask(__name__, static_url_path='/uploads', static_folder='uploads')
+app = Flask(__name__, static_folder=None)
 CORS(app)
+upload_store.ensure_gc()
+
+
+@app.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """Stored uploads (blobs and files from before the blob store), never the
+    store's own staging files."""
+    if not upload_store.servable(filename):
+        abort(404)
+    return send_from_directory(os.path.abspath(UPLOAD_FOLDER), filename)
 
 # ------------- UTIL: Firestore Chat Save -------------
-def save_chat_to_firestore(user_id, message, reply, file_meta=None):
-    """Save user chat and AI response to Firestore. Returns the document ID."""
+def save_chat_to_firestore(user_id, message, reply, file_meta=None, blob_ref=None):
+    """Save user chat and AI response to Firestore. Returns the document ID.
+    `blob_ref` is the digest of an upload this document holds a reference on;
+    only the upload endpoints set it, never client input."""
     doc_ref = db.collection("users").document(user_id).collection("chats").document()
-    doc_ref.set({
+    doc = {
         "message": message,
         "reply": reply,
         "fileMeta": file_meta,
         "timestamp": firestore.SERVER_TIMESTAMP
-    })
+    }
+    if blob_ref:
+        doc["blobRef"] = blob_ref
+    doc_ref.set(doc)
     logger.info("Chat saved for user %s with ID %s", user_id, doc_ref.id)
     return doc_ref.id
 
 
+def save_upload_chat(user_id, message, reply, blob, filename, content_type):
+    """Save an upload's chat pair and take a reference on its blob."""
+    file_meta = {"name": filename, "type": content_type, "url": blob["url"]}
+    doc_id = save_chat_to_firestore(user_id, message, reply, file_meta, blob_ref=blob["sha256"])
+    upload_store.add_ref(blob["sha256"])
+    return doc_id
+
+
+def release_chat_upload(data):
+    """Drop the blob reference a chat document took in save_upload_chat (no-op
+    for plain messages, /saveChat documents and files saved before the blob
+    store). A client-supplied fileMeta never names a blob to release."""
+    digest = (data or {}).get("blobRef")
+    if isinstance(digest, str) and digest:
+        upload_store.release(digest)
+
+
 @app.route('/saveChat', methods=['POST'])
 def save_chat():
     """Generic endpoint to save a chat pair (message + reply) from the client.
@@ -70,6 +102,9 @@ def save_chat():
     message = data.get('message', '')
     reply = data.get('reply', '')
     file_meta = data.get('fileMeta', None)
+    if isinstance(file_meta, dict):
+        # blob references are server-side only (see save_upload_chat)
+        file_meta = {k: v for k, v in file_meta.items() if k not in ("sha256", "blobRef")}
 
     try:
         doc_id = save_chat_to_firestore(user_id, message, reply, file_meta)
@@ -80,17 +115,8 @@ def save_chat():
 
 # ------------- ROUTES -------------
 
-@app.route("/chat", methods=["POST"])
-def handle_chat():
-    """Handle normal chat text."""
-    data = request.get_json(force=True)
-    user_id = data.get("user_id", "anonymous")
-    message = data.get("text", "").strip()
-
-    if not message:
-        return jsonify({"error": "Empty message"}), 400
-
-    # --- Fetch user profile ---
+def build_chat_prompt(user_id, message):
+    """Mentor prompt for a chat turn, including the user's profile when known."""
     profile_text = ""
     if user_id != "anonymous":
         doc_ref = db.collection("users").document(user_id)
@@ -109,14 +135,25 @@ def handle_chat():
                 f"Hobbies: {hobbies}\n"
             )
 
-    try:
-        model = get_gemini_model()
-        prompt = f"{FORMATTING_INSTRUCTIONS}\n\n"
-        prompt += f"{profile_text}"
-        prompt += f"User message: {message}"
+    prompt = f"{FORMATTING_INSTRUCTIONS}\n\n"
+    prompt += f"{profile_text}"
+    prompt += f"User message: {message}"
+    return prompt
 
-        resp = model.generate_content(prompt)
-        reply = getattr(resp, "text", "⚠️ No AI response")
+
+@app.route("/chat", methods=["POST"])
+def handle_chat():
+    """Handle normal chat text."""
+    data = request.get_json(force=True)
+    user_id = data.get("user_id", "anonymous")
+    message = data.get("text", "").strip()
+
+    if not message:
+        return jsonify({"error": "Empty message"}), 400
+
+    try:
+        prompt = build_chat_prompt(user_id, message)
+        reply = gemini_gateway.generate_text(prompt, api_key=GENAI_KEY, label="chat", cache=False)
 
         # Save chat and get document ID
         doc_id = save_chat_to_firestore(user_id, message, reply)
@@ -128,6 +165,37 @@ def handle_chat():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/chat/stream", methods=["POST"])
+def handle_chat_stream():
+    """Streaming variant of /chat: forwards model tokens as Server-Sent Events.
+
+    Same JSON body as /chat. The full reply is saved to Firestore when the
+    stream ends and returned in the final `done` event with its doc_id.
+    """
+    data = request.get_json(force=True)
+    user_id = data.get("user_id", "anonymous")
+    message = data.get("text", "").strip()
+
+    if not message:
+        return jsonify({"error": "Empty message"}), 400
+
+    def events():
+        pieces = []
+        try:
+            prompt = build_chat_prompt(user_id, message)
+            for delta in gemini_gateway.stream_text(prompt, api_key=GENAI_KEY, label="chat-stream"):
+                pieces.append(delta)
+                yield format_event({"delta": delta})
+            reply = "".join(pieces) or "⚠️ No AI response"
+            doc_id = save_chat_to_firestore(user_id, message, reply)
+            yield format_event({"reply": reply, "doc_id": doc_id}, event="done")
+        except Exception as e:
+            logger.exception("Chat stream error")
+            yield format_event({"error": str(e)}, event="error")
+
+    return sse_response(events())
+
+
 @app.route("/uploadImage", methods=["POST"])
 def upload_image():
     """Handle image upload and question."""
@@ -139,28 +207,22 @@ def upload_image():
     user_id = request.form.get("user_id", "anonymous")
 
     filename = secure_filename(f.filename)
-    unique_name = f"{uuid.uuid4().hex}_{filename}"
-    save_path = os.path.join(UPLOAD_FOLDER, unique_name)
-    f.save(save_path)
+    blob = upload_store.put(f.stream, f.content_type, filename)
 
-    extracted_text = extract_text_from_image(save_path)
+    extracted_text = extract_text_from_image(blob["path"])
 
-    model = get_gemini_model()
     prompt = (
         f"{FORMATTING_INSTRUCTIONS}\n\n"
         f"User uploaded an image and asked: {question or 'Summarize the image'}\n"
         f"Extracted Text:\n{extracted_text}"
     )
-    resp = model.generate_content(prompt)
-    reply = getattr(resp, "text", "⚠️ No AI response")
+    reply = gemini_gateway.generate_text(prompt, api_key=GENAI_KEY, label="chat", cache=False)
 
-    file_url = f"/uploads/{unique_name}"  # this is the browser-accessible URL
-
-    doc_id = save_chat_to_firestore(
+    doc_id = save_upload_chat(
         user_id,
         f"[Image: {filename}] {question}",
         reply,
-        {"name": filename, "type": f.content_type, "url": file_url})
+        blob, filename, f.content_type)
 
     return jsonify({"reply": reply, "filename": filename, "doc_id": doc_id})
 
@@ -176,28 +238,22 @@ def upload_pdf():
     user_id = request.form.get("user_id", "anonymous")
 
     filename = secure_filename(f.filename)
-    unique_name = f"{uuid.uuid4().hex}_{filename}"
-    save_path = os.path.join(UPLOAD_FOLDER, unique_name)
-    f.save(save_path)
+    blob = upload_store.put(f.stream, f.content_type, filename)
 
-    extracted_text = extract_text_from_pdf(save_path)
+    extracted_text = extract_text_from_pdf(blob["path"])
 
-    model = get_gemini_model()
     prompt = (
         f"{FORMATTING_INSTRUCTIONS}\n\n"
         f"User uploaded a document and asked: {question or 'Summarize this PDF'}\n"
         f"Document Content:\n{extracted_text}"
     )
-    resp = model.generate_content(prompt)
-    reply = getattr(resp, "text", "⚠️ No AI response")
-
-    file_url = f"/uploads/{unique_name}"
+    reply = gemini_gateway.generate_text(prompt, api_key=GENAI_KEY, label="chat", cache=False)
 
-    doc_id = save_chat_to_firestore(
+    doc_id = save_upload_chat(
         user_id,
         f"[PDF: {filename}] {question}",
         reply,
-        {"name": filename, "type": f.content_type, "url": file_url} )
+        blob, filename, f.content_type)
     return jsonify({"reply": reply, "filename": filename, "doc_id": doc_id})
 
 
@@ -212,6 +268,7 @@ def get_chats(user_id):
         for d in docs:
             data = d.to_dict()
             data["doc_id"] = d.id # Include the document ID
+            data.pop("blobRef", None)
             # Normalize timestamp to ISO string when possible
             ts = data.get("timestamp")
             if ts is not None:
@@ -233,7 +290,11 @@ def get_chats(user_id):
 def delete_chat(user_id, doc_id):
     """Delete a single chat message document by doc_id (new endpoint)."""
     try:
-        db.collection("users").document(user_id).collection("chats").document(doc_id).delete()
+        doc_ref = db.collection("users").document(user_id).collection("chats").document(doc_id)
+        snapshot = doc_ref.get()
+        doc_ref.delete()
+        if snapshot.exists:
+            release_chat_upload(snapshot.to_dict())
         logger.info("Deleted chat document %s for user %s", doc_id, user_id)
         return jsonify({"status": "deleted", "doc_id": doc_id}), 200
     except Exception as e:
@@ -249,6 +310,7 @@ def clear_all_chats(user_id):
         deleted_count = 0
         for doc in docs:
             doc.reference.delete()
+            release_chat_upload(doc.to_dict())
             deleted_count += 1
         return jsonify({"status": f"Cleared {deleted_count} chats"}), 200
     except Exception as e:
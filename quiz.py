@@ -1,10 +1,8 @@
 #app.py
 import os
 import json
-import socket
+import hashlib
 import logging
-import requests
-import time
 from flask import Flask, request, jsonify, send_from_directory, session, redirect
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -20,6 +18,20 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("quiz-backend")
 
+from utils import gemini_gateway
+from utils.cache import llm_cache
+from utils import health
+from utils.deadline import Deadline, DeadlineExceeded, backoff_delay
+from utils.context_builder import build_context
+from utils.jobs import job_queue, submit_response, register_job_routes, QueueFull
+from utils.extractors import extraction_cache
+from utils import ocr
+from utils.blobstore import upload_store
+from utils import wordnet_table
+from utils import nltk_resources
+from utils import question_bank as qbank
+from utils.question_bank import question_bank
+
 
 def user_file(user_id):
     return f'progress_{user_id}.json'
@@ -180,22 +192,43 @@ def delete_quiz(quiz_name):
     return jsonify({'status': 'deleted'})
 
 
-def is_online(host="8.8.8.8", port=53, timeout=2) -> bool:
-    try:
-        socket.setdefaulttimeout(timeout)
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((host, port))
-        return True
-    except Exception:
-        return False
+@app.route('/api/ai-stats', methods=['GET'])
+def ai_stats():
+    """Gemini gateway counters (call count, retries, connection reuse and timing split)
+    LLM response cache hit/miss counters, how many calls single-flight saved,
+    circuit breaker state with its recent transitions, background job queue depth,
+    the document extraction cache, OCR throughput, chat upload storage, the
+    WordNet distractor table, which NLTK resources this host has and the
+    per-document question banks."""
+    return jsonify({
+        'gateway': gemini_gateway.stats(),
+        'llm_cache': llm_cache.stats(),
+        'coalescing': gemini_gateway.flight.stats(),
+        'health': health.stats(),
+        'jobs': job_queue.stats(),
+        'extract_cache': extraction_cache.stats(),
+        'ocr': ocr.stats(),
+        'uploads': upload_store.stats(),
+        'wordnet': wordnet_table.stats(),
+        'nltk': nltk_resources.stats(),
+        'question_bank': question_bank.stats(),
+    })
+
+
+def is_online() -> bool:
+    """Whether Gemini calls should be attempted. Reads the circuit breaker kept
+    up to date by the background health monitor; never touches the network."""
+    return health.gemini_available()
 
 
 from quiz_generator import generate_offline_quiz, clean_input_text
 
 
-def generate_online_quiz_gemini(text: str, amount: int = 10, difficulty: str = "medium", gemini_api_key: str = None):
+def generate_online_quiz_gemini(text: str, amount: int = 10, difficulty: str = "medium", gemini_api_key: str = None,
+                                deadline: Deadline = None):
     if not gemini_api_key:
         raise ValueError("Missing GEMINI_API_KEY")
+    deadline = deadline or Deadline.for_task("quiz")
     prompt = f"""
 You are an expert quiz maker. Generate exactly {amount} multiple-choice questions (MCQs)
 from the following study material. Each question must include:
@@ -218,41 +251,17 @@ Return ONLY a valid JSON array (no explanation, no extra text) in this exact sha
 
 
 Study material:
-{text[:6000]}
+{build_context(text, task="quiz")}
 """.strip()
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
-    headers = {
-        "Content-Type": "application/json",
-        "x-goog-api-key": gemini_api_key
-    }
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"text": prompt}
-                ]
-            }
-        ]
-    }
     max_attempts = 3
     base_backoff = 1.0
     last_err = None
     for attempt in range(1, max_attempts + 1):
         try:
             logger.info(f"Gemini request attempt {attempt}/{max_attempts}")
-            resp = requests.post(url, headers=headers, json=payload, timeout=90)
-            resp.raise_for_status()
-            data = resp.json()
-            candidates = data.get("candidates", [])
-            if not candidates:
-                raise RuntimeError("Gemini response contains no candidates")
-            content = candidates[0].get("content", {})
-            parts = content.get("parts", [])
-            if not parts:
-                raise RuntimeError("Gemini response content.parts missing")
-            text_response = parts[0].get("text", "")
-            if not isinstance(text_response, str) or not text_response.strip():
-                raise RuntimeError("Gemini returned empty text response")
+            text_response = gemini_gateway.generate_text(prompt, api_key=gemini_api_key, timeout=90,
+                                                         max_attempts=1, label="quiz", cache=False,
+                                                         deadline=deadline)
             try:
                 quiz = json.loads(text_response)
             except Exception as p_err:
@@ -297,26 +306,39 @@ Study material:
         except Exception as exc:
             last_err = exc
             logger.warning(f"Gemini attempt {attempt} failed: {exc}")
+            if isinstance(exc, (DeadlineExceeded, gemini_gateway.CircuitOpenError)):
+                break
             if attempt < max_attempts:
-                sleep_for = base_backoff * (2 ** (attempt - 1))
-                logger.info(f"Retrying after {sleep_for} seconds...")
-                time.sleep(sleep_for)
+                sleep_for = backoff_delay(attempt, base=base_backoff)
+                if not deadline.sleep_before_retry(sleep_for):
+                    logger.warning(f"Deadline budget cannot fit another attempt ({deadline})")
+                    break
+                logger.info(f"Retried after {sleep_for:.1f} seconds")
             else:
                 logger.error("Gemini generation exhausted retries")
     raise RuntimeError(f"Gemini generation failed after {max_attempts} attempts: {last_err}")
 
 
-def generate_online_quiz_about_topic(topic: str, amount: int = 10, difficulty: str = "medium", gemini_api_key: str = None):
+def generate_online_quiz_about_topic(topic: str, amount: int = 10, difficulty: str = "medium", gemini_api_key: str = None,
+                                     deadline: Deadline = None):
     """
     Generate multiple-choice questions strictly about a short named topic.
     This helper calls Gemini with a prompt that instructs it to return only a JSON array
     of MCQ objects closely tied to the provided topic string.
+
+    Valid questions are kept across attempts: each follow-up call asks only for the
+    shortfall and lists the questions already collected so the model avoids repeats.
+    Attempts and timeouts are bounded by `deadline` (default: the "quiz" budget).
+
+    Returns (questions, model_calls). `questions` may be shorter than `amount` when
+    the budget or attempts run out; raises if no valid question was produced at all.
     """
     if not gemini_api_key:
         raise ValueError("Missing GEMINI_API_KEY")
+    deadline = deadline or Deadline.for_task("quiz")
     prompt_template = """
 You are an expert quiz maker. Generate exactly {amount} multiple-choice questions (MCQs)
-STRICTLY about the topic: "{topic}". Every question MUST include the topic word "{topic}" either in the question text or in the correct answer. Do NOT include any questions unrelated to the topic. If you cannot generate enough, repeat or rephrase questions about the topic until you reach {amount}.
+STRICTLY about the topic: "{topic}". Every question MUST include the topic word "{topic}" either in the question text or in the correct answer. Do NOT include any questions unrelated to the topic. If you cannot generate enough, cover other aspects of the topic until you reach {amount}.
 
 Each question must include:
 - "question": concise, clear question text that mentions the topic word "{topic}" OR where the correct answer contains the topic word
@@ -334,14 +356,9 @@ Return ONLY a valid JSON array (no explanation, no extra text) in this exact sha
     }},
     ...
 ]
-
+{existing}
 Topic: {topic}
 """
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
-    headers = {
-        "Content-Type": "application/json",
-        "x-goog-api-key": gemini_api_key
-    }
     import re
     # We'll attempt multiple times to get strictly topic-related questions.
     max_attempts = 8
@@ -362,24 +379,31 @@ Topic: {topic}
             pass
         return False
 
+    def _question_key(q):
+        return " ".join(re.findall(r"\w+", q.lower()))
+
+    collected = []
+    seen = set()
+    model_calls = 0
     for attempt in range(1, max_attempts + 1):
-        prompt = prompt_template.format(amount=amount, topic=topic, difficulty=difficulty)
-        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        needed = amount - len(collected)
+        existing = ""
+        if collected:
+            listed = "\n".join(f"- {item['question']}" for item in collected)
+            existing = (f"\nThese questions already exist. Do NOT repeat or paraphrase them; "
+                        f"write {needed} NEW ones:\n{listed}\n")
+        prompt = prompt_template.format(amount=needed, topic=topic, difficulty=difficulty, existing=existing)
         try:
-            logger.info(f"Gemini topic request attempt {attempt}/{max_attempts}")
-            resp = requests.post(url, headers=headers, json=payload, timeout=90)
-            resp.raise_for_status()
-            data = resp.json()
-            candidates = data.get("candidates", [])
-            if not candidates:
-                raise RuntimeError("Gemini response contains no candidates")
-            content = candidates[0].get("content", {})
-            parts = content.get("parts", [])
-            if not parts:
-                raise RuntimeError("Gemini response content.parts missing")
-            text_response = parts[0].get("text", "")
-            if not isinstance(text_response, str) or not text_response.strip():
-                raise RuntimeError("Gemini returned empty text response")
+            logger.info(f"Gemini topic request attempt {attempt}/{max_attempts} (need {needed} more)")
+            sent = gemini_gateway.requests_sent()
+            try:
+                text_response = gemini_gateway.generate_text(prompt, api_key=gemini_api_key, timeout=90,
+                                                             max_attempts=1, label="quiz-topic", cache=False,
+                                                             deadline=deadline)
+            finally:
+                # calls refused by the breaker or the deadline never reached the model
+                if gemini_gateway.requests_sent() > sent:
+                    model_calls += 1
             try:
                 quiz = json.loads(text_response)
             except Exception as p_err:
@@ -394,7 +418,6 @@ Topic: {topic}
             if not isinstance(quiz, list):
                 raise RuntimeError("Gemini returned JSON that is not a list")
             # Normalize and validate items strictly: require topic word in question or answer
-            normalized = []
             for item in quiz:
                 if not isinstance(item, dict):
                     continue
@@ -409,94 +432,218 @@ Topic: {topic}
                 # Check topic presence in question or answer using keywords
                 if topic_keywords and not _item_matches_topic(item):
                     continue
+                key = _question_key(str(q))
+                if key in seen:
+                    continue
                 opts = opts[:4]
                 if len(opts) < 4:
                     while len(opts) < 4:
                         opts.append(f"Option {len(opts)+1}")
                 if ans not in opts:
                     opts[-1] = ans
-                normalized.append({
+                seen.add(key)
+                collected.append({
                     "question": str(q),
                     "options": [str(o) for o in opts],
                     "answer": str(ans),
                     "difficulty": str(diff)
                 })
-            if len(normalized) >= amount:
-                return normalized[:amount]
-            last_err = f"Gemini produced only {len(normalized)} valid topic questions (need {amount})"
+            if len(collected) >= amount:
+                logger.info(f"Topic quiz complete after {model_calls} model call(s)")
+                return collected[:amount], model_calls
+            last_err = f"Gemini produced {len(collected)} valid topic questions so far (need {amount})"
             logger.warning(last_err)
-            if attempt < max_attempts:
-                logger.info("Waiting 5 seconds before retrying...")
-                import time
-                time.sleep(5)
+            # partial success: top up immediately, no backoff needed
+            continue
         except Exception as exc:
             last_err = exc
             logger.warning(f"Gemini topic attempt {attempt} failed: {exc}")
-            if attempt < max_attempts:
-                logger.info("Waiting 5 seconds before retrying...")
-                import time
-                time.sleep(5)
-            else:
-                logger.error("Gemini topic generation exhausted retries")
-    raise RuntimeError(f"Gemini topic generation failed after {max_attempts} attempts: {last_err}")
+            if isinstance(exc, (DeadlineExceeded, gemini_gateway.CircuitOpenError)):
+                break
+        if attempt < max_attempts:
+            sleep_for = backoff_delay(attempt, base=1.0, cap=5.0)
+            if not deadline.sleep_before_retry(sleep_for):
+                logger.warning(f"Deadline budget cannot fit another topic attempt ({deadline})")
+                break
+        else:
+            logger.error("Gemini topic generation exhausted retries")
+    if collected:
+        logger.warning(f"Returning {len(collected)}/{amount} topic questions after {model_calls} model call(s)")
+        return collected[:amount], model_calls
+    raise RuntimeError(f"Gemini topic generation failed after {model_calls} model calls: {last_err}")
 
 
-@app.route("/generate-quiz", methods=["POST"])
-def generate_quiz():
-    try:
-        data = request.get_json(force=True)
-    except Exception as e:
-        return jsonify({"error": "Invalid JSON body", "details": str(e)}), 400
+def parse_quiz_request(data):
+    """Validate a /generate-quiz body. Returns (params, None) or (None, (error_body, status))."""
     text = (data.get("text") or "").strip()
     difficulty = (data.get("difficulty") or "medium").strip().lower()
     try:
         amount = int(data.get("amount", 10))
     except Exception:
-        return jsonify({"error": "amount must be an integer"}), 400
+        return None, ({"error": "amount must be an integer"}, 400)
     if difficulty not in {"easy", "medium", "hard"}:
-        return jsonify({"error": "difficulty must be one of easy, medium, hard"}), 400
+        return None, ({"error": "difficulty must be one of easy, medium, hard"}, 400)
     if amount <= 0 or amount > 100:
-        return jsonify({"error": "amount must be 1..100"}), 400
+        return None, ({"error": "amount must be 1..100"}, 400)
     if not text:
-        return jsonify({"error": "No text provided from PDF"}), 400
+        return None, ({"error": "No text provided from PDF"}, 400)
+    return {"text": text, "difficulty": difficulty, "amount": amount,
+            "is_topic": bool(data.get("is_topic", False)), "user": quiz_user(data)}, None
+
+
+def quiz_user(data):
+    """Who the question bank tracks seen questions for: the logged-in user, else
+    the anonymous id the quiz page keeps in localStorage, else a fingerprint of
+    the caller (address and user agent), so repeat requests still get new questions."""
+    if session.get('user_id'):
+        return f"user:{session['user_id']}"
+    client_id = str(data.get("client_id") or "").strip()
+    if client_id and len(client_id) <= 64:
+        return f"client:{client_id}"
+    caller = f"{request.remote_addr}\0{request.headers.get('User-Agent', '')}"
+    return "anon:" + hashlib.sha256(caller.encode("utf-8")).hexdigest()[:32]
+
+
+def offline_quiz(cleaned, amount, difficulty, user=None):
+    """Offline questions, sampled from the document's question bank. The first
+    request for a document banks the `amount` questions it needs plus enough
+    for a retake before the background job tops the bank up to
+    QUESTION_BANK_SIZE questions spread over the text. Later requests skip
+    what `user` has already been served."""
+    key = qbank.bank_key(cleaned, difficulty, "offline")
+    first = max(amount, min(qbank.BANK_SIZE, max(2 * amount, amount + 10)))
+    quiz = question_bank.serve(
+        key, amount, user=user, source="offline", target=first,
+        fill=lambda: generate_offline_quiz(cleaned, amount=first, difficulty=difficulty, spread=True))
+    if quiz is None:
+        quiz = generate_offline_quiz(cleaned, amount=amount, difficulty=difficulty)
+    if question_bank.needs_top_up(key, qbank.BANK_SIZE):
+        try:
+            job_queue.submit("question-bank", top_up_offline_bank, key, cleaned, difficulty)
+        except QueueFull:
+            logger.info("Job queue full; question bank top-up deferred to a later request")
+    return quiz
+
+
+def top_up_offline_bank(key, cleaned, difficulty):
+    """Background job: grow an offline question bank to QUESTION_BANK_SIZE questions."""
+    target = qbank.BANK_SIZE
+    added = question_bank.top_up(
+        key, lambda: generate_offline_quiz(cleaned, amount=target, difficulty=difficulty, spread=True),
+        source="offline", target=target)
+    return {"added": added}, 200
+
+
+def build_quiz(text, amount, difficulty, is_topic=False, user=None):
+    """The quiz pipeline (Gemini when available, offline generator otherwise).
+    Returns (body, status); runs inside a request or as a background job."""
     cleaned = clean_input_text(text)
-    is_topic = bool(data.get("is_topic", False))
     # Use only the GEMINI_API_KEY from the server environment (do not accept client-supplied keys)
     env_key = os.getenv("GEMINI_API_KEY", "").strip()
     gemini_key = env_key
     online_ok = bool(gemini_key) and is_online()
+    # one time budget for every Gemini attempt made on behalf of this request;
+    # when it runs out we fall back to the offline generator
+    deadline = Deadline.for_task("quiz")
     try:
         mode = None
+        model_calls = None
         if online_ok:
             if is_topic:
                 logger.info("Online topic-mode: Using Gemini topic generator")
                 # For topic-mode, the `text` field is expected to be a short topic string
                 try:
-                    quiz = generate_online_quiz_about_topic(text, amount=amount, difficulty=difficulty, gemini_api_key=gemini_key)
+                    quiz, model_calls = generate_online_quiz_about_topic(text, amount=amount, difficulty=difficulty,
+                                                                         gemini_api_key=gemini_key, deadline=deadline)
                     mode = 'ai-verified'
+                    if len(quiz) < amount:
+                        # keep the verified questions, fill the rest locally
+                        quiz += generate_offline_quiz(text, amount=amount - len(quiz), difficulty=difficulty)
+                        mode = 'ai-verified-partial'
                 except Exception as topic_exc:
                     logger.warning(f"Gemini topic generation failed or produced no valid questions: {topic_exc}")
                     logger.info("Falling back to offline topic generator")
                     quiz = generate_offline_quiz(text, amount=amount, difficulty=difficulty)
                     mode = 'offline-fallback'
             else:
-                logger.info("Online mode: Using Gemini API for quiz generation")
-                quiz = generate_online_quiz_gemini(cleaned, amount=amount, difficulty=difficulty, gemini_api_key=gemini_key)
+                # earlier Gemini questions for this document that `user` has not seen
+                ai_key = qbank.bank_key(cleaned, difficulty, "ai")
+                quiz = question_bank.sample(ai_key, amount, user=user, recycle=False)
+                if quiz is None:
+                    logger.info("Online mode: Using Gemini API for quiz generation")
+                    quiz = generate_online_quiz_gemini(cleaned, amount=amount, difficulty=difficulty,
+                                                       gemini_api_key=gemini_key, deadline=deadline)
+                    question_bank.add(ai_key, quiz, source="ai", user=user)
                 mode = 'ai'
         else:
             logger.info("Offline mode: Using local quiz generator")
-            quiz = generate_offline_quiz(cleaned, amount=amount, difficulty=difficulty)
+            quiz = offline_quiz(cleaned, amount, difficulty, user=user)
             mode = 'offline'
-        return jsonify({"quiz": quiz, "mode": mode})
+        payload = {"quiz": quiz, "mode": mode}
+        if model_calls is not None:
+            payload["model_calls"] = model_calls
+        return payload, 200
     except Exception as e:
+        if not online_ok:
+            # the offline generator itself failed; running it again would not help
+            logger.exception("Offline quiz generation failed")
+            return {"error": "Quiz generation failed", "details": str(e)}, 500
         logger.exception("Quiz generation failed (online attempt)")
         try:
             logger.info("Falling back to offline generator")
-            quiz = generate_offline_quiz(cleaned, amount=amount, difficulty=difficulty)
-            return jsonify({"quiz": quiz, "mode": "offline-fallback"})
+            quiz = offline_quiz(cleaned, amount, difficulty, user=user)
+            return {"quiz": quiz, "mode": "offline-fallback"}, 200
         except Exception as e2:
             logger.exception("Offline fallback also failed")
-            return jsonify({"error": "Quiz generation failed", "details": str(e2)}), 500
+            return {"error": "Quiz generation failed", "details": str(e2)}, 500
+
+
+@app.route("/generate-quiz", methods=["POST"])
+def generate_quiz():
+    try:
+        data = request.get_json(force=True)
+    except Exception as e:
+        return jsonify({"error": "Invalid JSON body", "details": str(e)}), 400
+    params, err = parse_quiz_request(data)
+    if err:
+        return jsonify(err[0]), err[1]
+    body, status = build_quiz(**params)
+    return jsonify(body), status
+
+
+@app.route("/generate-quiz/jobs", methods=["POST"])
+def generate_quiz_job():
+    """Queue /generate-quiz in the background: 202 {job_id, status_url}; poll GET /jobs/<job_id>."""
+    try:
+        data = request.get_json(force=True)
+    except Exception as e:
+        return jsonify({"error": "Invalid JSON body", "details": str(e)}), 400
+    params, err = parse_quiz_request(data)
+    if err:
+        return jsonify(err[0]), err[1]
+    return submit_response("quiz", build_quiz, **params)
+
+
+register_job_routes(app)
+
+
+def explain_prompt(question, correct):
+    return f"""
+You are an expert tutor. The question is:
+{question}
+The correct answer is: {correct}
+
+
+Give a concise and clear explanation for why this answer is correct, referencing the question and reasoning. Do not return any extra text or apologies.
+"""
+
+
+def offline_explanation(correct):
+    return (
+        f"The correct answer is '{correct}' because it best completes or matches the key "
+        f"fact referenced in the prompt. Look for contextual cues around the blank or "
+        f"the entity mentioned in the sentence to verify alignment with '{correct}'."
+    )
 
 
 @app.route("/explain-answer", methods=["POST"])
@@ -509,46 +656,169 @@ def explain_answer():
     correct = (data.get("correct_answer") or "").strip()
     if not question or not correct:
         return jsonify({"error": "question and correct_answer are required"}), 400
+    # explanations are cached by prompt; clients can ask for a fresh one
+    use_cache = not bool(data.get("no_cache", False))
     gemini_key = os.getenv("GEMINI_API_KEY", "").strip()
     online_ok = bool(gemini_key) and is_online()
     if online_ok:
-        prompt = f"""
-You are an expert tutor. The question is:
-{question}
-The correct answer is: {correct}
-
-
-Give a concise and clear explanation for why this answer is correct, referencing the question and reasoning. Do not return any extra text or apologies.
-"""
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
-        headers = {
-            "Content-Type": "application/json",
-            "x-goog-api-key": gemini_key
-        }
-        payload = {
-            "contents": [
-                {"parts": [{"text": prompt}]}
-            ]
-        }
-
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=40)
-            resp.raise_for_status()
-            data = resp.json()
-            candidates = data.get("candidates", [])
-            if candidates and candidates[0].get("content", {}).get("parts", []):
-                explanation = candidates[0]["content"]["parts"][0].get("text", "").strip()
-                if explanation:
-                    return jsonify({"explanation": explanation})
+            explanation = gemini_gateway.generate_text(explain_prompt(question, correct), api_key=gemini_key, timeout=40,
+                                                       max_attempts=1, label="explain",
+                                                       cache=use_cache,
+                                                       deadline=Deadline.for_task("explain")).strip()
+            if explanation:
+                return jsonify({"explanation": explanation})
         except Exception as err:
             logger.warning(f"Gemini explanation failed: {err}")
     # Fallback (or offline) explanation
-    explanation = (
-        f"The correct answer is '{correct}' because it best completes or matches the key "
-        f"fact referenced in the prompt. Look for contextual cues around the blank or "
-        f"the entity mentioned in the sentence to verify alignment with '{correct}'."
+    return jsonify({"explanation": offline_explanation(correct)})
+
+
+EXPLAIN_BATCH_SIZE = int(os.getenv("EXPLAIN_BATCH_SIZE", "10"))
+EXPLAIN_BATCH_MAX_ITEMS = 100
+
+
+def explain_batch_prompt(items):
+    listing = "\n".join(
+        f'{i}. Question: {q}\n   Correct answer: {a}' for i, (q, a) in enumerate(items, start=1)
     )
-    return jsonify({"explanation": explanation})
+    return f"""
+You are an expert tutor. For each numbered quiz question below, explain concisely and clearly why
+the given answer is correct, referencing the question and reasoning.
+
+{listing}
+
+Return ONLY a valid JSON array (no extra text), one object per question, in this exact shape:
+[{{"id": 1, "explanation": "..."}}, ...]
+""".strip()
+
+
+def parse_batch_explanations(raw, count):
+    """Map id (1-based) -> explanation from a batch reply; unparseable items are left out."""
+    raw = (raw or "").strip()
+    if raw.startswith("```"):
+        raw = raw.strip("`")
+        raw = raw[raw.find("["):] if "[" in raw else raw
+    start, end = raw.find("["), raw.rfind("]")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(raw[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    out = {}
+    for pos, entry in enumerate(data if isinstance(data, list) else [], start=1):
+        if isinstance(entry, str):
+            idx, text = pos, entry
+        elif isinstance(entry, dict):
+            try:
+                idx = int(entry.get("id", pos))
+            except (TypeError, ValueError):
+                idx = pos
+            text = entry.get("explanation")
+        else:
+            continue
+        if isinstance(text, str) and text.strip() and 1 <= idx <= count:
+            out[idx] = text.strip()
+    return out
+
+
+@app.route("/explain-answers", methods=["POST"])
+def explain_answers():
+    """Batch variant of /explain-answer for a whole quiz review.
+
+    Body: {"items": [{"question", "correct_answer"}, ...], "no_cache": false}
+    Returns {"explanations": {question: text}, "results": [{question, explanation, source}], "model_calls": n}.
+    Cached explanations are served first; the rest go to Gemini in chunks of
+    EXPLAIN_BATCH_SIZE with one structured (JSON) call per chunk. Items a chunk
+    reply does not cover are retried one by one while the time budget lasts,
+    then get the offline explanation. Every model answer is stored under the
+    same cache key /explain-answer uses.
+    """
+    try:
+        data = request.get_json(force=True)
+    except Exception as e:
+        return jsonify({"error": "Invalid JSON body", "details": str(e)}), 400
+    raw_items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(raw_items) > EXPLAIN_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"at most {EXPLAIN_BATCH_MAX_ITEMS} items per request"}), 400
+    items = {}
+    for item in raw_items:
+        question = (item.get("question") or "").strip() if isinstance(item, dict) else ""
+        correct = (item.get("correct_answer") or "").strip() if isinstance(item, dict) else ""
+        if not question or not correct:
+            return jsonify({"error": "every item needs question and correct_answer"}), 400
+        if items.setdefault(question, correct) != correct:
+            # explanations are keyed by question; one question cannot have two answers
+            return jsonify({"error": "conflicting correct_answer values for one question",
+                            "question": question}), 400
+    use_cache = not bool(data.get("no_cache", False))
+    gemini_key = os.getenv("GEMINI_API_KEY", "").strip()
+    online_ok = bool(gemini_key) and is_online()
+
+    explanations, sources = {}, {}
+    model_calls = 0
+    keys = {q: gemini_gateway.cache_key(explain_prompt(q, a)) for q, a in items.items()}
+    if use_cache:
+        # earlier answers stay useful even while Gemini is unreachable
+        for q in items:
+            hit = llm_cache.get(keys[q])
+            if hit:
+                explanations[q], sources[q] = hit.strip(), "cache"
+    if online_ok:
+        deadline = Deadline.for_task("explain_batch")
+        pending = [q for q in items if q not in explanations]
+        for start in range(0, len(pending), EXPLAIN_BATCH_SIZE):
+            chunk = pending[start:start + EXPLAIN_BATCH_SIZE]
+            pairs = [(q, items[q]) for q in chunk]
+            sent = gemini_gateway.requests_sent()
+            try:
+                raw = gemini_gateway.generate_text(explain_batch_prompt(pairs), api_key=gemini_key, timeout=60,
+                                                   max_attempts=2, label="explain-batch", cache=use_cache,
+                                                   generation_config={"responseMimeType": "application/json"},
+                                                   deadline=deadline)
+            except (DeadlineExceeded, gemini_gateway.CircuitOpenError) as err:
+                logger.warning(f"Batch explanation stopped: {err}")
+                break
+            except Exception as err:
+                logger.warning(f"Batch explanation chunk failed: {err}")
+                continue
+            finally:
+                # cached or coalesced replies are not model calls
+                if gemini_gateway.requests_sent() > sent:
+                    model_calls += 1
+            for idx, text in parse_batch_explanations(raw, len(chunk)).items():
+                q = chunk[idx - 1]
+                explanations[q], sources[q] = text, "batch"
+                llm_cache.set(keys[q], text)
+        # per-item fallback for anything the batch replies did not cover
+        for q in [q for q in items if q not in explanations]:
+            sent = gemini_gateway.requests_sent()
+            try:
+                text = gemini_gateway.generate_text(explain_prompt(q, items[q]), api_key=gemini_key, timeout=40,
+                                                    max_attempts=1, label="explain", cache=use_cache,
+                                                    deadline=deadline).strip()
+            except (DeadlineExceeded, gemini_gateway.CircuitOpenError) as err:
+                logger.warning(f"Per-item explanation fallback stopped: {err}")
+                break
+            except Exception as err:
+                logger.warning(f"Gemini explanation failed: {err}")
+                continue
+            finally:
+                if gemini_gateway.requests_sent() > sent:
+                    model_calls += 1
+            if text:
+                explanations[q], sources[q] = text, "single"
+    for q, a in items.items():
+        if q not in explanations:
+            explanations[q], sources[q] = offline_explanation(a), "offline"
+    results = []
+    for item in raw_items:
+        q = item["question"].strip()
+        results.append({"question": q, "explanation": explanations[q], "source": sources[q]})
+    return jsonify({"explanations": explanations, "results": results, "model_calls": model_calls})
 
 
 if __name__ == "__main__":
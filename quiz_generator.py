@@ -1,126 +1,207 @@
 import re
 import json
 import random
-import unicodedata
-from collections import Counter, defaultdict
-from typing import List, Dict
+from collections import Counter
+from itertools import zip_longest
+from functools import cached_property
+from typing import List, Dict, Optional
 
 # Offline NLP imports (ensure these packages installed in environment)
 import fitz  # PyMuPDF (only if server-side PDF parsing desired)
-import nltk
 import logging
-from nltk.corpus import wordnet as wn
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+from utils.wordnet_table import related_terms
+from utils.distractors import DistractorEngine
+from utils.textclean import clean_text
+from utils.nltk_resources import available as nltk_available, load_nltk, verify as verify_nltk_data
+
 # Optional online fallback (OpenAI) - keep safe
 try:
     import openai
 except Exception:
     openai = None
 
-# Try to download common NLTK resources if available; failures won't break the server.
-for res in ("punkt", "averaged_perceptron_tagger", "wordnet", "stopwords"):
-    try:
-        nltk.download(res, quiet=True)
-    except Exception:
-        logging.getLogger(__name__).warning("Could not download NLTK resource: %s", res)
+# NLTK data comes from a prepared directory (python -m utils.nltk_resources prepare).
+# This only stats files; nltk itself is imported on first use.
+verify_nltk_data()
 
 # Safe tokenizer/tagger wrappers: try NLTK, fall back to lightweight regex-based versions
+# (resources missing from this host skip straight to the fallback)
 def safe_sent_tokenize(text: str) -> List[str]:
-    try:
-        return nltk.sent_tokenize(text)
-    except Exception:
-        # Fallback: split on sentence-ending punctuation (basic, but robust)
-        sents = re.split(r'(?<=[\.\!?])\s+', (text or "").strip())
-        return [s.strip() for s in sents if s and s.strip()]
+    if nltk_available("punkt_tab"):
+        try:
+            return load_nltk().sent_tokenize(text)
+        except Exception:
+            pass
+    # Fallback: split on sentence-ending punctuation (basic, but robust)
+    sents = re.split(r'(?<=[\.\!?])\s+', (text or "").strip())
+    return [s.strip() for s in sents if s and s.strip()]
 
 
 def safe_word_tokenize(text: str) -> List[str]:
-    try:
-        return nltk.word_tokenize(text)
-    except Exception:
-        # Fallback: capture words (incl. contractions)
-        return re.findall(r"\b\w+(?:'\w+)?\b", text or "")
+    if nltk_available("punkt_tab"):
+        try:
+            return load_nltk().word_tokenize(text)
+        except Exception:
+            pass
+    # Fallback: capture words (incl. contractions)
+    return re.findall(r"\b\w+(?:'\w+)?\b", text or "")
 
 
 def safe_pos_tag(tokens: List[str]) -> List[tuple]:
+    if nltk_available("averaged_perceptron_tagger_eng"):
+        try:
+            return load_nltk().pos_tag(tokens)
+        except Exception:
+            pass
+    # Fallback: naive tagging (assume nouns) so downstream code still runs
+    return [(t, 'NN') for t in tokens]
+
+
+def safe_word_tokenize_sents(sentences: List[str]) -> List[List[str]]:
+    """Tokenize already-split sentences (no second sentence split inside NLTK;
+    the Treebank tokenizer needs no data). NLTK is tried once; on failure every
+    sentence uses the regex."""
     try:
-        return nltk.pos_tag(tokens)
+        word_tokenize = load_nltk().word_tokenize
+        return [word_tokenize(s, preserve_line=True) for s in sentences]
     except Exception:
-        # Fallback: naive tagging (assume nouns) so downstream code still runs
-        return [(t, 'NN') for t in tokens]
+        return [re.findall(r"\b\w+(?:'\w+)?\b", s) for s in sentences]
+
+
+def safe_pos_tag_sents(token_lists: List[List[str]]) -> List[List[tuple]]:
+    if nltk_available("averaged_perceptron_tagger_eng"):
+        try:
+            return load_nltk().pos_tag_sents(token_lists)
+        except Exception:
+            pass
+    return [[(t, 'NN') for t in tokens] for tokens in token_lists]
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class AnnotatedDocument:
+    """Sentences, tokens and POS tags of a text, each computed once.
+
+    The offline generator's stages (chunking, TF-IDF ranking, keyword
+    extraction, answer selection) all read from one instance instead of
+    re-splitting and re-tagging overlapping slices of the same text.
+    Tokens and tags are computed on first use.
+
+    `index` maps each lowercase word to the sentences containing it, and
+    `word_spans` records where it occurs in each sentence. "Which sentence
+    mentions this keyword" and "blank it out" then become dictionary
+    lookups instead of a regex compiled and run per keyword.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.sentences = [s.strip() for s in safe_sent_tokenize(text)]
+        self.word_counts = [len(s.split()) for s in self.sentences]
+
+    @cached_property
+    def tokens(self) -> List[List[str]]:
+        return safe_word_tokenize_sents(self.sentences)
+
+    @cached_property
+    def tags(self) -> List[List[tuple]]:
+        return safe_pos_tag_sents(self.tokens)
+
+    @cached_property
+    def word_spans(self) -> List[Dict[str, List[tuple]]]:
+        """Per sentence: lowercase word -> (start, end) of each occurrence."""
+        spans = []
+        for sent in self.sentences:
+            found = {}
+            for m in _WORD_RE.finditer(sent):
+                found.setdefault(m.group().lower(), []).append(m.span())
+            spans.append(found)
+        return spans
+
+    @cached_property
+    def index(self) -> Dict[str, List[int]]:
+        """Lowercase word -> ids of the sentences containing it, in document order."""
+        index = {}
+        for i, found in enumerate(self.word_spans):
+            for word in found:
+                index.setdefault(word, []).append(i)
+        return index
+
+    def sentences_with(self, word: str) -> List[int]:
+        return self.index.get(word.lower(), [])
+
+    def mask(self, i: int, word: str, blank="_____") -> Optional[str]:
+        """Sentence i with the first whole-word, case-insensitive occurrence of
+        `word` blanked, or None when it does not occur."""
+        sent = self.sentences[i]
+        if not _WORD_RE.fullmatch(word):
+            # "3.5", "1,000": not a single word token, match it the slow way
+            pattern = re.compile(r"\b" + re.escape(word) + r"\b", flags=re.IGNORECASE)
+            masked, n = pattern.subn(blank, sent, count=1)
+            return masked if n else None
+        spans = self.word_spans[i].get(word.lower())
+        if not spans:
+            return None
+        start, end = spans[0]
+        return sent[:start] + blank + sent[end:]
+
+    def chunks(self, max_words=300) -> List[List[int]]:
+        """Consecutive sentence ids grouped into chunks of about max_words words."""
+        chunks = []
+        cur = []
+        cur_words = 0
+        for i, w in enumerate(self.word_counts):
+            if cur_words + w > max_words and cur:
+                chunks.append(cur)
+                cur = [i]
+                cur_words = w
+            else:
+                cur.append(i)
+                cur_words += w
+        if cur:
+            chunks.append(cur)
+        return chunks
+
+    def chunk_text(self, sentence_ids: List[int]) -> str:
+        return " ".join(self.sentences[i] for i in sentence_ids)
+
+    def candidate_keywords(self, topn=40) -> List[str]:
+        nouns = [w for tags in self.tags for w, t in tags if w.isalpha() and t.startswith("NN") and len(w) > 3]
+        freq = Counter([w.lower() for w in nouns])
+        return [w for w, _ in freq.most_common(topn)]
 
 RANDOM_SEED = 42
 random.seed(RANDOM_SEED)
 
 
 def clean_input_text(raw_text: str) -> str:
-    txt = unicodedata.normalize("NFKC", raw_text or "")
-    lines = [ln.strip() for ln in txt.splitlines() if ln.strip()]
-    lines = [ln for ln in lines if len(ln.split()) > 2]
-    junk_patterns = [
-        r"^\s*page\s*\d+\b",
-        r"^\s*\d+\s*$",
-        r"^\s*figure\s*\d+",
-        r"^\s*fig\.\s*\d+",
-        r"copyright\b",
-        r"doi:",
-        r"http[s]?:\/\/",
-    ]
-    filtered = []
-    for ln in lines:
-        low = ln.lower()
-        if any(re.search(p, low) for p in junk_patterns):
-            continue
-        filtered.append(ln)
-    counts = Counter(filtered)
-    cleaned = [ln for ln in filtered if counts[ln] < max(3, len(filtered)//30)]
-    out = " ".join(cleaned)
-    out = re.sub(r"\s+", " ", out).strip()
+    # one pass, precompiled patterns; utils.textclean.TextCleaner streams the same rules
+    out = clean_text(raw_text)
     return out if out else raw_text
 
 
-def chunk_text(text: str, max_words=300) -> List[str]:
-    sents = nltk.sent_tokenize(text)
-    chunks = []
-    cur = []
-    cur_words = 0
-    for s in sents:
-        w = len(s.split())
-        if cur_words + w > max_words and cur:
-            chunks.append(" ".join(cur))
-            cur = [s]
-            cur_words = w
-        else:
-            cur.append(s)
-            cur_words += w
-    if cur:
-        chunks.append(" ".join(cur))
-    return chunks
-
-
-def extract_candidate_keywords(text: str, topn=40) -> List[str]:
-    tokens = [w for w in nltk.word_tokenize(text) if w.isalpha()]
-    tags = nltk.pos_tag(tokens)
-    nouns = [w for w,t in tags if t.startswith("NN") and len(w)>3]
-    freq = Counter([w.lower() for w in nouns])
-    return [w for w,_ in freq.most_common(topn)]
+def chunk_text(text, max_words=300) -> List[str]:
+    doc = text if isinstance(text, AnnotatedDocument) else AnnotatedDocument(text)
+    return [doc.chunk_text(ids) for ids in doc.chunks(max_words)]
+
+
+def extract_candidate_keywords(text, topn=40) -> List[str]:
+    doc = text if isinstance(text, AnnotatedDocument) else AnnotatedDocument(text)
+    return doc.candidate_keywords(topn)
 
 
 def get_wordnet_distractors(word: str, k=3) -> List[str]:
-    distractors = set()
-    try:
-        synsets = wn.synsets(word)
-        for syn in synsets:
-            for lemma in syn.lemmas():
-                candidate = lemma.name().replace("_", " ")
-                if candidate.lower() != word.lower() and candidate.isalpha():
-                    distractors.add(candidate)
-                if len(distractors) >= k:
-                    return list(distractors)[:k]
-    except Exception:
-        pass
-    return list(distractors)[:k]
+    """Up to k single-word WordNet neighbours of `word`, from the precomputed
+    table (utils/wordnet_table.py) rather than a synset walk per question."""
+    distractors = []
+    for candidate in related_terms(word):
+        if candidate.lower() != word.lower() and candidate.isalpha() and candidate not in distractors:
+            distractors.append(candidate)
+            if len(distractors) >= k:
+                break
+    return distractors
 
 
 def safe_sample(pool: List[str], k: int) -> List[str]:
@@ -135,103 +216,121 @@ def safe_sample(pool: List[str], k: int) -> List[str]:
     return res[:k]
 
 
-def generate_offline_quiz(text: str, amount: int = 10, difficulty: str = "medium") -> List[Dict]:
+def generate_offline_quiz(text: str, amount: int = 10, difficulty: str = "medium", spread: bool = False) -> List[Dict]:
     text = clean_input_text(text)
     if not text or not text.strip():
         return []
-    chunks = chunk_text(text, max_words=300) or [text]
+    # sentence split, tokenization and tagging happen once, here
+    doc = AnnotatedDocument(text)
+    chunk_ids = doc.chunks(max_words=300)
+    if not chunk_ids:
+        return []
+    chunks = [doc.chunk_text(ids) for ids in chunk_ids]
     try:
         vectorizer = TfidfVectorizer(stop_words="english")
         tfidf = vectorizer.fit_transform(chunks)
         scores = tfidf.sum(axis=1).A1
-        ranked = [c for _,c in sorted(zip(scores, chunks), key=lambda x: x[0], reverse=True)]
+        ranked = [ids for _, ids in sorted(zip(scores, chunk_ids), key=lambda x: x[0], reverse=True)]
     except Exception:
-        ranked = chunks
-    cand_keywords = extract_candidate_keywords(text, topn=200)
-    pos_pools = defaultdict(list)
-    tokens = nltk.word_tokenize(text)
-    tags = nltk.pos_tag(tokens)
-    for w,t in tags:
-        if not w.isalpha(): continue
-        key = t[:2]
-        pos_pools[key].append(w)
+        ranked = chunk_ids
+    cand_keywords = doc.candidate_keywords(topn=200)
     questions = []
     used_sentences = set()
-    for chunk in ranked:
+    if spread:
+        # round-robin over the ranked chunks (first sentence of each, then the second, ...)
+        # so a large pool covers the whole document instead of its densest chunks
+        order = [i for group in zip_longest(*ranked) for i in group if i is not None]
+    else:
+        order = [i for ids in ranked for i in ids]
+    for i in order:
         if len(questions) >= amount:
             break
-        sents = nltk.sent_tokenize(chunk)
-        sents = [s.strip() for s in sents if len(s.split()) >= 6]
-        for sent in sents:
-            if len(questions) >= amount:
+        if doc.word_counts[i] < 6:
+            continue
+        sent = doc.sentences[i]
+        if sent in used_sentences:
+            continue
+        used_sentences.add(sent)
+        tags_sent = doc.tags[i]
+        candidate = None
+        for w,t in tags_sent:
+            if t.startswith("NNP") and w.isalpha() and len(w)>2:
+                candidate = w
                 break
-            if sent in used_sentences:
-                continue
-            used_sentences.add(sent)
-            tags_sent = nltk.pos_tag(nltk.word_tokenize(sent))
-            candidate = None
+        if not candidate:
+            for w,t in tags_sent:
+                if t.startswith("NN") and w.isalpha() and len(w)>3:
+                    candidate = w
+                    break
+        if not candidate:
             for w,t in tags_sent:
-                if t.startswith("NNP") and w.isalpha() and len(w)>2:
+                if t.startswith("CD"):
                     candidate = w
                     break
-            if not candidate:
-                for w,t in tags_sent:
-                    if t.startswith("NN") and w.isalpha() and len(w)>3:
-                        candidate = w
-                        break
-            if not candidate:
-                for w,t in tags_sent:
-                    if t.startswith("CD"):
-                        candidate = w
-                        break
-            if not candidate:
-                for kw in cand_keywords:
-                    if re.search(r"\b" + re.escape(kw) + r"\b", sent, flags=re.IGNORECASE):
-                        candidate = kw
-                        break
-            if not candidate:
-                continue
-            pattern = re.compile(r"\b" + re.escape(candidate) + r"\b", flags=re.IGNORECASE)
-            question_text = pattern.sub("_____", sent, count=1)
-            distractors = get_wordnet_distractors(candidate, k=3)
-            if len(distractors) < 3:
-                same_type_pool = [k for k in cand_keywords if k.lower() != candidate.lower()]
-                distractors += safe_sample(same_type_pool, 3 - len(distractors))
-            distractors = [d for d in distractors if d and d.lower() != candidate.lower()]
-            distractors = safe_sample(distractors, 3)
-            options = distractors + [candidate]
-            random.shuffle(options)
-            questions.append({
-                "question": question_text,
-                "options": options,
-                "answer": candidate,
-                "difficulty": difficulty,
-                "context": sent[:320]
-            })
+        if not candidate:
+            words = doc.word_spans[i]
+            candidate = next((kw for kw in cand_keywords if kw in words), None)
+        if not candidate:
+            continue
+        question_text = doc.mask(i, candidate)
+        if question_text is None:
+            continue
+        questions.append({
+            "question": question_text,
+            "options": [],
+            "answer": candidate,
+            "difficulty": difficulty,
+            "context": sent[:320]
+        })
     idx = 0
     while len(questions) < amount and idx < len(cand_keywords):
         kw = cand_keywords[idx]
         idx += 1
-        m = re.search(r"([^.?!]*\b" + re.escape(kw) + r"\b[^.?!]*)[.?!]", text, flags=re.IGNORECASE)
-        if not m:
+        ids = doc.sentences_with(kw)
+        if not ids:
             continue
-        sent = m.group(1)
-        pattern = re.compile(r"\b" + re.escape(kw) + r"\b", flags=re.IGNORECASE)
-        qtxt = pattern.sub("_____", sent, count=1)
-        distractors = get_wordnet_distractors(kw, k=3)
-        if len(distractors) < 3:
-            distractors += safe_sample([k for k in cand_keywords if k.lower() != kw.lower()], 3 - len(distractors))
-        distractors = safe_sample(distractors, 3)
-        options = distractors + [kw]
-        random.shuffle(options)
+        # prefer a sentence no earlier question was built from
+        i = next((j for j in ids if doc.sentences[j] not in used_sentences), ids[0])
+        sent = doc.sentences[i]
+        used_sentences.add(sent)
+        qtxt = doc.mask(i, kw)
         questions.append({
             "question": qtxt,
-            "options": options,
+            "options": [],
             "answer": kw,
             "difficulty": difficulty,
             "context": sent[:320]
         })
-    return questions[:amount]
+    questions = questions[:amount]
+    add_options(questions, doc, cand_keywords)
+    return questions
+
+
+def add_options(questions: List[Dict], doc: AnnotatedDocument, cand_keywords: List[str], k=3) -> None:
+    """Give every question k distractors plus its answer, shuffled. Distractors
+    come from the document first (DistractorEngine: all answers in one sparse
+    product), then WordNet, then the keyword pool."""
+    if not questions:
+        return
+    answers = [q["answer"] for q in questions]
+    try:
+        neighbours = DistractorEngine.from_document(doc).nearest(answers, k=k, candidates=cand_keywords)
+    except Exception as e:
+        logging.getLogger(__name__).warning("Document distractors failed: %s", e)
+        neighbours = [[] for _ in answers]
+    for q, near in zip(questions, neighbours):
+        answer = q["answer"]
+        distractors = []
+        for d in near + get_wordnet_distractors(answer, k=k):
+            if d.lower() != answer.lower() and d.lower() not in {x.lower() for x in distractors}:
+                distractors.append(d)
+        distractors = distractors[:k]
+        if len(distractors) < k:
+            taken = {x.lower() for x in distractors} | {answer.lower()}
+            distractors += safe_sample([kw for kw in cand_keywords if kw.lower() not in taken], k - len(distractors))
+        options = distractors + [answer]
+        random.shuffle(options)
+        q["options"] = options
 
 
 # Optional online/OpenAI functions kept as-is (not changed)
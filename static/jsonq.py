@@ -16,6 +16,7 @@ Pipeline:
 import re
 import unicodedata
 import random
+from functools import lru_cache
 from collections import Counter
 
 # Optional PDF reader
@@ -24,15 +25,50 @@ try:
 except Exception:
     fitz = None
 
-# Optional NLP libs
+# Optional shared extractor: drops headers/footers by block position (utils/layout.py)
 try:
-    import nltk
-    from nltk.corpus import wordnet as wn
-    HAVE_NLTK = True
+    from utils.extractors import extract_pdf
 except Exception:
-    nltk = None
-    wn = None
-    HAVE_NLTK = False
+    extract_pdf = None
+
+# Optional shared line cleaner (utils/textclean.py): same rules, one pass, precompiled patterns
+try:
+    from utils.textclean import clean_pages
+except Exception:
+    clean_pages = None
+
+# Optional precomputed WordNet table (utils/wordnet_table.py): no corpus load, memoized
+try:
+    from utils.wordnet_table import related_terms
+except Exception:
+    related_terms = None
+
+# Optional document-local distractors (utils/distractors.py): one sparse product per quiz
+try:
+    from utils.distractors import DistractorEngine
+except Exception:
+    DistractorEngine = None
+
+# Optional NLP libs: nltk is imported on first use, and only for resources this
+# host has (prepared data dir, data/nltk_data; no downloads)
+try:
+    from utils.nltk_resources import available as nltk_available, load_nltk
+except ImportError:
+    nltk_available = None
+
+    def load_nltk():
+        import nltk
+        return nltk
+
+
+def get_nltk(*resources):
+    """The nltk module when `resources` are installed, else None."""
+    if nltk_available is not None and not all(nltk_available(r) for r in resources):
+        return None
+    try:
+        return load_nltk()
+    except Exception:
+        return None
 
 # Optional TF-IDF ranking
 try:
@@ -52,6 +88,16 @@ def simple_sent_tokenize(text):
 def simple_word_tokenize(text):
     return _word_splitter_re.findall(text.lower())
 
+_word_span_re = re.compile(r"\w+")
+
+def word_spans(text):
+    """Lowercase word -> [(start, end), ...] of its whole-word occurrences, in one scan.
+    Keyword presence, repeat count and blanking become lookups instead of a regex per keyword."""
+    spans = {}
+    for m in _word_span_re.finditer(text):
+        spans.setdefault(m.group().lower(), []).append(m.span())
+    return spans
+
 # Basic stopwords fallback
 FALLBACK_STOPWORDS = {
     "the","and","for","that","with","this","from","which","when","are","were",
@@ -59,16 +105,15 @@ FALLBACK_STOPWORDS = {
     "into","about","between","other","such","a","an","in","on","at","by","of","to","is","it","its","this","these","those"
 }
 
+@lru_cache(maxsize=None)
 def get_stopwords():
-    if HAVE_NLTK:
+    nltk = get_nltk("stopwords")
+    if nltk is not None:
         try:
-            from nltk.corpus import stopwords
-            return set(stopwords.words("english"))
+            return frozenset(nltk.corpus.stopwords.words("english"))
         except Exception:
             pass
-    return FALLBACK_STOPWORDS
-
-STOPWORDS = get_stopwords()
+    return frozenset(FALLBACK_STOPWORDS)
 
 # Remove emojis & bullets & weird characters
 _EMOJI_RE = re.compile(
@@ -171,11 +216,17 @@ def looks_like_header_token(line):
             return True
     return False
 
-def clean_and_merge_pages(raw_text):
+def clean_and_merge_pages(raw_text, layout_cleaned=False):
+    """Merge pages into one cleaned string. With layout_cleaned=True the text
+    comes from the shared extractor, which already removed headers, footers
+    and page numbers geometrically, so the line-frequency and header regexes
+    (which also eat real content) are skipped."""
     segments = split_into_segments(raw_text, seg_chars=3500)
     if not segments:
         return ""
-    repeated = detect_repeated_lines(segments, threshold_frac=0.30)
+    if clean_pages is not None:
+        return clean_pages(segments, layout_cleaned=layout_cleaned)
+    repeated = set() if layout_cleaned else detect_repeated_lines(segments, threshold_frac=0.30)
     kept = []
     for seg in segments:
         lines = extract_lines_from_segment(seg)
@@ -185,11 +236,11 @@ def clean_and_merge_pages(raw_text):
                 continue
             if line in repeated:
                 continue
-            if looks_like_page_number(line):
+            if not layout_cleaned and looks_like_page_number(line):
                 continue
             if looks_like_toc_or_range(line):
                 continue
-            if looks_like_header_token(line):
+            if not layout_cleaned and looks_like_header_token(line):
                 continue
             # drop very short lines
             if len(simple_word_tokenize(line)) <= 3:
@@ -202,7 +253,8 @@ def clean_and_merge_pages(raw_text):
 
 # ---------------- chunking and ranking ----------------
 def chunk_text(text, chunk_size_words=300):
-    if HAVE_NLTK:
+    nltk = get_nltk("punkt_tab")
+    if nltk is not None:
         try:
             sents = nltk.sent_tokenize(text)
         except Exception:
@@ -236,16 +288,18 @@ def rank_chunks(chunks):
             pass
     # fallback ranking: length & keyword density
     scored = []
+    stopwords = get_stopwords()
     for c in chunks:
         words = simple_word_tokenize(c)
-        kw_count = sum(1 for w in words if w not in STOPWORDS and len(w) > 3)
+        kw_count = sum(1 for w in words if w not in stopwords and len(w) > 3)
         scored.append((len(words) + kw_count * 2, c))
     scored.sort(reverse=True)
     return [c for _, c in scored]
 
 # ---------------- keyword extraction ----------------
 def extract_keywords_for_chunk(chunk, topn=12):
-    if HAVE_NLTK:
+    nltk = get_nltk("punkt_tab", "averaged_perceptron_tagger_eng")
+    if nltk is not None:
         try:
             tokens = [w for w in nltk.word_tokenize(chunk) if w.isalpha()]
             tags = nltk.pos_tag(tokens)
@@ -255,7 +309,8 @@ def extract_keywords_for_chunk(chunk, topn=12):
         except Exception:
             pass
     words = simple_word_tokenize(chunk)
-    candidates = [w for w in words if w not in STOPWORDS and len(w) > 3]
+    stopwords = get_stopwords()
+    candidates = [w for w in words if w not in stopwords and len(w) > 3]
     freq = Counter(candidates)
     return [w for w, _ in freq.most_common(topn)]
 
@@ -270,9 +325,15 @@ def _simple_singular(word):
 
 def get_distractors(correct_word, pool_keywords, k=3):
     distractors = []
-    if wn is not None:
+    if related_terms is not None:
+        for w in related_terms(correct_word):
+            if w.lower() != correct_word.lower() and w not in distractors:
+                distractors.append(w)
+            if len(distractors) >= k:
+                return distractors[:k]
+    elif get_nltk("wordnet") is not None:
         try:
-            synsets = wn.synsets(correct_word)
+            synsets = get_nltk("wordnet").corpus.wordnet.synsets(correct_word)
             for syn in synsets:
                 for lemma in syn.lemmas():
                     w = lemma.name().replace('_', ' ')
@@ -307,8 +368,9 @@ def get_distractors(correct_word, pool_keywords, k=3):
     return chosen[:k]
 
 # ---------------- generate question from chunk ----------------
-def build_question_from_chunk(chunk, pool_keywords, difficulty="medium"):
-    if HAVE_NLTK:
+def build_question_from_chunk(chunk, pool_keywords, difficulty="medium", with_options=True):
+    nltk = get_nltk("punkt_tab")
+    if nltk is not None:
         try:
             sents = nltk.sent_tokenize(chunk)
         except Exception:
@@ -339,76 +401,39 @@ def build_question_from_chunk(chunk, pool_keywords, difficulty="medium"):
 
         # extract candidate keywords for the sentence
         keywords = extract_keywords_for_chunk(s_clean, topn=6)
+        positions = word_spans(s_clean)
         # fallback pick long words not stopwords
         if not keywords:
             words = simple_word_tokenize(s_clean)
-            words = [w for w in words if w not in STOPWORDS and len(w) > 4]
+            words = [w for w in words if w not in get_stopwords() and len(w) > 4]
             if words:
                 keywords = [max(words, key=len)]
 
         for kw in keywords:
-            # ensure keyword is present as a whole word
-            if not re.search(r'\b' + re.escape(kw) + r'\b', s_clean, flags=re.I):
+            # ensure keyword is present as a whole word (keywords are single word tokens)
+            spans = positions.get(kw.lower())
+            if not spans:
                 continue
             # avoid numbers or weird tokens
-            if re.search(r'\d', kw):
+            if any(ch.isdigit() for ch in kw):
+                continue
+            # avoid when the answer would still appear in the qtext due to capitalization variation
+            if len(spans) > 1:
                 continue
-            # avoid when answer is already adjacent to punctuation giving away the answer
-            # e.g., "Application Layer •" or headings
-            # if keyword occurs in the very first 4 tokens and there's punctuation next, prefer different sentence
-            tokpos = [i for i,t in enumerate(re.findall(r'\b\w+\b', s_clean)) if t.lower() == kw.lower()]
-            if tokpos and tokpos[0] < 4:
-                # check if sentence includes punctuation right after keyword or is header-like
-                # prefer to reframe: take clause after ':' or '•' processed earlier
-                pass
 
             # form cloze: replace the whole word case-insensitively
-            pattern = re.compile(r'\b' + re.escape(kw) + r'\b', flags=re.IGNORECASE)
-            qtext = pattern.sub('______', s_clean, count=1)
+            start, end = spans[0]
+            qtext = s_clean[:start] + '______' + s_clean[end:]
 
             # post-check: remove any stray emoji or bullets in qtext
             qtext = strip_noise_chars(qtext)
             if len(simple_word_tokenize(qtext)) < 4:
                 continue
 
-            # avoid when the answer still appears in the qtext due to capitalization variation
-            if re.search(r'\b' + re.escape(kw) + r'\b', qtext, flags=re.IGNORECASE):
-                continue
-
-            # create distractors
-            distractors = get_distractors(kw, pool_keywords, k=3)
-            options = [kw] + distractors
-            # ensure 4 options and uniqueness
-            opts = []
-            for o in options:
-                o_clean = o.strip()
-                if not o_clean:
-                    continue
-                if o_clean.lower() == kw.lower():
-                    opts.insert(0, o_clean)
-                else:
-                    if o_clean not in opts:
-                        opts.append(o_clean)
-            # pad with pool_keywords if needed
-            for g in pool_keywords:
-                if len(opts) >= 4:
-                    break
-                if g.lower() != kw.lower() and g not in opts and len(g) > 2:
-                    opts.append(g)
-            # final fallback fill
-            fallback_fill = ["Option A", "Option B", "Option C", "Option D"]
-            i = 0
-            while len(opts) < 4 and i < len(fallback_fill):
-                if fallback_fill[i] not in opts:
-                    opts.append(fallback_fill[i])
-                i += 1
-
-            # shuffle options but keep answer present
-            random.shuffle(opts)
-            # ensure answer exists (match case-insensitive) — pick canonical answer as kw
+            # options are filled later, for the whole quiz at once, when with_options is False
             return {
                 "question": qtext,
-                "options": opts,
+                "options": build_options(kw, pool_keywords) if with_options else [],
                 "answer": kw,
                 "difficulty": difficulty,
                 "category": "General"
@@ -416,10 +441,65 @@ def build_question_from_chunk(chunk, pool_keywords, difficulty="medium"):
 
     return None
 
+def build_options(kw, pool_keywords, near=()):
+    """Answer plus 3 distractors, shuffled: document neighbours (`near`) first,
+    then WordNet / keyword pool via get_distractors."""
+    distractors = list(near) + get_distractors(kw, pool_keywords, k=3)
+    options = [kw] + distractors
+    # ensure 4 options and uniqueness
+    opts = []
+    for o in options:
+        o_clean = o.strip()
+        if not o_clean:
+            continue
+        if o_clean.lower() == kw.lower():
+            if o_clean.lower() not in (x.lower() for x in opts):
+                opts.insert(0, o_clean)
+        else:
+            if o_clean.lower() not in (x.lower() for x in opts):
+                opts.append(o_clean)
+        if len(opts) >= 4:
+            break
+    # pad with pool_keywords if needed
+    for g in pool_keywords:
+        if len(opts) >= 4:
+            break
+        if g.lower() != kw.lower() and g not in opts and len(g) > 2:
+            opts.append(g)
+    # final fallback fill
+    fallback_fill = ["Option A", "Option B", "Option C", "Option D"]
+    i = 0
+    while len(opts) < 4 and i < len(fallback_fill):
+        if fallback_fill[i] not in opts:
+            opts.append(fallback_fill[i])
+        i += 1
+
+    # shuffle options but keep answer present
+    random.shuffle(opts)
+    return opts
+
+def fill_document_options(quiz, merged, pool_keywords):
+    """Options for questions built with with_options=False. Every answer's
+    document neighbours come from one DistractorEngine.nearest call."""
+    pending = [q for q in quiz if not q["options"]]
+    if not pending:
+        return
+    neighbours = [[] for _ in pending]
+    if DistractorEngine is not None:
+        try:
+            sents = simple_sent_tokenize(merged)
+            engine = DistractorEngine([simple_word_tokenize(s) for s in sents], stopwords=get_stopwords())
+            neighbours = engine.nearest([q["answer"] for q in pending], k=3)
+        except Exception:
+            pass
+    for q, near in zip(pending, neighbours):
+        q["options"] = build_options(q["answer"], pool_keywords, near)
+
 # ---------------- main API ----------------
-def build_quiz_from_text(raw_text: str, num_questions: int = 15, difficulty: str = "medium", category: str = None):
+def build_quiz_from_text(raw_text: str, num_questions: int = 15, difficulty: str = "medium", category: str = None,
+                         layout_cleaned: bool = False):
     # 1) Clean document and remove headers/footers using segmentation
-    merged = clean_and_merge_pages(raw_text)
+    merged = clean_and_merge_pages(raw_text, layout_cleaned=layout_cleaned)
     if not merged or len(merged) < 40:
         # fallback: simple sentence-based generator
         sentences = [s.strip() for s in re.split(r'[.?!]\s', raw_text) if len(s.strip()) > 20]
@@ -474,7 +554,7 @@ def build_quiz_from_text(raw_text: str, num_questions: int = 15, difficulty: str
     # 5) generate questions from selected chunks
     for idx in indices:
         chunk = ranked[idx]
-        q = build_question_from_chunk(chunk, pool_keywords, difficulty=difficulty)
+        q = build_question_from_chunk(chunk, pool_keywords, difficulty=difficulty, with_options=False)
         if q:
             if category:
                 q["category"] = category
@@ -485,7 +565,7 @@ def build_quiz_from_text(raw_text: str, num_questions: int = 15, difficulty: str
     # 6) if still short, attempt remaining chunks
     if len(quiz) < num_questions:
         for chunk in ranked:
-            q = build_question_from_chunk(chunk, pool_keywords, difficulty=difficulty)
+            q = build_question_from_chunk(chunk, pool_keywords, difficulty=difficulty, with_options=False)
             if q:
                 if category:
                     q["category"] = category
@@ -495,6 +575,8 @@ def build_quiz_from_text(raw_text: str, num_questions: int = 15, difficulty: str
             if len(quiz) >= num_questions:
                 break
 
+    fill_document_options(quiz, merged, pool_keywords)
+
     # 7) final fallback ensure we return as many as requested
     if len(quiz) < num_questions:
         sentences = [s.strip() for s in re.split(r'[.?!]\s', merged) if len(s.strip()) > 20]
@@ -513,6 +595,11 @@ def build_quiz_from_text(raw_text: str, num_questions: int = 15, difficulty: str
 
 # compatibility: if user passes a pdf path
 def build_quiz(pdf_name: str, num_questions: int = 15, difficulty: str = "medium", category: str = None):
+    if extract_pdf is not None:
+        pages = extract_pdf(pdf_name)["pages"]
+        merged = "\f".join(p["text"] for p in pages)
+        return build_quiz_from_text(merged, num_questions=num_questions, difficulty=difficulty, category=category,
+                                    layout_cleaned=True)
     if fitz is None:
         raise RuntimeError("PyMuPDF is not installed.")
     pages = []
@@ -10,6 +10,17 @@ function logout() {
   window.location.href = "home.html";
 }
 
+// Anonymous id sent with /generate-quiz so the server's question bank can skip
+// questions this browser has already been served (logged-in users are tracked by session)
+function quizClientId() {
+  let id = localStorage.getItem('quizClientId');
+  if (!id) {
+    id = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    localStorage.setItem('quizClientId', id);
+  }
+  return id;
+}
+
 const quizTypeSelection = document.getElementById("quiz-type-selection");
 const normalQuizSetup = document.getElementById("normal-quiz-setup");
 const pdfQuizSetup = document.getElementById("pdf-quiz-setup");
@@ -410,7 +421,7 @@ startPdfQuizBtn.onclick = async () => {
           const options = {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ text: fullText, amount: amount, difficulty: difficulty })
+            body: JSON.stringify({ text: fullText, amount: amount, difficulty: difficulty, client_id: quizClientId() })
           };
           const validator = (res, data) => {
             if (!data) return false;
@@ -473,7 +484,7 @@ startPdfQuizBtn.onclick = async () => {
               const options = {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ text: fullText, amount: amount, difficulty: difficulty })
+                body: JSON.stringify({ text: fullText, amount: amount, difficulty: difficulty, client_id: quizClientId() })
               };
               const validator = (res, data) => {
                 if (!data) return false;
@@ -531,7 +542,7 @@ async function questionGenerator(text, difficulty, amount) {
       const res = await fetch(`${BACKEND_URL}/generate-quiz`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text: text, amount: amount, difficulty: difficulty })
+        body: JSON.stringify({ text: text, amount: amount, difficulty: difficulty, client_id: quizClientId() })
       });
         if (res.ok) {
           const data = await res.json();
@@ -903,6 +914,33 @@ function nextQuestion() {
   }
 }
 
+// Explanations for the whole quiz come from one /explain-answers request,
+// made on the first "Explain" click; later clicks read from it.
+let explanationBatch = null;
+let explanationBatchFor = null;
+
+function fetchExplanations() {
+  if (explanationBatch && explanationBatchFor === questions) return explanationBatch;
+  explanationBatchFor = questions;
+  const items = questions.map(q => ({
+    question: q.question || q.question_text || "",
+    correct_answer: q.correct_answer || q.answer || q.correct || ""
+  })).filter(it => it.question && it.correct_answer);
+  explanationBatch = fetch(`${BACKEND_URL}/explain-answers`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ items })
+  })
+    .then(res => (res.ok ? res.json() : {}))
+    .then(data => data.explanations || {})
+    .catch(err => {
+      console.warn('Batch explain API failed', err);
+      explanationBatch = null;
+      return {};
+    });
+  return explanationBatch;
+}
+
 explainBtn.addEventListener("click", async () => {
   // Call backend explanation endpoint when possible
   const q = questions[currentIndex];
@@ -911,6 +949,11 @@ explainBtn.addEventListener("click", async () => {
   explanationEl.textContent = "Loading explanation...";
   explanationEl.classList.remove("hidden");
   if (navigator.onLine) {
+    const batch = await fetchExplanations();
+    if (batch[questionText.trim()]) {
+      explanationEl.textContent = batch[questionText.trim()];
+      return;
+    }
     try {
       const res = await fetch(`${BACKEND_URL}/explain-answer`, {
         method: 'POST',
@@ -1171,7 +1214,7 @@ document.addEventListener('DOMContentLoaded', () => {
               const options = {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ text: fullText, amount: amount, difficulty: pdfDifficultySelect.value })
+                body: JSON.stringify({ text: fullText, amount: amount, difficulty: pdfDifficultySelect.value, client_id: quizClientId() })
               };
               // Validator: accept only when data.quiz is an array with at least 1 item (preferably full amount)
               const validator = (res, data) => {
@@ -298,20 +298,31 @@ async function sendQueryToGemini(query, filePayload = null) {
                 await new Promise(r => setTimeout(r, 1000 * (attempt - 1)));
             }
 
-            const payload = {
-                prompt: query,
-                roomId: currentRoomId,
-                file: filePayload ? {
-                    data: cleanDataURL(filePayload.data), // Clean Base64 string
-                    mimeType: filePayload.mimeType
-                } : null
-            };
+            let request;
+            if (filePayload && filePayload.file) {
+                // multipart upload: the raw file is streamed, no base64 inflation
+                const form = new FormData();
+                form.append('prompt', query);
+                form.append('roomId', currentRoomId);
+                form.append('file', filePayload.file, filePayload.file.name);
+                request = { method: 'POST', body: form };
+            } else {
+                const payload = {
+                    prompt: query,
+                    roomId: currentRoomId,
+                    file: filePayload ? {
+                        data: cleanDataURL(filePayload.data), // Clean Base64 string
+                        mimeType: filePayload.mimeType
+                    } : null
+                };
+                request = {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(payload)
+                };
+            }
 
-            const response = await apiFetch(serverPath, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
-            });
+            const response = await apiFetch(serverPath, request);
 
             // 2. Check for Server Response Status
             if (response.ok) {
@@ -521,21 +532,8 @@ if (quizModalEl) {
             quizId: String(startedAt)
         });
 
-        // prepare file payload if present
-        let filePayload = null;
-        if (file) {
-            try {
-                const dataUrl = await readFileAsDataURL(file);
-                const base64Data = cleanDataURL(dataUrl);
-                filePayload = { data: base64Data, mimeType: file.type };
-            } catch (err) {
-                console.error('readFile error', err);
-                return showToast('Failed to read uploaded PDF.', '#e11d48');
-            }
-        }
-
-        // call backend
-        const generateResult = await generateQuizBackend({ roomId: currentRoomId, quizName, numQuestions, file: filePayload });
+        // call backend (the PDF is sent as a multipart file part)
+        const generateResult = await generateQuizBackend({ roomId: currentRoomId, quizName, numQuestions, file: file || null });
 
         // fallback to local mock if needed
         let finalQuizData = null;
@@ -613,11 +611,13 @@ function readFileAsDataURL(file) {
 // Call backend /generate-quiz endpoint
 async function generateQuizBackend(payload) {
     try {
-        const resp = await apiFetch('generate-quiz', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
-        });
+        const form = new FormData();
+        for (const [key, value] of Object.entries(payload)) {
+            if (value === null || value === undefined) continue;
+            if (value instanceof Blob) form.append(key, value, value.name || 'upload.pdf');
+            else form.append(key, String(value));
+        }
+        const resp = await apiFetch('generate-quiz', { method: 'POST', body: form });
         const data = await resp.json();
         return data;
     } catch (err) {
@@ -895,7 +895,7 @@ if (sendBtn) {
                 if (fileEl && fileEl.files && fileEl.files.length > 0) {
                     const f = fileEl.files[0];
                     fileDataUrl = await readFileAsDataURL(f); // Full Data URL for local display
-                    filePayload = { data: cleanDataURL(fileDataUrl), mimeType: f.type }; // Payload for backend
+                    filePayload = { data: cleanDataURL(fileDataUrl), mimeType: f.type, file: f }; // Payload for backend (file is sent as multipart)
                     fileType = f.type;
                     fileName = f.name;
                 }
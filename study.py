@@ -14,20 +14,24 @@ try:
 except Exception:
     # python-dotenv not installed; continue — env vars may still be set in the environment
     pass
-import base64
-import io
 import json
 import random
 import re
-import time
 try:
-    import PyPDF2
+    from utils.extractors import extract_pdf_text, check_page_spec
 except Exception:
-    PyPDF2 = None
+    # PyMuPDF not installed
+    extract_pdf_text = check_page_spec = None
 try:
-    import requests
+    from utils import gemini_gateway
 except Exception:
-    requests = None
+    # requests not installed
+    gemini_gateway = None
+from utils.sse import format_event, sse_response
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.context_builder import build_context, source_char_budget
+from utils.jobs import submit_response, register_job_routes
+from utils.uploads import read_upload_request, UploadTooLarge, UploadRequest
 
 # --- Try to import the Google Generative AI SDK ---
 # FIX: Using the correct, modern import for the 'google-genai' package.
@@ -51,6 +55,8 @@ client = None
 
 # Create Flask app and enable CORS for the frontend
 app = Flask(__name__)
+# large multipart files spool to a named temp file the PDF extractor can open by path
+app.request_class = UploadRequest
 CORS(app)
 
 if genai:
@@ -142,13 +148,12 @@ def get_chat_session(room_id):
             room_sessions[room_id] = None
     return room_sessions.get(room_id)
 
-# Utility to create a file Part from Base64
-def create_file_part(base64_data, mime_type):
-    """Decodes base64 string to bytes and creates a Part for the Gemini API."""
+# Utility to create a file Part from an upload
+def create_file_part(upload):
+    """Creates a Part for the Gemini API from a SpooledUpload."""
     try:
-        file_bytes = base64.b64decode(base64_data)
         if genai and hasattr(genai, 'types') and hasattr(genai.types, 'Part'):
-            return genai.types.Part.from_bytes(data=file_bytes, mime_type=mime_type)
+            return genai.types.Part.from_bytes(data=upload.read(), mime_type=upload.mime_type)
         else:
             print("genai.types.Part not available; cannot create file Part for SDK. Skipping file part.")
             return None
@@ -157,29 +162,48 @@ def create_file_part(base64_data, mime_type):
         return None
 
 
-def extract_text_from_pdf_base64(base64_data, max_chars=20000):
-    """Decode base64 PDF bytes and extract text using PyPDF2. Returns a truncated string."""
-    if not PyPDF2:
-        print("PyPDF2 not available; cannot extract PDF text.")
+def extract_upload_text(upload, task, pages=None):
+    """Extract text from an uploaded PDF with the shared PyMuPDF extractor. Pages are read lazily
+    and parsing stops at the task's source budget (utils.context_builder.source_char_budget);
+    `pages` ("1-20,35") restricts extraction to those pages."""
+    if not extract_pdf_text:
+        print("PyMuPDF not available; cannot extract PDF text.")
         return None
     try:
-        file_bytes = base64.b64decode(base64_data)
-        reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
-        texts = []
-        for page in reader.pages:
-            try:
-                texts.append(page.extract_text() or "")
-            except Exception:
-                continue
-        combined = "\n\n".join(texts)
-        if len(combined) > max_chars:
-            combined = combined[:max_chars]
-        return combined
+        return extract_pdf_text(upload.path or upload.file, max_chars=source_char_budget(task), pages=pages or None)
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return None
 
 
+def read_study_request():
+    """Fields plus the uploaded file (multipart, raw binary or legacy base64 JSON) as one dict;
+    `file` holds a SpooledUpload or None. Returns (data, None) or (None, (error_body, status))."""
+    try:
+        data, upload = read_upload_request(request)
+    except UploadTooLarge as e:
+        return None, ({"error": str(e)}, 413)
+    except Exception as e:
+        return None, ({"error": "Invalid upload", "details": str(e)}, 400)
+    data['file'] = upload
+    pages = data.get('pages')
+    if pages and check_page_spec:
+        try:
+            check_page_spec(pages)
+        except (TypeError, ValueError) as e:
+            if upload is not None:
+                upload.close()
+            return None, ({"error": f"Invalid pages {pages!r}: {e}"}, 400)
+    return data, None
+
+
+def close_upload(data):
+    """Close the request's upload (if any); handlers call this when done with it."""
+    upload = (data or {}).get('file')
+    if upload is not None:
+        upload.close()
+
+
 def generate_quiz_from_text(text, num_questions=3, quiz_name='Quiz'):
     """Create simple multiple-choice questions from extracted text as a fallback when AI is unavailable.
     This is a lightweight heuristic generator: it selects candidate sentences, picks a keyword from each,
@@ -281,181 +305,201 @@ def generate_quiz_from_text(text, num_questions=3, quiz_name='Quiz'):
     return quiz
 
 
-def forward_to_gemini_rest(prompt_text, model=None, timeout=60, max_retries=3):
-    """Forward a text prompt to the configured Gemini REST endpoint.
+def parse_quiz_text(text, quiz_name):
+    """Parse model output into {quizName, questions}. Accepts a JSON object with
+    quizName/questions or a bare JSON array of questions (older prompts).
+    Returns None when nothing parseable is found."""
+    if not text:
+        return None
+    m = re.search(r"\{\s*\"quizName\"[\s\S]*\}", text)
+    if m:
+        try:
+            return json.loads(m.group(0))
+        except Exception:
+            pass
+    m2 = re.search(r"(\[\s*\{[\s\S]*\}\s*\])", text)
+    if m2:
+        try:
+            arr = json.loads(m2.group(0))
+            return {"quizName": quiz_name, "questions": arr}
+        except Exception:
+            pass
+    return None
+
+
+def forward_to_gemini_rest(prompt_text, model=None, timeout=60, max_retries=3, cache=False, deadline=None):
+    """Forward a text prompt to the configured Gemini REST endpoint and return the reply text.
     This is intentionally generic: if `GEMINI_REST_URL` is set it will be used directly.
     Otherwise we will build a default Google Generative Language URL using `GEMINI_REST_MODEL`.
-    Returns the requests.Response object or raises an exception on repeated failure.
+    Calls go through the shared pooled gateway (`utils.gemini_gateway`), which also parses
+    the response. Pass `cache=True` for prompts whose reply can be reused (explanations).
+    All candidate endpoints and retries share one `deadline` budget (default: "study").
+    Raises an exception on repeated failure.
     """
-    if requests is None:
+    if gemini_gateway is None:
         raise RuntimeError("requests library is not installed (pip install requests)")
 
     model_to_use = model or GEMINI_REST_MODEL
+    deadline = deadline or Deadline.for_task("study")
 
     # Candidate endpoints (try Google generateContent first which uses contents/parts body,
     # then fallback to generateText style endpoint).
     candidates = []
     if GEMINI_REST_URL:
-        candidates.append((GEMINI_REST_URL, 'auto'))
+        candidates.append((GEMINI_REST_URL, 'content'))
     # prefer v1beta generateContent shape
-    candidates.append((f"https://generativelanguage.googleapis.com/v1beta/models/{model_to_use}:generateContent", 'content'))
+    candidates.append((gemini_gateway.model_url(model_to_use), 'content'))
     # fallback v1beta2 generateText shape
     candidates.append((f"https://generativelanguage.googleapis.com/v1beta2/models/{model_to_use}:generateText", 'prompt'))
 
     last_exc = None
-    # Try each candidate endpoint in order; for each do a retry loop
     for url, shape in candidates:
-        headers = {"Content-Type": "application/json"}
-        params = {}
-        if GEMINI_USE_APIKEY_IN_QUERY and GEMINI_API_KEY:
-            params['key'] = GEMINI_API_KEY
-        elif GEMINI_API_KEY:
-            use_x_goog = 'generativelanguage.googleapis.com' in url or GEMINI_API_KEY.startswith('AIza') or GEMINI_API_KEY.startswith('AIzaSy')
-            if use_x_goog:
-                headers['x-goog-api-key'] = GEMINI_API_KEY
-            else:
-                headers['Authorization'] = f"Bearer {GEMINI_API_KEY}"
-
-        # Build body according to required shape
-        if shape == 'content':
-            body = {"contents": [{"parts": [{"text": prompt_text}]}]}
-        else:
-            body = {"prompt": {"text": prompt_text}, "temperature": 0.2, "maxOutputTokens": 800}
-
-        for attempt in range(1, max_retries + 1):
-            try:
-                resp = requests.post(url, headers=headers, params=params, json=body, timeout=timeout)
-                try:
-                    resp.raise_for_status()
-                    # Log which endpoint succeeded
-                    print(f"forward_to_gemini_rest: succeeded using {url} (shape={shape})")
-                    return resp
-                except requests.HTTPError as http_err:
-                    status = getattr(resp, 'status_code', None)
-                    text = resp.text if hasattr(resp, 'text') else str(resp)
-                    # If 404, this endpoint/model may not be available; break to try next candidate
-                    if status == 404:
-                        print(f"forward_to_gemini_rest attempt {attempt} to {url} failed: HTTP 404 (not found). Trying next endpoint.")
-                        last_exc = RuntimeError(f"HTTP 404 from {url}: {text}")
-                        break
-                    if status == 401:
-                        raise RuntimeError(f"401 Unauthorized from Gemini REST at {url}. Response: {text}. Hint: use x-goog-api-key or OAuth token.")
-                    raise RuntimeError(f"HTTP {status} from Gemini REST at {url}: {text}") from http_err
-            except Exception as e:
-                last_exc = e
-                backoff = 0.5 * (2 ** (attempt - 1))
-                print(f"forward_to_gemini_rest attempt {attempt} to {url} failed: {e}. Backing off {backoff}s.")
-                time.sleep(backoff)
+        try:
+            text = gemini_gateway.generate_text(prompt_text, api_key=GEMINI_API_KEY, url=url, shape=shape,
+                                                timeout=timeout, max_attempts=max_retries, backoff=0.5,
+                                                key_in_query=GEMINI_USE_APIKEY_IN_QUERY, label="study",
+                                                cache=cache, deadline=deadline)
+            print(f"forward_to_gemini_rest: succeeded using {url} (shape={shape})")
+            return text
+        except (DeadlineExceeded, gemini_gateway.CircuitOpenError):
+            # no point trying other endpoints: out of time, or Gemini is down
+            raise
+        except gemini_gateway.GeminiError as e:
+            last_exc = e
+            # If 404, this endpoint/model may not be available; try next candidate
+            if e.status_code == 404:
+                print(f"forward_to_gemini_rest to {url} failed: HTTP 404 (not found). Trying next endpoint.")
+                continue
+            if e.status_code == 401:
+                raise RuntimeError(f"401 Unauthorized from Gemini REST at {url}. Response: {e.body}. Hint: use x-goog-api-key or OAuth token.")
+            print(f"forward_to_gemini_rest to {url} failed: {e}")
+        except Exception as e:
+            last_exc = e
+            print(f"forward_to_gemini_rest to {url} failed: {e}")
         # try next candidate
 
     # If we exit the candidate loop, raise the last exception
     raise last_exc
 
-@app.route('/ask-ai', methods=['POST'])
-def ask_ai():
-    if not client:
-        return jsonify({"error": "AI client not initialized. Check API Key."}), 500
+QUIZ_BANNER = "✨ Quiz Generated! ✨\n\n"
 
-    data = request.get_json()
+
+def prepare_ask_request(data):
+    """Validate an /ask-ai body and build the SDK content parts.
+    Returns (ask, None) on success or (None, (error_body, status)) on failure."""
     prompt = data.get('prompt', '')
     room_id = data.get('roomId') 
     file_payload = data.get('file', None)
 
     if not room_id:
-        return jsonify({"error": "Room ID is required."}), 400
+        return None, ({"error": "Room ID is required."}, 400)
 
-    try:
-        chat = get_chat_session(room_id)
+    content_parts = []
+    is_quiz_request = False
+
+    # 1. Process File Payload (if present)
+    if file_payload:
+        file_part = create_file_part(file_payload)
+        if not file_part:
+            return None, ({"error": "Failed to process file data."}, 500)
         
-        content_parts = []
-        is_quiz_request = False
-
-        # 1. Process File Payload (if present)
-        if file_payload:
-            file_part = create_file_part(file_payload['data'], file_payload['mimeType'])
-            if not file_part:
-                return jsonify({"error": "Failed to process file data."}), 500
-            
-            content_parts.append(file_part)
-            
-            # 2. AUTOMATIC ACTION CHECK (THE CHANGE IS HERE)
-            mime_type = file_payload['mimeType']
+        content_parts.append(file_part)
+        
+        # 2. AUTOMATIC ACTION CHECK (THE CHANGE IS HERE)
+        mime_type = file_payload.mime_type
+        
+        if mime_type.startswith('application/pdf') or mime_type.startswith('text/'):
+            if not prompt.strip():
+                # ✅ NEW DEFAULT BEHAVIOR: Provide a summary/explanation
+                prompt = "Please read this document/file and provide a concise 3-point summary and explanation of the key content."
             
-            if mime_type.startswith('application/pdf') or mime_type.startswith('text/'):
-                if not prompt.strip():
-                    # ✅ NEW DEFAULT BEHAVIOR: Provide a summary/explanation
-                    prompt = "Please read this document/file and provide a concise 3-point summary and explanation of the key content."
+            # Check if the final prompt (either user's or default) is a quiz request
+            if 'quiz' in prompt.strip().lower() or 'questions' in prompt.strip().lower():
+                # Ensure the prompt is detailed for the AI if it is a quiz request
+                if 'quiz' not in prompt.strip().lower(): 
+                     prompt = f"{prompt.strip()}. Please create a short quiz with exactly 3 multiple-choice questions (A, B, C or D), followed by the correct answers at the end."
+
+                is_quiz_request = True
                 
-                # Check if the final prompt (either user's or default) is a quiz request
-                if 'quiz' in prompt.strip().lower() or 'questions' in prompt.strip().lower():
-                    # Ensure the prompt is detailed for the AI if it is a quiz request
-                    if 'quiz' not in prompt.strip().lower(): 
-                         prompt = f"{prompt.strip()}. Please create a short quiz with exactly 3 multiple-choice questions (A, B, C or D), followed by the correct answers at the end."
-
-                    is_quiz_request = True
-                    
-        # 3. Add the User's Prompt
-        if prompt:
-            content_parts.append(prompt)
-            
-        if not content_parts:
-             return jsonify({"error": "Prompt or file is required."}), 400
+    # 3. Add the User's Prompt
+    if prompt:
+        content_parts.append(prompt)
+        
+    if not content_parts:
+        return None, ({"error": "Prompt or file is required."}, 400)
+
+    return {
+        "room_id": room_id,
+        "prompt": prompt,
+        "file_payload": file_payload,
+        "pages": data.get('pages'),
+        "content_parts": content_parts,
+        "is_quiz_request": is_quiz_request,
+    }, None
+
+
+def build_rest_prompt(ask):
+    """Fallback prompt combining the user's prompt and any uploaded file text (REST path)."""
+    prompt = ask["prompt"]
+    file_payload = ask["file_payload"]
+    prompt_parts = []
+    if prompt:
+        prompt_parts.append(prompt)
+    if file_payload and extract_pdf_text:
+        try:
+            file_text = extract_upload_text(file_payload, "study_chat", ask["pages"]) or ''
+            if file_text:
+                prompt_parts.append("Document excerpt:\n" + build_context(file_text, task="study_chat"))
+        except Exception as e:
+            print(f"Failed to extract PDF for REST fallback: {e}")
+
+    return "\n\n".join([p for p in prompt_parts if p]) or prompt or ""
+
+
+@app.route('/ask-ai', methods=['POST'])
+def ask_ai():
+    if not client:
+        return jsonify({"error": "AI client not initialized. Check API Key."}), 500
+
+    data, err = read_study_request()
+    if err:
+        return jsonify(err[0]), err[1]
+    room_id = data.get('roomId') 
+
+    try:
+        ask, err = prepare_ask_request(data)
+        if err:
+            return jsonify(err[0]), err[1]
+        chat = get_chat_session(room_id)
+        is_quiz_request = ask["is_quiz_request"]
 
         # 4. Send the Request
         # If SDK chat session is not available, fall back to the REST proxy using the
         # available prompt and uploaded file text. This makes the send action work even
         # when the installed SDK doesn't expose chat APIs.
         if not chat:
-            # Build a fallback prompt combining the user's prompt and any uploaded file text
-            prompt_parts = []
-            if prompt:
-                prompt_parts.append(prompt)
-            if file_payload and PyPDF2:
-                try:
-                    file_text = extract_text_from_pdf_base64(file_payload.get('data', '')) or ''
-                    if file_text:
-                        prompt_parts.append("Document excerpt:\n" + file_text[:15000])
-                except Exception as e:
-                    print(f"Failed to extract PDF for REST fallback: {e}")
+            prompt_text = build_rest_prompt(ask)
 
-            prompt_text = "\n\n".join([p for p in prompt_parts if p]) or prompt or ""
-
-            if GEMINI_API_KEY and requests is not None:
+            if GEMINI_API_KEY and gemini_gateway is not None:
                 try:
-                    resp = forward_to_gemini_rest(prompt_text)
+                    ai_response_text = forward_to_gemini_rest(prompt_text)
                 except Exception as e:
                     print(f"REST fallback failed for room {room_id}: {e}")
                     return jsonify({"error": "Failed to get response from AI (REST fallback).", "details": str(e)}), 500
 
-                # Extract text from common response shapes
-                ai_response_text = None
-                try:
-                    j = resp.json()
-                    if isinstance(j, dict) and 'candidates' in j and isinstance(j['candidates'], list) and j['candidates']:
-                        content = j['candidates'][0].get('content') or j['candidates'][0]
-                        if isinstance(content, dict):
-                            parts = content.get('parts') or []
-                            if parts and isinstance(parts[0], dict):
-                                ai_response_text = parts[0].get('text') or parts[0].get('content')
-                except Exception:
-                    pass
-
-                if not ai_response_text:
-                    ai_response_text = resp.text if hasattr(resp, 'text') else str(resp)
-
                 if is_quiz_request:
-                    ai_response_text = "✨ Quiz Generated! ✨\n\n" + (ai_response_text or "")
+                    ai_response_text = QUIZ_BANNER + (ai_response_text or "")
                 return jsonify({"text": (ai_response_text or "").strip()})
 
             # No SDK chat and no REST key available
             return jsonify({"error": "AI client unavailable (no chat API and no REST key)."}), 500
 
         # SDK chat is available — use it
-        response = chat.send_message(content_parts)
+        response = chat.send_message(ask["content_parts"])
 
         # 5. Format the Response Text for Quiz requests
         if is_quiz_request:
-            ai_response_text = "✨ Quiz Generated! ✨\n\n" + response.text
+            ai_response_text = QUIZ_BANNER + response.text
         else:
             ai_response_text = response.text
 
@@ -464,17 +508,76 @@ def ask_ai():
     except Exception as e:
         print(f"Error calling Gemini API for room {room_id}: {e}")
         return jsonify({"error": "Failed to get response from AI."}), 500
+    finally:
+        close_upload(data)
 
 
+@app.route('/ask-ai/stream', methods=['POST'])
+def ask_ai_stream():
+    """Streaming variant of /ask-ai. Same body (JSON or multipart); replies are sent as
+    Server-Sent Events (`delta` chunks, then a `done` event with the full text).
+    Uses the SDK chat session's streaming API when available, otherwise the
+    REST streamGenerateContent endpoint through the shared gateway."""
+    if not client:
+        return jsonify({"error": "AI client not initialized. Check API Key."}), 500
 
+    data, err = read_study_request()
+    if err:
+        return jsonify(err[0]), err[1]
+    room_id = data.get('roomId')
+    chat = rest_prompt = None
+    try:
+        ask, err = prepare_ask_request(data)
+        if not err:
+            chat = get_chat_session(room_id)
+            if not chat and GEMINI_API_KEY and gemini_gateway is not None:
+                # built now: the upload is closed before the stream starts
+                rest_prompt = build_rest_prompt(ask)
+    except Exception as e:
+        print(f"Error preparing streaming request for room {room_id}: {e}")
+        return jsonify({"error": "Failed to get response from AI."}), 500
+    finally:
+        close_upload(data)
+    if err:
+        return jsonify(err[0]), err[1]
+    if not chat and rest_prompt is None:
+        return jsonify({"error": "AI client unavailable (no chat API and no REST key)."}), 500
+
+    def deltas():
+        if chat and hasattr(chat, 'send_message_stream'):
+            for chunk in chat.send_message_stream(ask["content_parts"]):
+                text = getattr(chunk, 'text', None)
+                if text:
+                    yield text
+        elif chat:
+            # SDK without a streaming chat API: send as one chunk
+            yield chat.send_message(ask["content_parts"]).text
+        else:
+            url = GEMINI_REST_URL or gemini_gateway.model_url(GEMINI_REST_MODEL)
+            yield from gemini_gateway.stream_text(rest_prompt, api_key=GEMINI_API_KEY, url=url,
+                                                  key_in_query=GEMINI_USE_APIKEY_IN_QUERY, label="study-stream",
+                                                  deadline=Deadline.for_task("study"))
 
-@app.route('/generate-quiz', methods=['POST'])
-def generate_quiz():
-    """Generate a structured quiz JSON from an uploaded file using the Gemini model.
-    Expects JSON: { roomId (optional), quizName, numQuestions, file: { data: <base64 str>, mimeType } }
-    Returns: { quizName: str, questions: [ { question, options: [A,B,C,D], answer } ] }
-    """
-    data = request.get_json() or {}
+    def events():
+        pieces = []
+        try:
+            if ask["is_quiz_request"]:
+                pieces.append(QUIZ_BANNER)
+                yield format_event({"delta": QUIZ_BANNER})
+            for delta in deltas():
+                pieces.append(delta)
+                yield format_event({"delta": delta})
+            yield format_event({"text": "".join(pieces).strip()}, event="done")
+        except Exception as e:
+            print(f"Error streaming Gemini reply for room {room_id}: {e}")
+            yield format_event({"error": "Failed to get response from AI.", "details": str(e)}, event="error")
+
+    return sse_response(events())
+
+
+def build_study_quiz(data):
+    """Quiz pipeline behind /generate-quiz. Returns (body, status); runs inside a
+    request or as a background job."""
     room_id = data.get('roomId', 'global')
     quiz_name = data.get('quizName', data.get('text', 'Quiz')[:40] or 'Quiz')
     try:
@@ -488,9 +591,9 @@ def generate_quiz():
 
     # Extract text from uploaded PDF if present
     extracted = None
-    if file_payload and PyPDF2:
+    if file_payload and extract_pdf_text:
         try:
-            extracted = extract_text_from_pdf_base64(file_payload.get('data', ''))
+            extracted = extract_upload_text(file_payload, "study_quiz", data.get('pages'))
         except Exception as e:
             print(f"Error extracting PDF text: {e}")
 
@@ -498,7 +601,7 @@ def generate_quiz():
     source_text = (provided_text or extracted or '').strip()
 
     # If GEMINI_API_KEY is present, prefer REST-based generation (no SDK required)
-    if GEMINI_API_KEY and requests is not None:
+    if GEMINI_API_KEY and gemini_gateway is not None:
         # Build prompt that asks for a strict JSON object with quizName and questions
         prompt = (
             f"You are an expert quiz maker. Read the following document text and generate exactly {num_questions} multiple-choice questions."
@@ -506,19 +609,19 @@ def generate_quiz():
             f" Set \"quizName\" to \"{quiz_name}\"."
         )
         if source_text:
-            # include excerpt (trim to reasonable length)
-            excerpt = source_text[:16000]
+            # salient chunks from the whole document, fitted to the prompt budget
+            excerpt = build_context(source_text, task="study_quiz")
             prompt = f"{prompt}\n\nDocument excerpt:\n{excerpt}"
 
         try:
-            resp = forward_to_gemini_rest(prompt, model=GEMINI_REST_MODEL)
+            ai_text = forward_to_gemini_rest(prompt, model=GEMINI_REST_MODEL)
         except Exception as e:
             print(f"Error calling Gemini REST: {e}")
             # fallback to local generation if possible
             if source_text:
                 local_quiz = generate_quiz_from_text(source_text, num_questions=num_questions, quiz_name=quiz_name)
                 if local_quiz:
-                    return jsonify(local_quiz)
+                    return local_quiz, 200
             # final fallback: mock
             mock_questions = []
             for i in range(num_questions):
@@ -527,87 +630,26 @@ def generate_quiz():
                     "options": ["Option A", "Option B", "Option C", "Option D"],
                     "answer": "A"
                 })
-            return jsonify({"quizName": quiz_name, "questions": mock_questions})
+            return {"quizName": quiz_name, "questions": mock_questions}, 200
 
-        # Try parsing response
-        try:
-            j = resp.json()
-        except Exception:
-            raw_text = resp.text
-            # attempt to extract JSON object
-            m = re.search(r"\{\s*\"quizName\"[\s\S]*\}", raw_text)
-            if m:
-                try:
-                    parsed = json.loads(m.group(0))
-                    return jsonify(parsed)
-                except Exception:
-                    pass
-            # try to extract JSON array (older prompts may return list)
-            m2 = re.search(r"(\[\s*\{[\s\S]*\}\s*\])", raw_text)
-            if m2:
-                try:
-                    arr = json.loads(m2.group(0))
-                    # convert list to object with quizName
-                    return jsonify({"quizName": quiz_name, "questions": arr})
-                except Exception:
-                    pass
-            # as last resort, return raw text
-            return jsonify({"raw": raw_text}), 200
-
-        # If provider returned a dict with quizName/questions, return it
-        if isinstance(j, dict) and 'quizName' in j and 'questions' in j:
-            return jsonify(j)
-
-        # If provider returned a list, wrap it
-        if isinstance(j, list):
-            return jsonify({"quizName": quiz_name, "questions": j})
-
-        # Try common nested shapes
-        text_candidate = None
-        try:
-            if isinstance(j, dict) and 'candidates' in j and isinstance(j['candidates'], list) and j['candidates']:
-                cand = j['candidates'][0]
-                # try content.parts[0].text
-                if isinstance(cand, dict):
-                    content = cand.get('content') or cand
-                    if isinstance(content, dict):
-                        parts = content.get('parts') or []
-                        if parts and isinstance(parts, list) and isinstance(parts[0], dict):
-                            text_candidate = parts[0].get('text') or parts[0].get('content')
-        except Exception:
-            text_candidate = None
-
-        if text_candidate:
-            m = re.search(r"\{\s*\"quizName\"[\s\S]*\}", text_candidate)
-            if m:
-                try:
-                    parsed = json.loads(m.group(0))
-                    return jsonify(parsed)
-                except Exception:
-                    pass
-            m2 = re.search(r"(\[\s*\{[\s\S]*\}\s*\])", text_candidate)
-            if m2:
-                try:
-                    arr = json.loads(m2.group(0))
-                    return jsonify({"quizName": quiz_name, "questions": arr})
-                except Exception:
-                    pass
-            return jsonify({"raw": text_candidate}), 200
+        parsed = parse_quiz_text(ai_text, quiz_name)
+        if parsed:
+            return parsed, 200
 
         # Nothing parsed: fallback to local generator if we have text
         if source_text:
             local_quiz = generate_quiz_from_text(source_text, num_questions=num_questions, quiz_name=quiz_name)
             if local_quiz:
-                return jsonify(local_quiz)
+                return local_quiz, 200
 
-        # Final fallback: return raw provider JSON
-        return jsonify(j), 200
+        # Final fallback: return raw provider text
+        return {"raw": ai_text}, 200
 
     # If no GEMINI key or requests not available, use local generation if possible
     if source_text:
         local_quiz = generate_quiz_from_text(source_text, num_questions=num_questions, quiz_name=quiz_name)
         if local_quiz:
-            return jsonify(local_quiz)
+            return local_quiz, 200
 
     # Final fallback: mock quiz
     mock_questions = []
@@ -617,117 +659,127 @@ def generate_quiz():
             "options": ["Option A", "Option B", "Option C", "Option D"],
             "answer": "A"
         })
-    return jsonify({"quizName": quiz_name, "questions": mock_questions})
+    return {"quizName": quiz_name, "questions": mock_questions}, 200
+
+
+@app.route('/generate-quiz', methods=['POST'])
+def generate_quiz():
+    """Generate a structured quiz JSON from an uploaded file using the Gemini model.
+    Expects multipart/form-data (roomId, quizName, numQuestions fields + `file` part), a raw PDF body
+    with the fields in the query string, or legacy JSON: { roomId, quizName, numQuestions, file: { data: <base64 str>, mimeType } }
+    Returns: { quizName: str, questions: [ { question, options: [A,B,C,D], answer } ] }
+    """
+    data, err = read_study_request()
+    if err:
+        return jsonify(err[0]), err[1]
+    try:
+        body, status = build_study_quiz(data)
+    finally:
+        close_upload(data)
+    return jsonify(body), status
+
+
+@app.route('/generate-quiz/jobs', methods=['POST'])
+def generate_quiz_job():
+    """Queue /generate-quiz in the background (same body): 202 {job_id, status_url};
+    poll GET /jobs/<job_id> or stream GET /jobs/<job_id>/events."""
+    data, err = read_study_request()
+    if err:
+        return jsonify(err[0]), err[1]
+    if data.get('file') is not None:
+        # the request closes its multipart files when it ends; the job needs its own copy
+        data['file'] = data['file'].detach()
+    resp = submit_response("study-quiz", build_study_quiz_job, data)
+    if resp.status_code != 202:
+        close_upload(data)
+    return resp
+
+
+def build_study_quiz_job(data):
+    try:
+        return build_study_quiz(data)
+    finally:
+        close_upload(data)
+
+
+register_job_routes(app)
 
 
 @app.route('/generate-quiz-rest', methods=['POST'])
 def generate_quiz_rest():
     """Generate a quiz by calling the Gemini REST API (configurable) instead of using the SDK.
-    Accepts same input shape as /generate-quiz: { roomId, quizName, numQuestions, file: { data, mimeType } }
+    Accepts the same input shapes as /generate-quiz (multipart, raw PDF body or base64 JSON)
     This endpoint will:
       - extract text from an uploaded PDF (if provided)
       - build a strict JSON-output prompt and forward to the configured Gemini REST endpoint
       - try to parse the response as JSON and return it; otherwise fall back to local generator
     """
-    if requests is None:
+    if gemini_gateway is None:
         return jsonify({"error": "Python 'requests' library is required for REST proxy. Install with: pip install requests"}), 500
 
-    data = request.get_json() or {}
-    quiz_name = data.get('quizName', 'Quiz')
+    data, err = read_study_request()
+    if err:
+        return jsonify(err[0]), err[1]
     try:
-        num_questions = int(data.get('numQuestions', 3))
-    except Exception:
-        num_questions = 3
-    file_payload = data.get('file')
+        quiz_name = data.get('quizName', 'Quiz')
+        try:
+            num_questions = int(data.get('numQuestions', 3))
+        except Exception:
+            num_questions = 3
+        file_payload = data.get('file')
 
-    # Prefer using extracted text for PDF inputs
-    extracted = None
-    if file_payload and PyPDF2:
+        # Prefer using extracted text for PDF inputs
+        extracted = None
+        if file_payload and extract_pdf_text:
+            try:
+                extracted = extract_upload_text(file_payload, "study_quiz", data.get('pages'))
+            except Exception as e:
+                print(f"Error extracting PDF text for REST flow: {e}")
+
+        if not extracted and file_payload and not extract_pdf_text:
+            print("No PyMuPDF available — cannot extract PDF text; proceeding without file content.")
+
+        # Build a strict JSON instruction prompt for the model
+        if extracted:
+            prompt_text = (
+                f"You are given the following extracted text from a document:\n\n{build_context(extracted, task='study_quiz')}\n\n"
+                f"Generate exactly {num_questions} multiple-choice questions based ONLY on that text. "
+                "Output MUST be valid JSON and nothing else, with this schema: {\"quizName\": <string>, \"questions\": [{\"question\": <string>, \"options\": [<strA>,<strB>,<strC>,<strD>], \"answer\": <\"A\"|\"B\"|\"C\"|\"D\">} ...] }. "
+                f"Set \"quizName\" to \"{quiz_name}\"."
+            )
+        else:
+            # If we don't have extracted text, ask the model to operate on the uploaded file (if provider supports file parts)
+            prompt_text = (
+                f"Read the uploaded document and generate exactly {num_questions} multiple-choice questions based ONLY on that document. "
+                "Output MUST be valid JSON and nothing else, with this schema: {\"quizName\": <string>, \"questions\": [{\"question\": <string>, \"options\": [<strA>,<strB>,<strC>,<strD>], \"answer\": <\"A\"|\"B\"|\"C\"|\"D\">} ...] }. "
+                f"Set \"quizName\" to \"{quiz_name}\"."
+            )
+
+        # Call the REST proxy helper
         try:
-            extracted = extract_text_from_pdf_base64(file_payload['data'])
+            ai_text = forward_to_gemini_rest(prompt_text)
         except Exception as e:
-            print(f"Error extracting PDF text for REST flow: {e}")
-
-    if not extracted and file_payload and not PyPDF2:
-        print("No PyPDF2 available — cannot extract PDF text; proceeding without file content.")
-
-    # Build a strict JSON instruction prompt for the model
-    if extracted:
-        prompt_text = (
-            f"You are given the following extracted text from a document:\n\n{extracted}\n\n"
-            f"Generate exactly {num_questions} multiple-choice questions based ONLY on that text. "
-            "Output MUST be valid JSON and nothing else, with this schema: {\"quizName\": <string>, \"questions\": [{\"question\": <string>, \"options\": [<strA>,<strB>,<strC>,<strD>], \"answer\": <\"A\"|\"B\"|\"C\"|\"D\">} ...] }. "
-            f"Set \"quizName\" to \"{quiz_name}\"."
-        )
-    else:
-        # If we don't have extracted text, ask the model to operate on the uploaded file (if provider supports file parts)
-        prompt_text = (
-            f"Read the uploaded document and generate exactly {num_questions} multiple-choice questions based ONLY on that document. "
-            "Output MUST be valid JSON and nothing else, with this schema: {\"quizName\": <string>, \"questions\": [{\"question\": <string>, \"options\": [<strA>,<strB>,<strC>,<strD>], \"answer\": <\"A\"|\"B\"|\"C\"|\"D\">} ...] }. "
-            f"Set \"quizName\" to \"{quiz_name}\"."
-        )
+            print(f"Error calling Gemini REST endpoint: {e}")
+            # Fallback to local generator if we have extracted text
+            if extracted:
+                local_quiz = generate_quiz_from_text(extracted, num_questions=num_questions, quiz_name=quiz_name)
+                if local_quiz:
+                    return jsonify(local_quiz)
+            return jsonify({"error": "Failed to call Gemini REST endpoint."}), 500
+
+        parsed = parse_quiz_text(ai_text, quiz_name)
+        if parsed:
+            return jsonify(parsed)
 
-    # Call the REST proxy helper
-    try:
-        resp = forward_to_gemini_rest(prompt_text)
-    except Exception as e:
-        print(f"Error calling Gemini REST endpoint: {e}")
-        # Fallback to local generator if we have extracted text
         if extracted:
             local_quiz = generate_quiz_from_text(extracted, num_questions=num_questions, quiz_name=quiz_name)
             if local_quiz:
                 return jsonify(local_quiz)
-        return jsonify({"error": "Failed to call Gemini REST endpoint."}), 500
-
-    # Try to parse the response. Different providers may embed text in different fields.
-    try:
-        j = resp.json()
-    except Exception:
-        text = resp.text
-        # Attempt to extract JSON substring from text
-        m = re.search(r"\{\s*\"quizName\"[\s\S]*\}", text)
-        if m:
-            try:
-                parsed = json.loads(m.group(0))
-                return jsonify(parsed)
-            except Exception:
-                pass
-        # As a last resort, return raw text
-        return jsonify({"raw": text}), 200
-
-    # If the provider returned JSON directly, try to find sensible fields
-    if isinstance(j, dict) and 'quizName' in j and 'questions' in j:
-        return jsonify(j)
-
-    # Try to find textual content in common response shapes
-    text_candidate = None
-    try:
-        if 'candidates' in j and isinstance(j['candidates'], list) and j['candidates']:
-            text_candidate = j['candidates'][0].get('content') or j['candidates'][0].get('text')
-        if not text_candidate and 'output' in j and isinstance(j['output'], list) and j['output']:
-            for o in j['output']:
-                if isinstance(o, dict):
-                    text_candidate = o.get('content') or o.get('text') or text_candidate
-    except Exception:
-        text_candidate = None
-
-    if text_candidate:
-        m = re.search(r"\{\s*\"quizName\"[\s\S]*\}", text_candidate)
-        if m:
-            try:
-                parsed = json.loads(m.group(0))
-                return jsonify(parsed)
-            except Exception:
-                pass
-        return jsonify({"raw": text_candidate}), 200
-
-    if extracted:
-        local_quiz = generate_quiz_from_text(extracted, num_questions=num_questions, quiz_name=quiz_name)
-        if local_quiz:
-            return jsonify(local_quiz)
 
-    return jsonify(j), 200
+        return jsonify({"raw": ai_text}), 200
 
+    finally:
+        close_upload(data)
 
 # --------------------
 # Static file routes (serve the frontend from the shared `static/` folder)
@@ -761,7 +813,8 @@ def debug_ai():
         'sdk_available': sdk_available,
         'client_ready': client_ready,
         'gemini_key_present': key_present,
-        'gemini_key_preview': (GEMINI_API_KEY[:4] + '...' + GEMINI_API_KEY[-4:]) if GEMINI_API_KEY and len(GEMINI_API_KEY) > 8 else None
+        'gemini_key_preview': (GEMINI_API_KEY[:4] + '...' + GEMINI_API_KEY[-4:]) if GEMINI_API_KEY and len(GEMINI_API_KEY) > 8 else None,
+        'gateway': gemini_gateway.stats() if gemini_gateway else None
     }
     return jsonify(info)
 
@@ -776,6 +829,7 @@ def explain_answer():
     correct = (data.get("correct_answer") or "").strip()
     if not question or not correct:
         return jsonify({"error": "question and correct_answer are required"}), 400
+    use_cache = not bool(data.get("no_cache", False))
 
     # Build a concise prompt asking for an explanation
     prompt = (
@@ -784,31 +838,15 @@ def explain_answer():
         "Return only the explanation text."
     )
 
-    if not GEMINI_API_KEY or requests is None:
+    if not GEMINI_API_KEY or gemini_gateway is None:
         return jsonify({"error": "Server not configured with GEMINI_API_KEY or requests not available"}), 500
 
     try:
-        resp = forward_to_gemini_rest(prompt)
+        explanation_text = forward_to_gemini_rest(prompt, cache=use_cache, deadline=Deadline.for_task("explain"))
     except Exception as e:
         print(f"Explain-answer Gemini call failed: {e}")
         return jsonify({"error": "Explain API failed", "details": str(e)}), 500
 
-    explanation_text = None
-    # Try common JSON/candidate shapes first
-    try:
-        j = resp.json()
-        if isinstance(j, dict) and 'candidates' in j and isinstance(j['candidates'], list) and j['candidates']:
-            content = j['candidates'][0].get('content') or j['candidates'][0]
-            if isinstance(content, dict):
-                parts = content.get('parts') or []
-                if parts and isinstance(parts[0], dict):
-                    explanation_text = parts[0].get('text') or parts[0].get('content')
-    except Exception:
-        pass
-
-    if not explanation_text:
-        explanation_text = resp.text if hasattr(resp, 'text') else str(resp)
-
     explanation_text = (explanation_text or "").strip()
     return jsonify({"explanation": explanation_text})
 
@@ -1,13 +1,17 @@
 import os
-import io
 from flask import Flask, request, jsonify
 from flask import send_from_directory
 from flask_cors import CORS
 from dotenv import load_dotenv
-import requests
-from PyPDF2 import PdfReader
 from flask import request as flask_request
 
+from utils import gemini_gateway
+from utils.extractors import extract_pdf_text, check_page_spec
+from utils.sse import format_event, sse_response
+from utils.deadline import Deadline
+from utils.context_builder import build_context, source_char_budget
+from utils.jobs import submit_response, register_job_routes
+
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
@@ -39,128 +43,37 @@ def index():
     if os.path.exists(index_file):
         return send_from_directory(BASE_DIR, 'summarizer.html')
     return jsonify({'error': 'No frontend available'}), 404
-def extract_text_from_pdf(file_stream):
-    try:
-        reader = PdfReader(file_stream)
-        text_parts = []
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                text_parts.append(text)
-        return "\n\n".join(text_parts)
-    except Exception:
-        return ""
 
 
-def call_gemini(prompt, max_tokens=256):
+def call_gemini(prompt, max_tokens=256, cache=True, deadline=None):
     """
-    Generic caller for a Gemini-like REST endpoint. This function makes a POST to
-    GEMINI_API_URL using GEMINI_API_KEY (if provided). The exact request/response
-    shape may need adjustment depending on the Gemini endpoint you use.
-
-    Assumptions:
-    - If GEMINI_API_URL is set it accepts a JSON body with keys: 'prompt' and 'max_tokens'
-    - Authorization via Bearer token header with GEMINI_API_KEY
-
-    If your actual Gemini endpoint requires a different shape (for example query param ?key=...)
-    update GEMINI_API_URL and headers/body accordingly.
+    Send a summarization prompt to Gemini through the shared pooled gateway
+    (`utils.gemini_gateway`). GEMINI_API_URL overrides the default
+    generateContent endpoint; GEMINI_API_KEY is sent as x-goog-api-key (or as
+    a Bearer token for non-Google endpoints). Summaries are cached by prompt
+    unless `cache=False`. Retries and timeouts are bounded by `deadline`
+    (default: the "summary" budget from utils.deadline).
+
+    Returns (text, None) on success or (None, error_message) on failure.
     """
     if not GEMINI_API_URL or not GEMINI_API_KEY:
         return None, 'Gemini URL or API key not configured on server. Set GEMINI_API_URL and GEMINI_API_KEY in .env.'
-    # Prefer Google-style Gemini endpoint shape (x-goog-api-key header and contents payload)
-    url = GEMINI_API_URL or "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
-    headers = {
-        'Content-Type': 'application/json',
-        'x-goog-api-key': GEMINI_API_KEY
-    }
-
-    payload = {
-        'contents': [
-            {
-                'parts': [
-                    {'text': prompt}
-                ]
-            }
-        ]
-    }
-
-    max_attempts = 4
-    base_backoff = 1.0
-    last_err = None
-    for attempt in range(1, max_attempts + 1):
-        try:
-            print(f"Calling Gemini (attempt {attempt}/{max_attempts})...")
-            resp = requests.post(url, json=payload, headers=headers, timeout=90)
-            resp.raise_for_status()
-        except Exception as e:
-            last_err = f'Error calling Gemini API (network or HTTP): {e}'
-            print(last_err)
-            if attempt < max_attempts:
-                import time
-                sleep_for = base_backoff * (2 ** (attempt - 1))
-                print(f"Retrying after {sleep_for} seconds...")
-                time.sleep(sleep_for)
-                continue
-            return None, last_err
+    url = GEMINI_API_URL or gemini_gateway.model_url()
+    deadline = deadline or Deadline.for_task("summary")
 
-        try:
-            body_text = resp.text
-        except Exception:
-            body_text = ''
-        # store last full body for debugging (not printed to terminal)
-        global LAST_GEMINI_RESPONSE
-        LAST_GEMINI_RESPONSE = body_text
-        # Print only status and size to avoid dumping the response content to the terminal
-        try:
-            size = len(body_text)
-        except Exception:
-            size = 0
-        print(f"Gemini response status: {resp.status_code} (body size: {size} bytes)")
-
-        try:
-            data = resp.json()
-        except Exception:
-            last_err = f'Unable to parse JSON response from Gemini: {body_text}'
-            print(last_err)
-            if attempt < max_attempts:
-                import time
-                sleep_for = base_backoff * (2 ** (attempt - 1))
-                time.sleep(sleep_for)
-                continue
-            return None, last_err
-
-        # Try to extract generator text from Google-style 'candidates' -> content -> parts -> text
-        if isinstance(data, dict):
-            candidates = data.get('candidates') or data.get('outputs') or []
-            if isinstance(candidates, list) and candidates:
-                first = candidates[0]
-                content = first.get('content') if isinstance(first, dict) else None
-                if content and isinstance(content, dict):
-                    parts = content.get('parts') or []
-                    if parts and isinstance(parts, list) and isinstance(parts[0], dict):
-                        text_resp = parts[0].get('text')
-                        if text_resp and isinstance(text_resp, str) and text_resp.strip():
-                            return text_resp, None
-
-        # Fall back to other shapes (OpenAI-like choices, direct fields)
-        if isinstance(data, dict):
-            if 'choices' in data and isinstance(data['choices'], list) and data['choices']:
-                text = data['choices'][0].get('text') or data['choices'][0].get('message', {}).get('content')
-                if text:
-                    return text, None
-            for key in ('text', 'content', 'summary'):
-                if key in data and isinstance(data[key], str) and data[key].strip():
-                    return data[key], None
-
-        last_err = 'Could not extract summary from Gemini response'
-        print(last_err)
-        if attempt < max_attempts:
-            import time
-            sleep_for = base_backoff * (2 ** (attempt - 1))
-            print(f"Retrying after {sleep_for} seconds...")
-            time.sleep(sleep_for)
-            continue
-        return None, last_err
+    global LAST_GEMINI_RESPONSE
+    try:
+        text_resp = gemini_gateway.generate_text(prompt, api_key=GEMINI_API_KEY, url=url, timeout=90,
+                                                 max_attempts=4, backoff=1.0, label="summarizer",
+                                                 cache=cache, deadline=deadline)
+    except Exception as e:
+        LAST_GEMINI_RESPONSE = gemini_gateway.last_response()
+        err = f'Error calling Gemini API: {e}'
+        print(err)
+        return None, err
+    # store last full body for debugging (not printed to terminal)
+    LAST_GEMINI_RESPONSE = gemini_gateway.last_response()
+    return text_resp, None
 
 
 @app.route('/debug/last_gemini', methods=['GET'])
@@ -238,43 +151,116 @@ def list_static():
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/summarize', methods=['POST'])
-def summarize():
+def build_summary_prompt(text, words):
+    return (
+        f"Summarize the following text into approximately {words} words. "
+        "Keep the important points, be concise and readable. Output only the summary, no extra commentary.\n\n"
+        f"{build_context(text, task='summary')}"
+    )
+
+
+def read_summarize_request():
+    """Parse a /summarize upload. Returns ((pdf_bytes, words, use_cache, pages), None) or (None, (error_body, status)).
+    `pages` is an optional page selection such as "1-20,35"."""
     if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+        return None, ({'error': 'No file part'}, 400)
 
     f = request.files['file']
     if f.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return None, ({'error': 'No selected file'}, 400)
 
     words_requested = request.form.get('words') or request.args.get('words') or request.form.get('summaryLength')
     try:
         words = int(words_requested)
     except Exception:
         words = 100
+    use_cache = (request.form.get('no_cache') or request.args.get('no_cache') or '').lower() not in ('1', 'true', 'yes')
+    pages = request.form.get('pages') or request.args.get('pages') or None
+    try:
+        check_page_spec(pages)
+    except ValueError as e:
+        return None, ({'error': f'Invalid pages {pages!r}: {e}'}, 400)
+    return (f.read(), words, use_cache, pages), None
 
-    # Extract text from pdf
-    file_stream = io.BytesIO(f.read())
-    text = extract_text_from_pdf(file_stream)
 
+def extract_summary_text(pdf_bytes, pages=None):
+    """Returns (text, None) or (None, (error_body, status)). Parsing stops once the
+    summary's source budget is filled, so long books are not read to the end."""
+    text = extract_pdf_text(pdf_bytes, max_chars=source_char_budget('summary'), pages=pages)
     if not text.strip():
-        return jsonify({'error': 'Unable to extract text from PDF or PDF is empty.'}), 400
+        return None, ({'error': 'Unable to extract text from PDF or PDF is empty.'}, 400)
+    return text, None
 
-    # Build prompt
-    prompt = (
-        f"Summarize the following text into approximately {words} words. "
-        "Keep the important points, be concise and readable. Output only the summary, no extra commentary.\n\n"
-        f"{text[:30000]}"
-    )
+
+def run_summary(pdf_bytes, words, use_cache=True, pages=None):
+    """Extraction + Gemini summary. Returns (body, status); runs inside a request or as a background job."""
+    text, err = extract_summary_text(pdf_bytes, pages)
+    if err:
+        return err
+
+    prompt = build_summary_prompt(text, words)
 
     # Rough token estimate: 1 token ~ 0.75 words; pick a safe max tokens value
     max_tokens = max(128, int(words * 1.8))
 
-    summary_text, err = call_gemini(prompt, max_tokens=max_tokens)
+    summary_text, err = call_gemini(prompt, max_tokens=max_tokens, cache=use_cache)
     if err:
-        return jsonify({'error': err}), 500
+        return {'error': err}, 500
+
+    return {'summary': summary_text}, 200
+
+
+@app.route('/summarize', methods=['POST'])
+def summarize():
+    parsed, err = read_summarize_request()
+    if err:
+        return jsonify(err[0]), err[1]
+    body, status = run_summary(*parsed)
+    return jsonify(body), status
+
+
+@app.route('/summarize/jobs', methods=['POST'])
+def summarize_job():
+    """Queue /summarize in the background (same multipart form): 202 {job_id, status_url};
+    poll GET /jobs/<job_id> or stream GET /jobs/<job_id>/events."""
+    parsed, err = read_summarize_request()
+    if err:
+        return jsonify(err[0]), err[1]
+    return submit_response('summary', run_summary, *parsed)
 
-    return jsonify({'summary': summary_text})
+
+register_job_routes(app)
+
+
+@app.route('/summarize/stream', methods=['POST'])
+def summarize_stream():
+    """Streaming variant of /summarize (same multipart form). The summary is
+    sent as Server-Sent Events: `delta` chunks, then `done` with the full text."""
+    parsed, err = read_summarize_request()
+    if err:
+        return jsonify(err[0]), err[1]
+    pdf_bytes, words, use_cache, pages = parsed
+    if not GEMINI_API_URL or not GEMINI_API_KEY:
+        return jsonify({'error': 'Gemini URL or API key not configured on server. Set GEMINI_API_URL and GEMINI_API_KEY in .env.'}), 500
+    text, err = extract_summary_text(pdf_bytes, pages)
+    if err:
+        return jsonify(err[0]), err[1]
+    prompt = build_summary_prompt(text, words)
+
+    def events():
+        pieces = []
+        try:
+            for delta in gemini_gateway.stream_text(prompt, api_key=GEMINI_API_KEY, url=GEMINI_API_URL,
+                                                    timeout=90, label="summarizer-stream", cache=use_cache,
+                                                    deadline=Deadline.for_task("summary")):
+                pieces.append(delta)
+                yield format_event({'delta': delta})
+            yield format_event({'summary': ''.join(pieces)}, event='done')
+        except Exception as e:
+            print(f'Error streaming summary from Gemini: {e}')
+            yield format_event({'error': f'Error calling Gemini API: {e}'}, event='error')
+
+    return sse_response(events())
 
 
 @app.route('/debug/summarize_text', methods=['POST'])
@@ -295,11 +281,7 @@ def debug_summarize_text():
     except Exception:
         words = 100
 
-    prompt = (
-        f"Summarize the following text into approximately {words} words. "
-        "Keep the important points, be concise and readable. Output only the summary, no extra commentary.\n\n"
-        f"{text[:30000]}"
-    )
+    prompt = build_summary_prompt(text, words)
     max_tokens = max(128, int(words * 1.8))
     summary_text, err = call_gemini(prompt, max_tokens=max_tokens)
     if err:
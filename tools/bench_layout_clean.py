@@ -0,0 +1,142 @@
+"""
+Compare header/footer removal: the geometric cleaner in the shared extractor
+(utils/layout.py, PyMuPDF block positions) against the text-only cleaners
+quiz_generator.clean_input_text and static/jsonq.clean_and_merge_pages.
+Requires: PyMuPDF (nltk/sklearn for the two regex cleaners; either is
+skipped when it cannot be imported)
+Usage:
+  python tools/bench_layout_clean.py [--pages 200] [--repeat 3]
+
+A synthetic textbook is generated with known furniture and known body text.
+Running heads alternate by page parity, chapter heads change every 10 pages,
+and footers carry "Page N of M". The body includes lines text cleaners tend
+to misfire on: short lines, acronyms, "Module"/"Chapter" in sentences, a
+definition repeated in every chapter, and "Figure 3 shows ...". For each
+cleaner the script reports:
+  furniture removed  share of header/footer lines absent from the output
+  body kept          share of body sentences present in the output
+  ms                 cleaning time (extraction time for the geometric path,
+                     with the plain-text extraction time shown for reference)
+"""
+import re
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "static"))
+
+from utils import layout  # noqa: E402
+from utils.extractors import fitz, extract_pdf, join_pages  # noqa: E402
+
+TOPICS = ["photosynthesis", "respiration", "mitosis", "osmosis", "enzymes", "transcription",
+          "translation", "homeostasis", "diffusion", "meiosis", "fermentation", "glycolysis"]
+TEMPLATES = [
+    "The process of {t} is regulated by several factors inside the cell.",
+    "Students often confuse {t} with {u}, although the two serve different purposes.",
+    "In Module {n} we revisit {t} and relate it to {u} in plants.",
+    "Figure {n} shows how {t} proceeds in stages over time.",
+    "DNA and RNA both take part in {t} in eukaryotic cells.",
+    "Chapter {n} introduces {t} through a short laboratory exercise.",
+    "Energy released during {t} is stored as ATP for later use.",
+]
+DEFINITION = "A catalyst speeds up a reaction without being consumed by it."
+SHORT_LINES = ["Key terms: {t}.", "Summary of {t}."]
+
+
+def make_book(path, pages, seed=7):
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    body, furniture = [], []
+    for n in range(pages):
+        chapter = n // 10 + 1
+        page = doc.new_page()
+        head = "BIOLOGY 101 - Cell Processes" if n % 2 else f"Chapter {chapter}: {TOPICS[chapter % len(TOPICS)].title()}"
+        foot = f"Page {n + 1} of {pages}"
+        page.insert_text((72, 40), head, fontsize=9)
+        page.insert_text((280, 815), foot, fontsize=9)
+        furniture += [head, foot]
+        lines = []
+        for _ in range(9):
+            t, u = rnd.sample(TOPICS, 2)
+            lines.append(rnd.choice(TEMPLATES).format(t=t, u=u, n=rnd.randint(1, 20)))
+        lines.insert(rnd.randint(0, len(lines)), rnd.choice(SHORT_LINES).format(t=rnd.choice(TOPICS)))
+        if n % 10 == 3:
+            lines.append(DEFINITION)
+        page.insert_textbox(fitz.Rect(72, 90, 523, 760), "\n".join(lines), fontsize=11)
+        body += lines
+    doc.save(path)
+    return body, furniture
+
+
+def _flat(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def score(output, body, furniture):
+    flat = _flat(output)
+    kept = sum(1 for s in body if _flat(s) in flat)
+    # a furniture string may legitimately occur several times; compare occurrence counts
+    leaked = 0
+    for line in set(furniture):
+        leaked += min(flat.count(_flat(line)), furniture.count(line))
+    return 1 - leaked / len(furniture), kept / len(body)
+
+
+def timed(fn, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return out, best * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description="header/footer cleaner quality and speed")
+    ap.add_argument("--pages", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    path = str(Path(tempfile.mkdtemp()) / "book.pdf")
+    body, furniture = make_book(path, args.pages)
+    data = Path(path).read_bytes()
+    print(f"{args.pages} pages, {len(body)} body sentences, {len(furniture)} header/footer lines")
+
+    layout.DISABLED = True
+    raw_pages, plain_ms = timed(lambda: extract_pdf(data, parallel=False, cache=False, use_ocr=False)["pages"],
+                                args.repeat)
+    layout.DISABLED = False
+    clean_pages, layout_ms = timed(lambda: extract_pdf(data, parallel=False, cache=False, use_ocr=False)["pages"],
+                                   args.repeat)
+    raw_lines = "\n".join(p["text"] for p in raw_pages)
+    raw_paged = "\f".join(p["text"] for p in raw_pages)
+
+    rows = [("none (raw text)", raw_lines, 0.0), ("layout (geometric)", join_pages(clean_pages), layout_ms - plain_ms)]
+    try:
+        from quiz_generator import clean_input_text
+        out, ms = timed(lambda: clean_input_text(raw_lines), args.repeat)
+        rows.append(("quiz_generator regex", out, ms))
+    except Exception as e:
+        print(f"quiz_generator unavailable: {e}")
+    try:
+        from jsonq import clean_and_merge_pages
+        out, ms = timed(lambda: clean_and_merge_pages(raw_paged), args.repeat)
+        rows.append(("jsonq regex", out, ms))
+    except Exception as e:
+        print(f"jsonq unavailable: {e}")
+
+    print(f"plain extraction {plain_ms:.1f} ms, with block positions + cleaning {layout_ms:.1f} ms")
+    print(f"  {'cleaner':<22} {'furniture removed':>18} {'body kept':>10} {'ms':>9}")
+    for name, out, ms in rows:
+        removed, kept = score(out, body, furniture)
+        print(f"  {name:<22} {removed:>17.1%} {kept:>10.1%} {ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
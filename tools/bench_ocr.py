@@ -0,0 +1,93 @@
+"""
+Benchmark the scanned-PDF OCR pipeline (utils/ocr.py): pages/sec with
+preprocessing (downscale + Otsu binarization) vs full-resolution OCR, and
+the cache-hit path.
+Requires: PyMuPDF, Pillow, pytesseract and the tesseract binary
+Usage:
+  python tools/bench_ocr.py path/to/scanned.pdf [--pages 10]
+
+Without a PDF argument, a synthetic scan is generated: text pages are
+rendered to images and re-inserted without a text layer.
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from utils import ocr  # noqa: E402
+from utils.extractors import fitz, extract_pdf  # noqa: E402
+
+
+def make_scan(path, pages=10, dpi=300):
+    para = ("Osmosis is the movement of water across a semi-permeable membrane from a region "
+            "of low solute concentration to a region of high solute concentration. ") * 5
+    src = fitz.open()
+    for n in range(pages):
+        page = src.new_page()
+        page.insert_textbox(fitz.Rect(60, 60, 540, 780), f"Unit {n + 1}\n\n{para}", fontsize=12)
+    out = fitz.open()
+    for page in src:
+        pix = page.get_pixmap(dpi=dpi, colorspace="gray")
+        new = out.new_page(width=page.rect.width, height=page.rect.height)
+        new.insert_image(new.rect, stream=pix.tobytes("png"))
+    out.save(path)
+    return path
+
+
+def timed(label, fn, pages):
+    t0 = time.perf_counter()
+    chars = fn()
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<24} {elapsed * 1000:>9.1f} ms  {pages / elapsed:>7.2f} pages/s  {chars:>7} chars")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="OCR pipeline throughput")
+    ap.add_argument("pdf", nargs="?")
+    ap.add_argument("--pages", type=int, default=10, help="size of the generated scan")
+    args = ap.parse_args()
+
+    if not ocr.available():
+        print("tesseract is not available (install the binary and pytesseract); nothing to measure")
+        raise SystemExit(1)
+
+    path = args.pdf
+    if not path:
+        path = str(Path(tempfile.mkdtemp()) / "scan.pdf")
+        make_scan(path, pages=args.pages)
+        print(f"No PDF given; generated {path}")
+    data = Path(path).read_bytes()
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        count = doc.page_count
+        images = [ocr.render_page(page, dpi=300) for page in doc]
+    print(f"{Path(path).name}: {count} pages, {ocr.OCR_WORKERS} OCR worker(s)")
+
+    def raw():
+        return sum(len(ocr.pytesseract.image_to_string(im)) for im in images)
+
+    def pipeline():
+        ocr.ocr_cache.memory.clear()
+        return sum(len(t) for t in ocr.ocr_images(images, use_cache=False))
+
+    def extract_cold():
+        r = extract_pdf(data, cache=False)
+        return sum(p["chars"] for p in r["pages"])
+
+    def extract_cached():
+        r = extract_pdf(data)
+        return sum(p["chars"] for p in r["pages"])
+
+    timed("full-res, sequential", raw, count)
+    timed("preprocessed, pool", pipeline, count)
+    timed("extract_pdf (OCR)", extract_cold, count)
+    extract_cached()
+    timed("extract_pdf (cached)", extract_cached, count)
+    print(ocr.stats())
+
+
+if __name__ == "__main__":
+    main()
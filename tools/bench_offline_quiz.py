@@ -0,0 +1,199 @@
+"""
+Benchmark the offline quiz generator's NLP stages: the single-pass
+AnnotatedDocument (quiz_generator.py) against the passes the generator used
+to make. Those were a sentence split for chunking, another per chunk, two
+tokenize+tag runs over the whole text (keywords, POS pools) and another per
+visited sentence. The end-to-end generate_offline_quiz time is also shown.
+It also times keyword lookup: a regex built and run over the whole text for
+each of the 200 candidate keywords (the old top-up loop), against the
+document's word->sentence index. Last, document distractors
+(utils/distractors.py): building the term vectors, then the neighbours of
+--amount answers from one batched sparse product against one call per answer.
+Requires: nltk (with punkt/averaged_perceptron_tagger data for real tagging;
+without them both sides use the same fallbacks), scikit-learn
+Usage:
+  python tools/bench_offline_quiz.py [document.pdf|document.txt] [--pages 100] [--amount 10] [--repeat 3]
+
+Without a document, a synthetic text of --pages pages (~2,500 characters
+each) is generated.
+"""
+import re
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import nltk  # noqa: E402
+import quiz_generator as qg  # noqa: E402
+from utils.distractors import DistractorEngine  # noqa: E402
+
+TOPICS = ["photosynthesis", "chlorophyll", "mitochondria", "osmosis", "enzymes", "ribosomes",
+          "Mendel", "Darwin", "glucose", "membranes", "chromosomes", "nucleus", "Krebs", "ATP"]
+TEMPLATES = [
+    "The {t} plays a central role in how {u} is produced inside the cell.",
+    "In 1865 {t} described experiments that later explained {u} in plants.",
+    "Scientists measured {t} levels across 40 samples to compare them with {u}.",
+    "Without {t} the cell cannot maintain {u} for more than a few hours.",
+    "Most textbooks introduce {t} before {u} because the ideas build on each other.",
+]
+
+
+SYLLABLES = ["cyto", "phos", "gly", "lipo", "nucle", "mito", "chloro", "ribo", "hydro", "osmo",
+             "kine", "plas", "geno", "troph", "zyme", "lyso", "vacu", "thyla", "stroma", "carbo"]
+
+
+def make_text(pages, seed=11):
+    """Textbook-like text: a few core topics throughout, plus terms local to
+    each 10-page chapter, so keywords occur all over the document."""
+    rnd = random.Random(seed)
+    terms = [a + b + "ase" for a in SYLLABLES for b in SYLLABLES if a != b]
+    out = []
+    for n in range(pages):
+        local = terms[(n // 10) * 8:(n // 10) * 8 + 8]
+        page = []
+        while sum(len(s) for s in page) < 2500:
+            t, u = rnd.choice(TOPICS), rnd.choice(local)
+            page.append(rnd.choice(TEMPLATES).format(t=t, u=u) if rnd.random() < 0.5
+                        else rnd.choice(TEMPLATES).format(t=u, u=t))
+        out.append(" ".join(page))
+    return "\n\n".join(out)
+
+
+def nltk_data(resource):
+    try:
+        nltk.data.find(resource)
+        return True
+    except LookupError:
+        return False
+
+
+def annotators():
+    """(sent_tokenize, word_tokenize, pos_tag) as the old code called them. When
+    NLTK data is missing, punkt is replaced by the regex sentence splitter and the
+    tagger by all-NN, so both sides still do the same work. word_tokenize keeps
+    its definition: split into sentences, then Treebank-tokenize each (the
+    Treebank tokenizer needs no data)."""
+    have_punkt = nltk_data("tokenizers/punkt_tab")
+    have_tagger = nltk_data("taggers/averaged_perceptron_tagger_eng")
+    sent = nltk.sent_tokenize if have_punkt else (
+        lambda t: [s.strip() for s in re.split(r'(?<=[\.\!?])\s+', t.strip()) if s.strip()])
+    word = nltk.word_tokenize if have_punkt else (
+        lambda t: [tok for s in sent(t) for tok in nltk.word_tokenize(s, preserve_line=True)])
+    tag = nltk.pos_tag if have_tagger else (lambda toks: [(w, 'NN') for w in toks])
+    return sent, word, tag, have_punkt and have_tagger
+
+
+def legacy_passes(text, amount):
+    sent_tokenize, word_tokenize, pos_tag, _ = annotators()
+    chunks, cur, words = [], [], 0
+    for s in sent_tokenize(text):
+        w = len(s.split())
+        if words + w > 300 and cur:
+            chunks.append(" ".join(cur))
+            cur, words = [s], w
+        else:
+            cur.append(s)
+            words += w
+    if cur:
+        chunks.append(" ".join(cur))
+    pos_tag([w for w in word_tokenize(text) if w.isalpha()])  # extract_candidate_keywords
+    pos_tag(word_tokenize(text))  # pos_pools
+    visited = 0
+    for chunk in chunks:
+        for sent in sent_tokenize(chunk):
+            if len(sent.split()) < 6:
+                continue
+            pos_tag(word_tokenize(sent))
+            visited += 1
+            if visited >= amount:
+                return
+
+
+def single_pass(text, amount):
+    doc = qg.AnnotatedDocument(text)
+    [doc.chunk_text(ids) for ids in doc.chunks(300)]
+    doc.candidate_keywords(200)
+    return doc.tags
+
+
+def legacy_lookup(text, keywords):
+    for kw in keywords:
+        m = re.search(r"([^.?!]*\b" + re.escape(kw) + r"\b[^.?!]*)[.?!]", text, flags=re.IGNORECASE)
+        if m:
+            re.compile(r"\b" + re.escape(kw) + r"\b", flags=re.IGNORECASE).sub("_____", m.group(1), count=1)
+
+
+def index_lookup(doc, keywords):
+    # sentences are already split for the rest of the pipeline; time the index itself
+    doc.__dict__.pop("word_spans", None)
+    doc.__dict__.pop("index", None)
+    for kw in keywords:
+        ids = doc.sentences_with(kw)
+        if ids:
+            doc.mask(ids[0], kw)
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description="offline quiz NLP stage timing")
+    ap.add_argument("document", nargs="?")
+    ap.add_argument("--pages", type=int, default=100)
+    ap.add_argument("--amount", type=int, default=10)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    if args.document and args.document.lower().endswith(".pdf"):
+        from utils.extractors import extract_pdf_text
+        text = extract_pdf_text(args.document)
+    elif args.document:
+        text = Path(args.document).read_text(encoding="utf-8", errors="ignore")
+    else:
+        text = make_text(args.pages)
+    text = qg.clean_input_text(text)
+    full_nltk = annotators()[3]
+    print(f"{len(text)} chars after cleaning; NLP: {'NLTK' if full_nltk else 'fallbacks (NLTK punkt/tagger data missing)'}")
+
+    before = best_of(lambda: legacy_passes(text, args.amount), args.repeat)
+    after = best_of(lambda: single_pass(text, args.amount), args.repeat)
+    total = best_of(lambda: qg.generate_offline_quiz(text, amount=args.amount), args.repeat)
+    print(f"  old multi-pass annotation   {before:>9.1f} ms")
+    print(f"  AnnotatedDocument (1 pass)  {after:>9.1f} ms   {before / after:.1f}x faster")
+    print(f"  generate_offline_quiz       {total:>9.1f} ms   (end to end, {args.amount} questions)")
+
+    doc = qg.AnnotatedDocument(text)
+    keywords = doc.candidate_keywords(200)
+    before = best_of(lambda: legacy_lookup(text, keywords), args.repeat)
+    after = best_of(lambda: index_lookup(doc, keywords), args.repeat)
+    print(f"  {len(keywords)} keyword lookups, regex scans    {before:>9.1f} ms")
+    print(f"  {len(keywords)} keyword lookups, word index     {after:>9.1f} ms   "
+          f"{before / after:.1f}x faster (index build included)")
+
+    engine, build = None, None
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        engine = DistractorEngine.from_document(doc)
+        elapsed = (time.perf_counter() - t0) * 1000
+        build = elapsed if build is None else min(build, elapsed)
+    answers = keywords[:args.amount]
+    before = best_of(lambda: [engine.nearest([a], 3, keywords) for a in answers], args.repeat)
+    after = best_of(lambda: engine.nearest(answers, 3, keywords), args.repeat)
+    print(f"  distractor vectors, {len(engine)} terms x {engine.vectors.shape[1]} contexts  {build:>9.1f} ms")
+    print(f"  {len(answers)} answers' neighbours, one call each   {before:>9.2f} ms")
+    print(f"  {len(answers)} answers' neighbours, one batch       {after:>9.2f} ms   {before / after:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
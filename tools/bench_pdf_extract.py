@@ -0,0 +1,100 @@
+"""
+Benchmark PDF text extraction: the shared PyMuPDF extractor (utils/extractors.py),
+single-core and with the page-range process pool, against the PyPDF2 loop the
+summarizer and study apps used before.
+Requires: PyMuPDF (PyPDF2 optional, for the "before" numbers)
+Usage:
+  python tools/bench_pdf_extract.py path/to/syllabus.pdf [more.pdf ...] [--repeat 3]
+
+Without arguments a synthetic text PDF (--pages, default 200) is generated in a temp dir so
+the script always has something to measure. Prints pages/sec per engine.
+"""
+import io
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from utils.extractors import fitz, extract_pdf, EXTRACT_WORKERS  # noqa: E402
+
+try:
+    import PyPDF2
+except ImportError:
+    PyPDF2 = None
+
+
+def make_sample(path, pages=200):
+    para = ("Photosynthesis converts light energy into chemical energy stored in glucose. "
+            "Chlorophyll in the thylakoid membranes absorbs red and blue light. ") * 6
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Chapter {n // 20 + 1}, page {n + 1}\n\n{para}\n\n{para}",
+                            fontsize=10)
+    doc.save(path)
+    return path
+
+
+def bench_pymupdf(data):
+    result = extract_pdf(data, parallel=False)
+    return len(result["pages"]), sum(p["chars"] for p in result["pages"])
+
+
+def bench_pymupdf_pool(data):
+    result = extract_pdf(data, parallel=True)
+    return len(result["pages"]), sum(p["chars"] for p in result["pages"])
+
+
+def bench_pypdf2(data):
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    chars = 0
+    for page in reader.pages:
+        chars += len(page.extract_text() or "")
+    return len(reader.pages), chars
+
+
+def run(name, fn, data, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        pages, chars = fn(data)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {name:<12} {pages:>5} pages {chars:>9} chars  {best * 1000:>8.1f} ms  {pages / best:>8.1f} pages/s")
+    return pages / best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("pdfs", nargs="*")
+    ap.add_argument("--repeat", type=int, default=3, help="runs per engine; the best is reported")
+    ap.add_argument("--pages", type=int, default=200, help="size of the generated sample")
+    args = ap.parse_args()
+
+    paths = [Path(p) for p in args.pdfs]
+    if not paths:
+        tmp = Path(tempfile.mkdtemp()) / "sample.pdf"
+        paths = [Path(make_sample(str(tmp), pages=args.pages))]
+        print(f"No PDFs given; generated {tmp}")
+    if PyPDF2 is None:
+        print("PyPDF2 not installed; only the PyMuPDF numbers are shown")
+
+    for path in paths:
+        data = path.read_bytes()
+        print(f"{path.name} ({len(data) / 1024:.0f} KiB)")
+        after = run("pymupdf", bench_pymupdf, data, args.repeat)
+        # first pool call pays for spawning the workers; warm it up outside the timing
+        bench_pymupdf_pool(data)
+        pooled = run(f"pymupdf x{EXTRACT_WORKERS}", bench_pymupdf_pool, data, args.repeat)
+        print(f"  pool speedup {pooled / after:.1f}x over one core")
+        if PyPDF2 is not None:
+            before = run("pypdf2", bench_pypdf2, data, args.repeat)
+            print(f"  pymupdf speedup {after / before:.1f}x over pypdf2 (one core)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Repeat quizzes on one document: generate_offline_quiz per request (what
+/generate-quiz did before) against the question bank (utils/question_bank.py):
+the first request banks what it needs, a top-up (a background job in the app,
+timed separately here) grows the bank, and later requests sample it. It also reports how many chunks of the
+document the questions come from, for a plain pool of the same size and for
+the spread fill, and how sampling time changes with the number of questions
+already seen (with a synthetic bank of --bank-size questions).
+Requires: the quiz_generator dependencies (nltk, scikit-learn, PyMuPDF)
+Usage:
+  python tools/bench_question_bank.py [document.pdf|document.txt] [--pages 100] [--amount 10] [--requests 20]
+
+Without a document, the synthetic text from tools/bench_offline_quiz.py is
+used. The bank lives in a temporary directory.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tools"))
+
+import quiz_generator as qg  # noqa: E402
+from utils.question_bank import QuestionBank, BANK_SIZE, bank_key  # noqa: E402
+from bench_offline_quiz import make_text  # noqa: E402
+
+
+def chunk_coverage(text, questions):
+    """How many of the document's ~300-word chunks the questions come from."""
+    doc = qg.AnnotatedDocument(qg.clean_input_text(text))
+    chunk_of = {}
+    for c, ids in enumerate(doc.chunks(max_words=300)):
+        for i in ids:
+            chunk_of.setdefault(doc.sentences[i][:320], c)
+    used = {chunk_of.get(q["context"]) for q in questions} - {None}
+    return len(used), len(doc.chunks(max_words=300))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="question bank vs per-request generation")
+    ap.add_argument("document", nargs="?")
+    ap.add_argument("--pages", type=int, default=100)
+    ap.add_argument("--amount", type=int, default=10)
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--bank-size", type=int, default=5000)
+    args = ap.parse_args()
+
+    if args.document and args.document.lower().endswith(".pdf"):
+        from utils.extractors import extract_pdf
+        text = "\n".join(p["text"] for p in extract_pdf(args.document)["pages"])
+    elif args.document:
+        text = Path(args.document).read_text(encoding="utf-8", errors="ignore")
+    else:
+        text = make_text(args.pages)
+    cleaned = qg.clean_input_text(text)
+    qg.generate_offline_quiz(cleaned, amount=1)  # load WordNet / tagger once, outside the timings
+
+    t0 = time.perf_counter()
+    for _ in range(args.requests):
+        qg.generate_offline_quiz(cleaned, amount=args.amount)
+    direct = time.perf_counter() - t0
+
+    bank = QuestionBank(os.path.join(tempfile.mkdtemp(), "question_bank.sqlite3"))
+    key = bank_key(cleaned, "medium", "offline")
+    target = max(args.amount, BANK_SIZE)
+    served = set()
+    t0 = time.perf_counter()
+    quiz = bank.serve(key, args.amount, user="bench", source="offline", target=args.amount,
+                      fill=lambda: qg.generate_offline_quiz(cleaned, amount=args.amount, spread=True))
+    first = time.perf_counter() - t0
+    served.update(q["question"] for q in quiz)
+    pool = []
+    t0 = time.perf_counter()
+    bank.top_up(key, lambda: pool.extend(qg.generate_offline_quiz(cleaned, amount=target, spread=True)) or pool,
+                source="offline", target=target)
+    top_up = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(args.requests - 1):
+        quiz = bank.serve(key, args.amount, user="bench", source="offline", target=args.amount, fill=list)
+        served.update(q["question"] for q in quiz)
+    banked = first + time.perf_counter() - t0
+    stats = bank.stats()
+
+    print(f"{len(cleaned):,} characters, {args.requests} requests of {args.amount} questions")
+    print(f"  generate per request   {direct * 1000:>9.1f} ms total  {direct / args.requests * 1000:>8.2f} ms/request")
+    print(f"  question bank          {banked * 1000:>9.1f} ms total  {stats['avg_sample_ms']:>8.2f} ms/sample "
+          f"(first request {first * 1000:.1f} ms; background top-up to {stats['questions']} questions: "
+          f"{top_up * 1000:.1f} ms)")
+    print(f"  {direct / banked:.1f}x faster; {len(served)} distinct questions served "
+          f"({stats['rounds']} new round(s) for the user)")
+
+    plain = qg.generate_offline_quiz(cleaned, amount=target)
+    used, total = chunk_coverage(text, plain)
+    spread_used, _ = chunk_coverage(text, pool)
+    print(f"  chunks covered by {target} questions: ranked order {used}/{total}, spread {spread_used}/{total}")
+
+    big = QuestionBank(os.path.join(tempfile.mkdtemp(), "question_bank.sqlite3"))
+    big.store("big", [{"question": f"q{i}", "options": [], "answer": ""} for i in range(args.bank_size)],
+              "offline", target=args.bank_size)
+    print(f"  sampling {args.amount} from a {args.bank_size}-question bank:")
+    for frac in (0.0, 0.5, 0.9):
+        user = f"seen-{frac}"
+        big._mark_seen(big._conn(), user, "big", range(int(args.bank_size * frac)))
+        t0 = time.perf_counter()
+        for _ in range(50):
+            big.sample("big", args.amount, user=user)
+        print(f"    {frac:>4.0%} seen  {(time.perf_counter() - t0) / 50 * 1000:.2f} ms/sample")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Time `import quiz_generator` in fresh processes: the old import, which
+imported nltk and called nltk.download for four resources, against the
+current one (file checks only, nltk imported on first use).
+Requires: the quiz_generator dependencies (nltk, scikit-learn, PyMuPDF)
+Usage:
+  python tools/bench_startup.py [--repeat 5] [--net-timeout 0]
+
+Each child counts its network attempts (DNS lookups and connects). With
+--net-timeout N, every attempt blocks N seconds and then fails, like a
+firewalled host where packets are dropped. Without it the real network is
+used, and the old path costs however long the downloads take to fail or
+finish.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# runs first in every child: count (and optionally stall) network attempts
+PRELUDE = """
+import socket, time
+attempts = [0]
+def _stall(real):
+    def wrapper(*a, **kw):
+        attempts[0] += 1
+        if {timeout} > 0:
+            time.sleep({timeout})
+            raise OSError("network unreachable (emulated)")
+        return real(*a, **kw)
+    return wrapper
+socket.create_connection = _stall(socket.create_connection)
+socket.getaddrinfo = _stall(socket.getaddrinfo)
+t0 = time.perf_counter()
+"""
+
+OLD = """
+import nltk
+for res in ("punkt", "averaged_perceptron_tagger", "wordnet", "stopwords"):
+    try:
+        nltk.download(res, quiet=True)
+    except Exception:
+        pass
+import quiz_generator
+"""
+
+NEW = """
+import quiz_generator
+"""
+
+REPORT = """
+import sys, json
+print(json.dumps({"s": time.perf_counter() - t0, "net": attempts[0], "nltk": "nltk" in sys.modules}))
+"""
+
+
+def run(body, timeout):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.getenv("PYTHONPATH")])),
+               HEALTH_MONITOR_DISABLED="1")
+    code = PRELUDE.format(timeout=timeout) + body + REPORT
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="quiz_generator import time")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--net-timeout", type=float, default=0.0,
+                    help="seconds each network attempt blocks before failing (0: real network)")
+    args = ap.parse_args()
+
+    print(f"import quiz_generator, best of {args.repeat} fresh processes"
+          + (f", network attempts stall {args.net_timeout:g} s" if args.net_timeout else ", real network"))
+    results = {}
+    for name, body in (("old (nltk.download at import)", OLD), ("new (prepared data, lazy nltk)", NEW)):
+        runs = [run(body, args.net_timeout) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r["s"])
+        results[name] = best["s"]
+        print(f"  {name:<32} {best['s'] * 1000:>9.1f} ms   network attempts {best['net']}, "
+              f"nltk imported: {'yes' if best['nltk'] else 'no'}")
+    old, new = results.values()
+    print(f"  {old / new:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Throughput of the shared line cleaners (utils/textclean.py) against the
+per-line regex loops they replaced in quiz_generator.clean_input_text and
+static/jsonq.clean_and_merge_pages. Both old loops are replayed below as
+they were. Outputs are checked to be identical, and throughput is reported
+in MB/s of input.
+Requires: nothing beyond the standard library (PyMuPDF for a PDF argument)
+Usage:
+  python tools/bench_textclean.py [document.pdf|document.txt] [--mb 20] [--repeat 3]
+
+Without a document, a synthetic textbook of about --mb megabytes is
+generated: pages separated by form feeds, each with a running head, a page
+number, a few bullets, TOC-like lines and body sentences. "streamed" feeds
+the same text in 64 KB pieces, as an extractor producing pages would.
+"""
+import re
+import sys
+import time
+import random
+import argparse
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from utils import textclean  # noqa: E402
+
+WORDS = ["cell", "membrane", "osmosis", "protein", "enzyme", "energy", "glucose", "chloroplast", "nucleus",
+         "diffusion", "gradient", "reaction", "structure", "function", "transport", "molecule", "water"]
+
+
+def make_text(mb, seed=5):
+    rnd = random.Random(seed)
+    pages, size, n = [], 0, 0
+    while size < mb * 1_000_000:
+        n += 1
+        lines = [f"BIOLOGY 101 - Chapter {n // 12 + 1}", f"Page {n}"]
+        for _ in range(rnd.randint(28, 40)):
+            kind = rnd.random()
+            if kind < 0.06:
+                lines.append(f"• {' '.join(rnd.sample(WORDS, 4))}")
+            elif kind < 0.08:
+                lines.append(f"{n}.{rnd.randint(1, 9)} {rnd.choice(WORDS).title()} ........ {n + 3}")
+            elif kind < 0.10:
+                lines.append(f"Figure {rnd.randint(1, 40)} shows the {rnd.choice(WORDS)}")
+            else:
+                words = [rnd.choice(WORDS) for _ in range(rnd.randint(6, 14))]
+                lines.append(" ".join(words).capitalize() + ".")
+        page = "\n".join(lines)
+        pages.append(page)
+        size += len(page) + 1
+    return "\f".join(pages)
+
+
+# ---- quiz_generator.clean_input_text, as it was ----
+def legacy_clean_input_text(raw_text):
+    txt = unicodedata.normalize("NFKC", raw_text or "")
+    lines = [ln.strip() for ln in txt.splitlines() if ln.strip()]
+    lines = [ln for ln in lines if len(ln.split()) > 2]
+    junk_patterns = [
+        r"^\s*page\s*\d+\b",
+        r"^\s*\d+\s*$",
+        r"^\s*figure\s*\d+",
+        r"^\s*fig\.\s*\d+",
+        r"copyright\b",
+        r"doi:",
+        r"http[s]?:\/\/",
+    ]
+    filtered = []
+    for ln in lines:
+        low = ln.lower()
+        if any(re.search(p, low) for p in junk_patterns):
+            continue
+        filtered.append(ln)
+    counts = Counter(filtered)
+    cleaned = [ln for ln in filtered if counts[ln] < max(3, len(filtered)//30)]
+    out = " ".join(cleaned)
+    out = re.sub(r"\s+", " ", out).strip()
+    return out if out else raw_text
+
+
+# ---- static/jsonq.clean_and_merge_pages, as it was ----
+_EMOJI_RE = re.compile("[\U0001F300-\U0001F6FF\u2600-\u26FF\u2700-\u27BF]", flags=re.UNICODE)
+
+
+def _strip_noise_chars(s):
+    s = _EMOJI_RE.sub('', s)
+    s = s.replace('\xa0', ' ')
+    s = re.sub(r'^[\s\-\u2022\u25CF\u25CB\u25A0\u25B2\u2023\u2043]+', '', s)
+    return s.strip()
+
+
+def _normalize_line(line):
+    ln = unicodedata.normalize("NFKC", line).strip()
+    ln = _strip_noise_chars(ln)
+    return re.sub(r'\s+', ' ', ln)
+
+
+def _split_into_segments(raw_text, seg_chars=3500):
+    text = raw_text.strip()
+    if not text:
+        return []
+    if '\f' in text:
+        return [seg for seg in text.split('\f') if seg.strip()]
+    if '\n\n' in text:
+        return [seg for seg in text.split('\n\n') if seg.strip()]
+    return [text[i:i + seg_chars] for i in range(0, len(text), seg_chars)]
+
+
+def _simple_sent_tokenize(text):
+    return [s.strip() for s in re.split(r'(?<=[.!?])\s+', text) if s.strip()]
+
+
+def _extract_lines_from_segment(seg):
+    seg = seg.replace('\r', '\n')
+    if '\n' in seg:
+        return [_normalize_line(line) for line in seg.split('\n') if line.strip()]
+    return [_normalize_line(s) for s in _simple_sent_tokenize(seg) if s.strip()]
+
+
+def _detect_repeated_lines(segments, threshold_frac=0.30):
+    freq = Counter()
+    for seg in segments:
+        for line in set(_extract_lines_from_segment(seg)):
+            freq[line] += 1
+    seg_count = max(1, len(segments))
+    return {line for line, cnt in freq.items() if cnt / seg_count >= threshold_frac}
+
+
+def _looks_like_page_number(line):
+    if re.match(r'^\s*\d+\s*$', line):
+        return True
+    if re.match(r'^\s*(page|pg|p)\.?\s*\d+\s*$', line, flags=re.I):
+        return True
+    return bool(re.match(r'^\(\d+\)$', line.strip()))
+
+
+def _looks_like_toc_or_range(line):
+    if re.search(r'\.{3,}', line):
+        return True
+    if re.search(r'\bcontents\b', line, flags=re.I):
+        return True
+    return bool(re.match(r'^\s*\d+(\.\d+){0,3}\s*[-–—]\s*\d+(\.\d+){0,3}\s*$', line))
+
+
+def _looks_like_header_token(line):
+    if re.search(r'\b[A-Z]{2,}\d{2,}\b', line):
+        return True
+    if re.search(r'\b(syllabus|module|chapter|textbook|contents|index|introduction|overview|syllabus)\b', line,
+                 flags=re.I):
+        return True
+    words = re.findall(r'\b[A-Za-z]+\b', line)
+    if words:
+        up = sum(1 for w in words if w.isupper())
+        if up >= max(1, len(words)//2):
+            return True
+    return False
+
+
+def legacy_clean_and_merge_pages(raw_text):
+    segments = _split_into_segments(raw_text)
+    if not segments:
+        return ""
+    repeated = _detect_repeated_lines(segments)
+    kept = []
+    for seg in segments:
+        for raw_line in _extract_lines_from_segment(seg):
+            line = _normalize_line(raw_line)
+            if not line or line in repeated or _looks_like_page_number(line) or _looks_like_toc_or_range(line):
+                continue
+            if _looks_like_header_token(line):
+                continue
+            if len(re.findall(r"\b[a-zA-Z]{2,}\b", line.lower())) <= 3:
+                continue
+            kept.append(line)
+    merged = unicodedata.normalize("NFKC", " ".join(kept))
+    return re.sub(r'\s+', ' ', merged).strip()
+
+
+def streamed_text(text, piece=65536):
+    cleaner = textclean.TextCleaner()
+    for i in range(0, len(text), piece):
+        cleaner.feed(text[i:i + piece])
+    return cleaner.finish() or text
+
+
+def timed(fn, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return out, best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="text cleaner throughput")
+    ap.add_argument("document", nargs="?")
+    ap.add_argument("--mb", type=float, default=20)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    if args.document and args.document.lower().endswith(".pdf"):
+        from utils.extractors import extract_pdf
+        text = "\f".join(p["text"] for p in extract_pdf(args.document)["pages"])
+    elif args.document:
+        text = Path(args.document).read_text(encoding="utf-8", errors="ignore")
+    else:
+        text = make_text(args.mb)
+    mb = len(text.encode("utf-8")) / 1e6
+    print(f"{mb:.1f} MB of input, {text.count(chr(10)) + 1} lines")
+
+    rows = [
+        ("clean_input_text", legacy_clean_input_text, lambda t: textclean.clean_text(t) or t),
+        ("clean_input_text (streamed)", legacy_clean_input_text, streamed_text),
+        ("clean_and_merge_pages", legacy_clean_and_merge_pages,
+         lambda t: textclean.clean_pages(_split_into_segments(t))),
+    ]
+    print(f"  {'cleaner':<28} {'old MB/s':>9} {'new MB/s':>9} {'speedup':>8}  same output")
+    legacy_cache = {}
+    for name, old_fn, new_fn in rows:
+        if old_fn not in legacy_cache:
+            legacy_cache[old_fn] = timed(lambda: old_fn(text), args.repeat)
+        old_out, old_s = legacy_cache[old_fn]
+        new_out, new_s = timed(lambda: new_fn(text), args.repeat)
+        print(f"  {name:<28} {mb / old_s:>9.1f} {mb / new_s:>9.1f} {old_s / new_s:>7.1f}x  "
+              f"{'yes' if old_out == new_out else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
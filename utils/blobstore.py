@@ -0,0 +1,261 @@
+"""Content-addressed store for chat uploads.
+
+Each upload is hashed (SHA-256) while it is streamed to a temporary file and
+kept once, at `blobs/<2 hex>/<2 hex>/<digest><ext>` under the upload folder.
+The sharding keeps each directory small no matter how many files pile up.
+The URL `/uploads/blobs/...` is derived from the digest, so it never changes
+and the same file uploaded twice gets the same URL.
+
+A SQLite index (`cache/uploads/index.sqlite3`, outside the served upload
+folder) records size, mimetype and a reference count per blob. A stored blob starts with no references.
+The chat app calls `add_ref` once the Firestore message that links to it
+exists, and `release` when that message is deleted. A GC thread per worker
+process (`ensure_gc`) removes blobs that have had no references for
+`BLOB_GC_GRACE` seconds. That covers deleted chats and uploads whose
+message was never saved.
+
+Writers take SQLite's write lock (BEGIN IMMEDIATE) around the rename or
+unlink of a blob file. A concurrent upload and GC pass across workers
+therefore can't leave an index row without its file.
+
+Uploads are written to `blobs/.staging` first, on the same filesystem so the
+final rename is atomic. The chat app serves the upload folder through a
+route that checks `servable()`, which refuses dot-paths such as the staging
+area and an index left behind by older versions.
+
+Files saved before this store (`uploads/<uuid>_<name>`) are not touched;
+their URLs keep working through that route.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import mimetypes
+import shutil
+import tempfile
+import threading
+
+from utils.cache import CACHE_DIR
+
+logger = logging.getLogger("blobstore")
+
+COPY_BLOCK_BYTES = 64 * 1024
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+GC_INTERVAL = _env_int("BLOB_GC_INTERVAL", 3600)
+GC_GRACE = _env_int("BLOB_GC_GRACE", 3600)
+GC_DISABLED = str(os.getenv("BLOB_GC_DISABLED") or "").lower() in ("1", "true", "yes")
+
+
+class BlobStore:
+    def __init__(self, root, url_prefix="/uploads", state_dir=None):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/")
+        self.blob_dir = os.path.join(root, "blobs")
+        self.staging_dir = os.path.join(self.blob_dir, ".staging")
+        # the index must not be reachable through the upload URL space
+        self.state_dir = state_dir or os.path.join(CACHE_DIR, "uploads")
+        self.index_path = os.path.join(self.state_dir, "index.sqlite3")
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self.counters = {"stored": 0, "deduplicated": 0, "bytes_saved": 0, "released": 0, "collected": 0}
+        self._gc_pid = None
+        self._gc_lock = threading.Lock()
+
+    # -- plumbing --
+    def _conn(self):
+        # one connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            if not self._ready:
+                with self._init_lock:
+                    os.makedirs(self.staging_dir, exist_ok=True)
+                    os.makedirs(self.state_dir, exist_ok=True)
+                    self._adopt_legacy_index()
+            conn = sqlite3.connect(self.index_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS blobs ("
+                    " digest TEXT PRIMARY KEY, path TEXT NOT NULL, mimetype TEXT, filename TEXT,"
+                    " size INTEGER NOT NULL, refcount INTEGER NOT NULL DEFAULT 0,"
+                    " uploaded_at REAL NOT NULL, released_at REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS blobs_unreferenced ON blobs(refcount, released_at)")
+                self._ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _adopt_legacy_index(self):
+        """Move an index kept inside the upload folder (older versions) to state_dir."""
+        legacy = os.path.join(self.root, "index.sqlite3")
+        if not os.path.exists(legacy) or os.path.exists(self.index_path):
+            return
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(legacy + suffix):
+                shutil.move(legacy + suffix, self.index_path + suffix)
+        logger.info("moved upload index %s to %s", legacy, self.index_path)
+
+    def servable(self, relpath):
+        """Whether `relpath` (under root) may be served: stored files only, never
+        dot-paths (staging area) or an index file."""
+        parts = relpath.replace("\\", "/").split("/")
+        return not any(p.startswith(".") for p in parts) and not parts[-1].startswith("index.sqlite3")
+
+    def _relpath(self, digest, mimetype):
+        ext = mimetypes.guess_extension(mimetype or "") or ""
+        if ext in (".jpe", ".jpeg"):
+            ext = ".jpg"
+        return os.path.join("blobs", digest[:2], digest[2:4], digest + ext)
+
+    def url_for(self, relpath):
+        return f"{self.url_prefix}/{relpath.replace(os.sep, '/')}"
+
+    def _record(self, row):
+        digest, path, mimetype, filename, size, refcount = row
+        return {"sha256": digest, "path": os.path.join(self.root, path), "url": self.url_for(path),
+                "mimetype": mimetype, "filename": filename, "size": size, "refcount": refcount}
+
+    # -- public API --
+    def put(self, stream, mimetype=None, filename=None):
+        """Store the contents of a binary stream. Returns the blob record plus
+        `deduplicated` (True when identical bytes were already stored)."""
+        conn = self._conn()
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.staging_dir, prefix="upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for block in iter(lambda: stream.read(COPY_BLOCK_BYTES), b""):
+                    h.update(block)
+                    out.write(block)
+                    size += len(block)
+            digest = h.hexdigest()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT digest, path, mimetype, filename, size, refcount FROM blobs WHERE digest=?",
+                                   (digest,)).fetchone()
+                if row is not None and os.path.exists(os.path.join(self.root, row[1])):
+                    # restart the grace period of an unreferenced blob so GC can't take it
+                    # before the caller's add_ref
+                    conn.execute("UPDATE blobs SET released_at=? WHERE digest=? AND refcount<=0", (now, digest))
+                    conn.execute("COMMIT")
+                    self.counters["deduplicated"] += 1
+                    self.counters["bytes_saved"] += size
+                    return dict(self._record(row), deduplicated=True)
+                relpath = self._relpath(digest, mimetype)
+                dest = os.path.join(self.root, relpath)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(tmp, dest)
+                tmp = None
+                # a row whose file went missing keeps its references
+                refcount = row[5] if row is not None else 0
+                conn.execute(
+                    "INSERT OR REPLACE INTO blobs(digest, path, mimetype, filename, size, refcount, uploaded_at, released_at)"
+                    " VALUES (?,?,?,?,?,?,?,?)",
+                    (digest, relpath, mimetype, filename, size, refcount, now, None if refcount else now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.counters["stored"] += 1
+            return dict(self._record((digest, relpath, mimetype, filename, size, refcount)), deduplicated=False)
+        finally:
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def get(self, digest):
+        row = self._conn().execute("SELECT digest, path, mimetype, filename, size, refcount FROM blobs WHERE digest=?",
+                                   (digest,)).fetchone()
+        return self._record(row) if row else None
+
+    def add_ref(self, digest):
+        self._conn().execute("UPDATE blobs SET refcount=refcount+1, released_at=NULL WHERE digest=?", (digest,))
+
+    def release(self, digest):
+        """Drop one reference. The blob becomes collectable when none are left."""
+        if not digest:
+            return
+        cur = self._conn().execute(
+            "UPDATE blobs SET refcount=MAX(refcount-1, 0),"
+            " released_at=CASE WHEN refcount<=1 THEN ? ELSE released_at END WHERE digest=?",
+            (time.time(), digest),
+        )
+        if cur.rowcount:
+            self.counters["released"] += 1
+
+    def collect(self, grace=GC_GRACE):
+        """Delete blobs unreferenced for at least `grace` seconds. Returns the number removed."""
+        conn = self._conn()
+        cutoff = time.time() - grace
+        candidates = [r[0] for r in conn.execute(
+            "SELECT digest FROM blobs WHERE refcount<=0 AND released_at<=?", (cutoff,))]
+        removed = 0
+        for digest in candidates:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT path FROM blobs WHERE digest=? AND refcount<=0 AND released_at<=?",
+                                   (digest, cutoff)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    continue
+                conn.execute("DELETE FROM blobs WHERE digest=?", (digest,))
+                try:
+                    os.unlink(os.path.join(self.root, row[0]))
+                except FileNotFoundError:
+                    pass
+                conn.execute("COMMIT")
+                removed += 1
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.counters["collected"] += removed
+        if removed:
+            logger.info("blob GC removed %d unreferenced upload(s)", removed)
+        return removed
+
+    def _gc_loop(self):
+        while True:
+            time.sleep(GC_INTERVAL)
+            try:
+                self.collect()
+            except Exception:
+                logger.exception("blob GC pass failed")
+
+    def ensure_gc(self):
+        """Start the GC thread once per worker process (threads do not survive fork)."""
+        if GC_DISABLED or self._gc_pid == os.getpid():
+            return
+        with self._gc_lock:
+            if self._gc_pid == os.getpid():
+                return
+            self._gc_pid = os.getpid()
+            threading.Thread(target=self._gc_loop, name="blob-gc", daemon=True).start()
+
+    def stats(self):
+        try:
+            row = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0),"
+                " COALESCE(SUM(refcount<=0), 0) FROM blobs").fetchone()
+        except sqlite3.Error as e:
+            return {"error": str(e), **self.counters}
+        return {"blobs": row[0], "bytes": row[1], "references": row[2], "unreferenced": row[3], **self.counters}
+
+
+upload_store = BlobStore(os.getenv("UPLOAD_FOLDER") or "uploads")
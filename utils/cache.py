@@ -0,0 +1,332 @@
+"""Two-tier cache: bounded in-process LRU in front of a SQLite file shared by
+all gunicorn workers on the host.
+
+The disk tier stores raw bytes with a TTL and a total-size budget; when the
+budget is exceeded the least recently read entries are evicted. SQLite runs
+in WAL mode so concurrent readers in other workers are never blocked by a
+writer.
+
+`llm_cache` is the instance used by `utils.gemini_gateway` for model replies.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("cache")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("MARGADARSHI_CACHE_DIR") or os.path.join(BASE_DIR, "cache")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so trivially different prompts share a key."""
+    return " ".join((prompt or "").split())
+
+
+def make_key(model, prompt, params=None):
+    """Content address for a model call: sha256 of (model, normalized prompt, params)."""
+    blob = json.dumps([model or "", normalize_prompt(prompt), params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """Thread-safe bounded LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """SQLite-backed byte store shared across processes, with TTL and a size budget."""
+
+    EVICT_EVERY = 50  # run size-based eviction every N writes
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _conn(self):
+        # one connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM entries WHERE key=? AND expires>?", (key, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE entries SET accessed=? WHERE key=?", (now, key))
+        return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires = now + (ttl or self.ttl)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries(key, value, size, created, expires, accessed) VALUES (?,?,?,?,?,?)",
+            (key, sqlite3.Binary(value), len(value), now, expires, now),
+        )
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key=?", (key,))
+
+    def evict(self):
+        """Drop expired rows, then least-recently-read rows until under 90% of max_bytes."""
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM entries WHERE expires<=?", (time.time(),)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            target = int(self.max_bytes * 0.9)
+            freed = 0
+            doomed = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+                if total - freed <= target:
+                    break
+                doomed.append((key,))
+                freed += size
+            conn.executemany("DELETE FROM entries WHERE key=?", doomed)
+            removed += len(doomed)
+        self.evictions += max(0, removed)
+        return removed
+
+    # -- cross-process leases (used by utils.singleflight) --
+    def _owner(self):
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def acquire_lease(self, key, ttl):
+        """Try to become the one process working on `key`. True if we got it."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM leases WHERE key=? AND expires<=?", (key, now))
+        cur = conn.execute("INSERT OR IGNORE INTO leases(key, owner, expires) VALUES (?,?,?)",
+                           (key, self._owner(), now + ttl))
+        return cur.rowcount == 1
+
+    def release_lease(self, key):
+        self._conn().execute("DELETE FROM leases WHERE key=? AND owner=?", (key, self._owner()))
+
+    def lease_held(self, key):
+        row = self._conn().execute("SELECT 1 FROM leases WHERE key=? AND expires>?", (key, time.time())).fetchone()
+        return row is not None
+
+    def usage(self):
+        count, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": count, "bytes": size, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        self._conn().execute("DELETE FROM entries")
+
+
+class TieredCache:
+    """Memory LRU -> disk. Values are bytes on disk; `encode`/`decode` convert."""
+
+    def __init__(self, name, max_entries, disk_path, max_bytes, ttl,
+                 encode=lambda v: v.encode("utf-8"), decode=lambda b: b.decode("utf-8"),
+                 enabled=True):
+        self.name = name
+        self.ttl = ttl
+        self.enabled = enabled
+        self.encode = encode
+        self.decode = decode
+        self.memory = MemoryLRU(max_entries)
+        self._disk_path = disk_path
+        self._max_bytes = max_bytes
+        self._disk = None
+        self._disk_failed = False
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "bypassed": 0, "errors": 0}
+
+    @property
+    def disk(self):
+        # opened lazily so importing the module never touches the filesystem
+        if self._disk is None and not self._disk_failed:
+            with self._lock:
+                if self._disk is None and not self._disk_failed:
+                    try:
+                        self._disk = DiskCache(self._disk_path, max_bytes=self._max_bytes, ttl=self.ttl)
+                    except Exception as e:
+                        logger.warning("%s disk cache unavailable (%s); using memory only", self.name, e)
+                        self._disk_failed = True
+        return self._disk
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        disk = self.disk
+        if disk is not None:
+            try:
+                raw = disk.get(key)
+            except Exception as e:
+                logger.warning("%s disk read failed: %s", self.name, e)
+                self._count("errors")
+                raw = None
+            if raw is not None:
+                value = self.decode(raw)
+                self.memory.set(key, value, self.ttl)
+                self._count("disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        if not self.enabled or value is None:
+            return
+        self.memory.set(key, value, self.ttl)
+        self._count("sets")
+        disk = self.disk
+        if disk is not None:
+            try:
+                disk.set(key, self.encode(value))
+            except Exception as e:
+                logger.warning("%s disk write failed: %s", self.name, e)
+                self._count("errors")
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk is not None:
+            try:
+                self.disk.delete(key)
+            except Exception:
+                pass
+
+    def peek(self, key):
+        """Like get() but without touching the hit/miss counters."""
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        try:
+            raw = self.disk.get(key)
+        except Exception:
+            return None
+        return self.decode(raw) if raw is not None else None
+
+    # Lease helpers return None when there is no disk tier (no cross-process coordination).
+    def acquire_lease(self, key, ttl):
+        if self.disk is None:
+            return None
+        try:
+            return self.disk.acquire_lease(key, ttl)
+        except Exception as e:
+            logger.warning("%s lease acquire failed: %s", self.name, e)
+            return None
+
+    def release_lease(self, key):
+        if self.disk is not None:
+            try:
+                self.disk.release_lease(key)
+            except Exception as e:
+                logger.warning("%s lease release failed: %s", self.name, e)
+
+    def lease_held(self, key):
+        if self.disk is None:
+            return False
+        try:
+            return self.disk.lease_held(key)
+        except Exception:
+            return False
+
+    def note_bypass(self):
+        self._count("bypassed")
+
+    def stats(self):
+        with self._lock:
+            snap = dict(self.counters)
+        lookups = snap["memory_hits"] + snap["disk_hits"] + snap["misses"]
+        snap["hit_rate"] = round((snap["memory_hits"] + snap["disk_hits"]) / lookups, 3) if lookups else 0.0
+        snap["memory_entries"] = len(self.memory)
+        snap["enabled"] = self.enabled
+        if self._disk is not None:
+            try:
+                snap["disk"] = self._disk.usage()
+                snap["disk"]["evictions"] = self._disk.evictions
+            except Exception:
+                pass
+        return snap
+
+
+llm_cache = TieredCache(
+    "llm",
+    max_entries=_env_int("LLM_CACHE_MEMORY_ENTRIES", 512),
+    disk_path=os.path.join(CACHE_DIR, "llm_cache.sqlite3"),
+    max_bytes=_env_int("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    ttl=_env_int("LLM_CACHE_TTL", 7 * 24 * 3600),
+    enabled=str(os.getenv("LLM_CACHE_DISABLED") or "").lower() not in ("1", "true", "yes"),
+)
@@ -0,0 +1,170 @@
+"""Token-budgeted prompt context from a whole document.
+
+Instead of slicing the first N characters (which drops the end of every long
+document), the text is split into ~`CHUNK_TOKENS` chunks, each chunk is
+scored for salience with TF-IDF (the same ranking the offline quiz generator
+uses), and chunks are picked until the task's token budget is filled:
+
+1. the document is divided into as many equal position bins as there are
+   chunk slots, and the best chunk from each bin is taken first so every part
+   of the document is represented;
+2. remaining budget goes to the highest-scoring leftover chunks.
+
+Selected chunks are emitted in document order, with a `[...]` marker where
+text was skipped.
+
+Token counts are estimated (no tokenizer dependency): ~4 characters per
+token for English prose, which is what Gemini's own estimate uses.
+"""
+import os
+import re
+import math
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+except Exception:
+    TfidfVectorizer = None
+
+CHARS_PER_TOKEN = 4
+CHUNK_TOKENS = 200
+GAP_MARKER = "\n[...]\n"
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Per-task prompt budgets in tokens (override with CONTEXT_BUDGET_<TASK>).
+TASK_BUDGETS = {
+    "quiz": _env_int("CONTEXT_BUDGET_QUIZ", 2000),
+    "summary": _env_int("CONTEXT_BUDGET_SUMMARY", 6000),
+    "study_quiz": _env_int("CONTEXT_BUDGET_STUDY_QUIZ", 3500),
+    "study_chat": _env_int("CONTEXT_BUDGET_STUDY_CHAT", 3500),
+}
+
+# How much source text to extract for a task before ranking: a multiple of the
+# prompt budget, so there is material to choose from without parsing a whole
+# 600-page book for a 3,500-token prompt (CONTEXT_SOURCE_FACTOR).
+SOURCE_FACTOR = _env_int("CONTEXT_SOURCE_FACTOR", 12)
+
+_SENT_RE = re.compile(r"(?<=[.!?])\s+")
+_PARA_RE = re.compile(r"\n\s*\n|\f")
+_WORD_RE = re.compile(r"[a-zA-Z]{3,}")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def source_char_budget(task):
+    """Characters of document text worth extracting for `task`."""
+    return TASK_BUDGETS.get(task, TASK_BUDGETS["quiz"]) * CHARS_PER_TOKEN * SOURCE_FACTOR
+
+
+def split_chunks(text, chunk_tokens=CHUNK_TOKENS):
+    """Pack paragraphs (or sentences of long paragraphs) into ~chunk_tokens pieces."""
+    max_chars = chunk_tokens * CHARS_PER_TOKEN
+    units = []
+    for para in _PARA_RE.split(text):
+        para = " ".join(para.split())
+        if not para:
+            continue
+        if len(para) <= max_chars:
+            units.append(para)
+            continue
+        for sent in _SENT_RE.split(para):
+            # hard-wrap run-on "sentences" (tables, OCR output without punctuation)
+            while len(sent) > max_chars:
+                cut = sent.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                units.append(sent[:cut])
+                sent = sent[cut:].lstrip()
+            if sent:
+                units.append(sent)
+    chunks, cur, cur_len = [], [], 0
+    for unit in units:
+        if cur and cur_len + len(unit) > max_chars:
+            chunks.append(" ".join(cur))
+            cur, cur_len = [], 0
+        cur.append(unit)
+        cur_len += len(unit) + 1
+    if cur:
+        chunks.append(" ".join(cur))
+    return chunks
+
+
+def score_chunks(chunks):
+    """Salience score per chunk: summed TF-IDF weight, or distinct-term density without sklearn."""
+    if TfidfVectorizer is not None and len(chunks) > 1:
+        try:
+            tfidf = TfidfVectorizer(stop_words="english").fit_transform(chunks)
+            return [float(s) for s in tfidf.sum(axis=1).A1]
+        except ValueError:
+            # empty vocabulary (e.g. only stop words / numbers)
+            pass
+    scores = []
+    for c in chunks:
+        words = [w.lower() for w in _WORD_RE.findall(c)]
+        scores.append(len(set(words)) / math.sqrt(len(words) + 1))
+    return scores
+
+
+def select_chunks(chunks, scores, budget_tokens):
+    """Indices of chunks to keep: best per position bin first, then by score."""
+    sizes = [estimate_tokens(c) for c in chunks]
+    avg = max(1, sum(sizes) // max(1, len(sizes)))
+    slots = max(1, min(len(chunks), budget_tokens // avg))
+    chosen, used = set(), 0
+
+    def take(i):
+        nonlocal used
+        if i in chosen or used + sizes[i] > budget_tokens:
+            return False
+        chosen.add(i)
+        used += sizes[i]
+        return True
+
+    n = len(chunks)
+    bins = [range(b * n // slots, (b + 1) * n // slots) for b in range(slots)]
+    for b in sorted(bins, key=lambda r: -max((scores[i] for i in r), default=0)):
+        if len(b):
+            take(max(b, key=lambda i: scores[i]))
+    for i in sorted(range(n), key=lambda i: -scores[i]):
+        if used >= budget_tokens:
+            break
+        take(i)
+    return sorted(chosen)
+
+
+def build_context(text, budget_tokens=None, task=None):
+    """Return `text` reduced to fit `budget_tokens` (or the budget for `task`).
+
+    Text that already fits is returned unchanged.
+    """
+    text = (text or "").strip()
+    if budget_tokens is None:
+        budget_tokens = TASK_BUDGETS.get(task, TASK_BUDGETS["quiz"])
+    if estimate_tokens(text) <= budget_tokens:
+        return text
+    chunks = split_chunks(text)
+    if not chunks:
+        return ""
+    picked = select_chunks(chunks, score_chunks(chunks), budget_tokens)
+    if not picked:
+        # a single chunk larger than the whole budget
+        return text[:budget_tokens * CHARS_PER_TOKEN]
+    parts = []
+    prev = None
+    for i in picked:
+        if prev is not None and i != prev + 1:
+            parts.append(GAP_MARKER)
+        elif prev is not None:
+            parts.append(" ")
+        parts.append(chunks[i])
+        prev = i
+    if picked[0] != 0:
+        parts.insert(0, GAP_MARKER.lstrip("\n"))
+    return "".join(parts)
@@ -0,0 +1,88 @@
+"""Per-request deadline budgets for LLM calls.
+
+A request creates one `Deadline` and passes it to every Gemini call and
+retry loop it triggers. Each attempt's timeout is capped by the remaining
+budget. Retries back off with full jitter and are skipped once the remaining
+budget cannot fit another attempt. When the budget is spent the call raises
+DeadlineExceeded and the caller falls back to its offline path.
+
+Budgets (seconds) can be tuned per task through environment variables, see
+BUDGETS.
+"""
+import os
+import time
+import random
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget cannot fit another upstream attempt."""
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+BUDGETS = {
+    "quiz": _env_float("QUIZ_DEADLINE_SECONDS", 45.0),
+    "explain": _env_float("EXPLAIN_DEADLINE_SECONDS", 15.0),
+    "explain_batch": _env_float("EXPLAIN_BATCH_DEADLINE_SECONDS", 45.0),
+    "summary": _env_float("SUMMARY_DEADLINE_SECONDS", 60.0),
+    "study": _env_float("STUDY_DEADLINE_SECONDS", 45.0),
+}
+
+# an attempt with less time than this left is not worth starting
+MIN_ATTEMPT_SECONDS = _env_float("MIN_ATTEMPT_SECONDS", 3.0)
+
+
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+
+    @classmethod
+    def for_task(cls, task):
+        return cls(BUDGETS.get(task, BUDGETS["quiz"]))
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def can_fit(self, seconds):
+        return self.remaining() >= seconds
+
+    def timeout(self, cap, floor=MIN_ATTEMPT_SECONDS):
+        """Timeout for the next attempt: `cap` limited by the remaining budget.
+        Raises DeadlineExceeded when less than `floor` seconds are left."""
+        left = self.remaining()
+        if left < floor:
+            raise DeadlineExceeded(f"deadline budget exhausted ({self.elapsed():.1f}s of {self.budget:.0f}s used)")
+        return min(cap, left)
+
+    def sleep_before_retry(self, delay, floor=MIN_ATTEMPT_SECONDS):
+        """Sleep `delay` if an attempt still fits afterwards. Returns False (without
+        sleeping) when the retry should be cancelled."""
+        if not self.can_fit(delay + floor):
+            return False
+        time.sleep(delay)
+        return True
+
+    def __repr__(self):
+        return f"Deadline(budget={self.budget}, remaining={self.remaining():.1f})"
+
+
+BACKOFF_CAP = 8.0
+
+
+def backoff_delay(attempt, base=1.0, cap=BACKOFF_CAP):
+    """Full-jitter exponential backoff for retry number `attempt` (1-based)."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
@@ -0,0 +1,156 @@
+"""Document-local distractors from term co-occurrence vectors.
+
+A good wrong answer is a term the same document uses in similar places:
+another enzyme, another organelle, another year. Per document:
+
+1. every occurrence of a term adds one count to each of its contexts: the
+   words up to `SPAN` positions either side (keyed by offset, so "the X is"
+   and "X is the" differ) and the window of `WINDOW` sentences it is in.
+   Neighbouring words find terms used the same way; the window adds topic;
+2. a sparse term x context matrix is built in one shot from those pairs
+   (SciPy COO -> CSR; duplicate entries sum to counts), weighted with
+   sublinear counts and an IDF-style context weight, and L2-normalized
+   per term;
+3. `nearest(answers, k)` stacks the answer rows and multiplies them by the
+   whole matrix once. The answers x terms cosine matrix covers every
+   question in the quiz. The answer itself, other inflections of it and
+   terms of a different part of speech are masked out, and
+   `np.argpartition` picks the top k of every row together. Passing the
+   document's keywords as `candidates` keeps ubiquitous words out.
+
+Only terms with a positive similarity are returned, so a row can be short.
+Callers top it up from WordNet or the keyword pool.
+"""
+import re
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+WINDOW = 3
+SPAN = 2
+MIN_TERM_CHARS = 3
+
+_TERM_RE = re.compile(r"^(?:[^\W\d_][\w'-]*|\d[\d.,]*)$")
+
+STOPWORDS = {
+    "the", "and", "for", "that", "with", "this", "from", "which", "when", "are", "were", "was", "also",
+    "have", "has", "had", "but", "not", "can", "use", "used", "using", "been", "into", "about", "between",
+    "other", "such", "these", "those", "their", "there", "they", "them", "than", "then", "its", "will",
+    "would", "could", "should", "may", "might", "must", "each", "more", "most", "some", "any", "all",
+    "both", "only", "very", "over", "under", "after", "before", "while", "where", "what", "who", "whom",
+    "how", "why", "our", "your", "his", "her", "she", "him", "you", "out", "off", "one", "two",
+}
+
+
+def _stem(term):
+    # enough to keep "enzyme" from being a distractor for "enzymes"
+    if term.endswith("ies") and len(term) > 4:
+        return term[:-3] + "y"
+    if term.endswith("es") and len(term) > 4:
+        return term[:-2]
+    if term.endswith("s") and not term.endswith("ss") and len(term) > 3:
+        return term[:-1]
+    return term
+
+
+def _pos_class(tag, token):
+    # numbers by shape too, so years stay apart from words even without a tagger
+    if tag == "CD" or token[:1].isdigit():
+        return "CD"
+    return tag[:2] if tag else "NN"
+
+
+class DistractorEngine:
+    def __init__(self, token_lists, tag_lists=None, window=WINDOW, span=SPAN, stopwords=STOPWORDS):
+        """`token_lists`: tokens per sentence. `tag_lists`: matching (token, tag)
+        lists, or None to separate only numbers from words."""
+        vocab = {}
+        contexts = {}
+        surface = []
+        pos_votes = []
+        rows, cols = [], []
+        for s, tokens in enumerate(token_lists):
+            tags = tag_lists[s] if tag_lists is not None else None
+            lows = [t.lower() for t in tokens]
+            topic = contexts.setdefault(("window", s // window), len(contexts))
+            for j, low in enumerate(lows):
+                if (len(low) < MIN_TERM_CHARS and not low.isdigit()) or low in stopwords or not _TERM_RE.match(low):
+                    continue
+                tid = vocab.get(low)
+                if tid is None:
+                    tid = vocab[low] = len(surface)
+                    surface.append(Counter())
+                    pos_votes.append(Counter())
+                surface[tid][tokens[j]] += 1
+                pos_votes[tid][_pos_class(tags[j][1] if tags is not None else None, low)] += 1
+                rows.append(tid)
+                cols.append(topic)
+                for off in range(max(0, j - span) - j, min(len(lows), j + span + 1) - j):
+                    if off:
+                        rows.append(tid)
+                        cols.append(contexts.setdefault((off, lows[j + off]), len(contexts)))
+        self.vocab = vocab
+        self.terms = [c.most_common(1)[0][0] for c in surface]
+        if not rows:
+            self.vectors = sparse.csr_matrix((0, 0))
+            self.pos = np.zeros(0, dtype=np.int32)
+            self.stems = np.zeros(0, dtype=np.int32)
+            self.numeric = -1
+            return
+        n_terms, n_ctx = len(surface), len(contexts)
+        # COO -> CSR sums repeated (term, context) pairs into counts
+        counts = sparse.coo_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                   shape=(n_terms, n_ctx)).tocsr()
+        # sublinear counts; contexts holding many distinct terms say less about each one
+        counts.data = 1.0 + np.log(counts.data)
+        terms_per_ctx = np.bincount(counts.indices, minlength=n_ctx).astype(np.float32)
+        ctx_weight = np.log((1.0 + n_terms) / (1.0 + terms_per_ctx)) + 1.0
+        weighted = counts @ sparse.diags(ctx_weight.astype(np.float32))
+        norms = np.sqrt(weighted.multiply(weighted).sum(axis=1)).A1
+        norms[norms == 0] = 1.0
+        self.vectors = sparse.diags((1.0 / norms).astype(np.float32)) @ weighted
+        pos_names = {}
+        self.pos = np.array([pos_names.setdefault(v.most_common(1)[0][0], len(pos_names)) for v in pos_votes],
+                            dtype=np.int32)
+        self.numeric = pos_names.get("CD", -1)
+        stem_names = {}
+        self.stems = np.array([stem_names.setdefault(_stem(t), len(stem_names)) for t in vocab], dtype=np.int32)
+
+    @classmethod
+    def from_document(cls, doc, **kwargs):
+        """Build from a quiz_generator.AnnotatedDocument (reuses its tokens and tags)."""
+        return cls(doc.tokens, doc.tags, **kwargs)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def nearest(self, answers, k=3, candidates=None):
+        """For each answer, up to k document terms closest to it (list of lists,
+        in input order). Answers that are not document terms get []. With
+        `candidates` (e.g. the document's keywords), only those terms are
+        eligible; otherwise a word like "cell" that is everywhere tends to be
+        everyone's nearest neighbour."""
+        ids = [self.vocab.get((a or "").lower(), -1) for a in answers]
+        known = [i for i, tid in enumerate(ids) if tid >= 0]
+        result = [[] for _ in answers]
+        if not known or len(self.terms) < 2:
+            return result
+        rows = np.array([ids[i] for i in known])
+        sims = (self.vectors[rows] @ self.vectors.T).toarray()
+        # mask: the answer, its inflections, other parts of speech, unrelated terms
+        sims[(self.stems[None, :] == self.stems[rows][:, None]) | (self.pos[None, :] != self.pos[rows][:, None])] = 0.0
+        if candidates is not None:
+            allowed = np.zeros(len(self.terms), dtype=bool)
+            allowed[[tid for tid in (self.vocab.get(c.lower(), -1) for c in candidates) if tid >= 0]] = True
+            # keyword lists hold words only; numbers stay eligible for numeric answers
+            sims[:, ~(allowed | (self.pos == self.numeric))] = 0.0
+        k = min(k, sims.shape[1])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        for r, i in enumerate(known):
+            result[i] = [self.terms[t] for t, s in zip(top[r], top_sims[r]) if s > 0]
+        return result
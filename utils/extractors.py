@@ -1,22 +1,456 @@
-import fitz  # PyMuPDF
-from PIL import Image
-import pytesseract
+"""Text extraction shared by the chat, summarizer and study apps.
+
+Every PDF goes through PyMuPDF here (it is several times faster than
+PyPDF2 on large textbooks). `extract_pdf` accepts a path, raw bytes or a
+file-like object and returns per-page text plus document metadata;
+`extract_pdf_text` is the joined-text shortcut most endpoints need.
+
+Large documents (`PDF_PARALLEL_MIN_PAGES` pages and up) are split into page
+ranges of at most `PDF_RANGE_PAGES` pages and extracted in a bounded process
+pool (`PDF_EXTRACT_WORKERS`); pages are reassembled in order. Workers open
+the file themselves, so each one holds only the pages of its current range
+and the upload is never copied into every task. Smaller documents stay on
+the single-core path, where process start-up would cost more than it saves.
+
+Results are cached by the SHA-256 of the file bytes (`extraction_cache`: an
+in-process LRU in front of a zlib-compressed SQLite store under the cache
+dir), so the same syllabus uploaded by a whole class, or by one student to
+chat, summarizer and study room, is extracted once. Tune with
+`EXTRACT_CACHE_MEMORY_ENTRIES`, `EXTRACT_CACHE_MAX_BYTES`, `EXTRACT_CACHE_TTL`;
+disable with `EXTRACT_CACHE_DISABLED=1`.
+
+Pages without a text layer (scans) are rendered and OCR'd through
+`utils.ocr`, in batches so a scanned book never has all its page images in
+memory at once; the OCR text is part of the cached extraction.
+
+Callers that only need part of a document use `iter_pdf_pages` (or
+`extract_pdf_text(..., max_chars=..., pages=...)`): pages are produced lazily
+and parsing stops once the character budget or page limit is met, or is
+restricted to the requested page ranges ("1-20,35"). Lazy reads fill the
+same cache: the pages they got through from page 1 on, or the full result
+once they reach the last page.
+
+Text is read as PyMuPDF blocks with their positions (`page_blocks`), and
+running headers, footers and page numbers are dropped geometrically by
+`utils.layout` before any caller sees the text. Full extractions learn the
+repeated margin text from every page. Lazy reads learn it from a sample of
+up to `LAYOUT_SAMPLE_PAGES` pages. Set `PDF_LAYOUT_CLEAN_DISABLED=1` to
+keep them.
+"""
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import hashlib
+import atexit
 import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pymupdf as fitz  # PyMuPDF >= 1.24
+except ImportError:
+    import fitz  # PyMuPDF
+
+from PIL import Image
+
+from utils import ocr
+from utils import layout
+from utils.cache import CACHE_DIR, TieredCache
+from utils.pdf_worker import page_blocks, page_entry as _page_entry, page_texts as _page_texts, extract_range as _extract_range
 
 logger = logging.getLogger("mentorbot")
 
-def extract_text_from_pdf(path):
+PAGE_SEPARATOR = "\n\n"
+METADATA_KEYS = ("title", "author", "subject", "keywords", "creator", "producer")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+PARALLEL_MIN_PAGES = _env_int("PDF_PARALLEL_MIN_PAGES", 80)
+RANGE_PAGES = _env_int("PDF_RANGE_PAGES", 50)
+EXTRACT_WORKERS = _env_int("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1))
+# recycle worker processes so PyMuPDF's native allocations cannot build up (Python 3.11+)
+WORKER_MAX_TASKS = 100
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+CACHE_VERSION = 3  # bump when the extraction output changes
+LAYOUT_SAMPLE_PAGES = 24
+PREFIX = "prefix"  # cache key suffix for the first pages a lazy read got through
+
+extraction_cache = TieredCache(
+    "extract",
+    max_entries=_env_int("EXTRACT_CACHE_MEMORY_ENTRIES", 32),
+    disk_path=os.path.join(CACHE_DIR, "extract_cache.sqlite3"),
+    max_bytes=_env_int("EXTRACT_CACHE_MAX_BYTES", 256 * 1024 * 1024),
+    ttl=_env_int("EXTRACT_CACHE_TTL", 30 * 24 * 3600),
+    encode=lambda v: zlib.compress(json.dumps(v, ensure_ascii=False).encode("utf-8"), 6),
+    decode=lambda b: json.loads(zlib.decompress(b).decode("utf-8")),
+    enabled=str(os.getenv("EXTRACT_CACHE_DISABLED") or "").lower() not in ("1", "true", "yes"),
+)
+
+
+def content_hash(source):
+    """SHA-256 hex digest of a path's file contents or of a bytes-like object."""
+    if isinstance(source, (str, os.PathLike)):
+        h = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+    return hashlib.sha256(source).hexdigest()
+
+
+def _cache_key(kind, digest, max_pages=None):
+    return f"{kind}:v{CACHE_VERSION}:{digest}:{'all' if max_pages is None else max_pages}"
+
+
+def open_pdf(source):
+    """Open a PDF from a filesystem path, bytes-like object or binary file object."""
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    if hasattr(source, "read"):
+        if hasattr(source, "seek"):
+            try:
+                source.seek(0)
+            except (OSError, io.UnsupportedOperation):
+                pass
+        return fitz.open(stream=source.read(), filetype="pdf")
+    raise TypeError(f"cannot open PDF from {type(source).__name__}")
+
+
+def pdf_blocks(source, pages=None):
+    """Yield {"number", "blocks"} per selected page (see parse_page_spec) for
+    callers that need positions rather than text."""
+    with open_pdf(source) as doc:
+        for index in parse_page_spec(pages, doc.page_count):
+            yield {"number": index + 1, "blocks": page_blocks(doc.load_page(index))}
+
+
+# Spawn, not fork: forking a threaded web worker can copy held locks. Spawned
+# children import the parent's main module again (as __mp_main__), so entry
+# points keep their start-up under `if __name__ == "__main__"` (see app.py);
+# the tasks themselves only need utils.pdf_worker.
+_mp_context = multiprocessing.get_context("spawn")
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                kwargs = {}
+                if sys.version_info >= (3, 11):
+                    kwargs["max_tasks_per_child"] = WORKER_MAX_TASKS
+                _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=_mp_context, **kwargs)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def page_ranges(count, workers=EXTRACT_WORKERS, max_range=RANGE_PAGES):
+    """Split `count` pages into contiguous [start, stop) ranges: at least one per
+    worker, none longer than `max_range` pages."""
+    size = max(1, min(max_range, -(-count // max(1, workers))))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _extract_parallel(source, limit, blocks=False):
+    path, tmp = source, None
+    if not isinstance(source, (str, os.PathLike)):
+        # workers open the document by path; spool the bytes to a temp file once
+        fd, tmp = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(source)
+        path = tmp
     try:
-        doc = fitz.open(path)
-        text = "\n".join(page.get_text() for page in doc)
-        return text.strip()
+        pool = _get_pool()
+        futures = [pool.submit(_extract_range, os.fspath(path), start, stop, blocks)
+                   for start, stop in page_ranges(limit)]
+        pages = []
+        for fut in futures:  # in submission order, i.e. page order
+            pages.extend(fut.result())
+        return pages
+    finally:
+        if tmp:
+            os.unlink(tmp)
+
+
+def _ocr_scanned_pages(source, pages):
+    """Replace the text of image-only pages with OCR output, a few pages at a time."""
+    short = [p for p in pages if len(p["text"].strip()) < ocr.OCR_MIN_CHARS]
+    if not short:
+        return 0
+    with open_pdf(source) as doc:
+        todo = [p for p in short if ocr.needs_ocr(p["text"], doc.load_page(p["number"] - 1))]
+        batch = max(1, ocr.OCR_WORKERS * 2)
+        for i in range(0, len(todo), batch):
+            chunk = todo[i:i + batch]
+            images = [ocr.render_page(doc.load_page(p["number"] - 1)) for p in chunk]
+            for p, text in zip(chunk, ocr.ocr_images(images)):
+                if text:
+                    p.update(text=text, chars=len(text), ocr=True)
+    return len(todo)
+
+
+def extract_pdf(source, max_pages=None, parallel=None, cache=True, use_ocr=True):
+    """Extract a PDF page by page.
+
+    Returns {"pages": [{"number", "text", "chars"}], "page_count", "metadata",
+    "workers", "sha256", "cache_hit", "elapsed_ms"}; `page_count` is the
+    document's total even when `max_pages` limits how many pages are read.
+    `parallel=None` picks the process pool for documents of PARALLEL_MIN_PAGES
+    pages or more; True/False force it on/off. Pages without a text layer
+    are OCR'd (flagged `"ocr": True`) unless `use_ocr=False` or tesseract is
+    missing. Headers, footers and page numbers are removed (see utils.layout;
+    pages report `furniture_chars`). Results are cached by content hash
+    unless `cache=False`. Raises on unreadable input.
+    """
+    t0 = time.perf_counter()
+    if hasattr(source, "read") and not isinstance(source, (str, os.PathLike)):
+        # read streams once: hashing, the metadata pass and the workers all need the bytes
+        if hasattr(source, "seek"):
+            try:
+                source.seek(0)
+            except (OSError, io.UnsupportedOperation):
+                pass
+        source = source.read()
+    digest = content_hash(source)
+    # text-layer-only results are kept apart so they never stand in for an OCR'd extraction
+    kind = "pdf" if use_ocr and ocr.available() else "pdf-text"
+    if cache:
+        # a full extraction also answers any page-limited request
+        hit = extraction_cache.get(_cache_key(kind, digest))
+        if hit is None and max_pages is not None:
+            hit = extraction_cache.get(_cache_key(kind, digest, max_pages))
+        if hit is not None:
+            pages = hit["pages"] if max_pages is None else hit["pages"][:max_pages]
+            return dict(hit, pages=pages, cache_hit=True,
+                        elapsed_ms=round((time.perf_counter() - t0) * 1000, 1))
+    with open_pdf(source) as doc:
+        total = doc.page_count
+        limit = total if max_pages is None else min(total, max_pages)
+        meta = doc.metadata or {}
+        metadata = {k: meta.get(k) for k in METADATA_KEYS if meta.get(k)}
+        metadata["encrypted"] = bool(doc.is_encrypted)
+        if parallel is None:
+            parallel = limit >= PARALLEL_MIN_PAGES and EXTRACT_WORKERS > 1 and not doc.is_encrypted
+        blocks = not layout.DISABLED
+        pages = None if parallel else _page_texts(doc, 0, limit, blocks)
+    workers = 1
+    if pages is None:
+        try:
+            pages = _extract_parallel(source, limit, blocks)
+            workers = min(EXTRACT_WORKERS, len(page_ranges(limit)))
+        except Exception as e:
+            logger.error("Parallel PDF extraction failed (%s); extracting on one core", e)
+            with open_pdf(source) as doc:
+                pages = _page_texts(doc, 0, limit, blocks)
+    if blocks:
+        layout.strip_furniture(pages)
+    ocr_pages = 0
+    if kind == "pdf":
+        try:
+            ocr_pages = _ocr_scanned_pages(source, pages)
+        except Exception as e:
+            logger.error("OCR of scanned pages failed: %s", e)
+    result = {
+        "pages": pages,
+        "page_count": total,
+        "metadata": metadata,
+        "workers": workers,
+        "ocr_pages": ocr_pages,
+        "sha256": digest,
+    }
+    if cache:
+        extraction_cache.set(_cache_key(kind, digest, None if limit == total else max_pages), result)
+    return dict(result, cache_hit=False, elapsed_ms=round((time.perf_counter() - t0) * 1000, 1))
+
+
+def _page_items(spec):
+    """(first, last) 1-based page pairs of a selection; `last` None runs to the end."""
+    items = []
+    if isinstance(spec, str):
+        for part in spec.replace(" ", "").split(","):
+            if not part:
+                continue
+            try:
+                if "-" in part:
+                    first, _, last = part.partition("-")
+                    items.append((int(first) if first else 1, int(last) if last else None))
+                else:
+                    items.append((int(part), int(part)))
+            except ValueError:
+                raise ValueError(f"bad page range {part!r}") from None
+    else:
+        for item in spec:
+            items.append((item, item) if isinstance(item, int) else (int(item[0]), int(item[1])))
+    for first, last in items:
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"bad page range {first}-{last or ''}")
+    return items
+
+
+def check_page_spec(spec):
+    """Raise ValueError if page selection `spec` is malformed, before any
+    document is opened (request parsers answer 400 with the message)."""
+    if spec is not None and spec != "":
+        _page_items(spec)
+
+
+def parse_page_spec(spec, page_count):
+    """Page selection -> sorted 0-based page indices inside the document.
+
+    `spec` is a string like "1-5,9,12-" (1-based, inclusive, open-ended
+    ranges allowed) or an iterable of ints / (first, last) pairs. None
+    selects every page. Raises ValueError for malformed specs.
+    """
+    if spec is None or spec == "":
+        return list(range(page_count))
+    selected = set()
+    for first, last in _page_items(spec):
+        selected.update(range(first - 1, min(last or page_count, page_count)))
+    return sorted(selected)
+
+
+def iter_pdf_pages(source, pages=None, max_pages=None, max_chars=None, use_ocr=True):
+    """Yield page dicts ({"number", "text", "chars"[, "ocr"]}) lazily, in page order.
+
+    Only pages selected by `pages` (see parse_page_spec) are parsed. Stops
+    after `max_pages` pages, or after the page that brings the total past
+    `max_chars` characters. A cached full extraction of the same file is
+    served from the cache instead of parsing. Header/footer text is learned
+    from up to LAYOUT_SAMPLE_PAGES pages spread over the selection.
+
+    Pages read from the start of the document are cached too: as the full
+    extraction once the read reaches the last page, otherwise as a prefix
+    entry that later lazy reads reuse (OCR included) and extend.
+    """
+    if hasattr(source, "read") and not isinstance(source, (str, os.PathLike)):
+        if hasattr(source, "seek"):
+            try:
+                source.seek(0)
+            except (OSError, io.UnsupportedOperation):
+                pass
+        source = source.read()
+    do_ocr = use_ocr and ocr.available()
+    kind = "pdf" if do_ocr else "pdf-text"
+    digest = content_hash(source)
+    cached = extraction_cache.get(_cache_key(kind, digest))
+    prefix = []
+    if cached is None:
+        hit = extraction_cache.get(_cache_key(kind, digest, PREFIX))
+        prefix = hit["pages"] if hit else []
+    read = []  # pages 1..n in order, as long as the selection starts at page 1 without gaps
+    emitted = chars = 0
+    total, metadata = 0, {}
+    try:
+        with open_pdf(source) as doc:
+            total = doc.page_count
+            meta = doc.metadata or {}
+            metadata = {k: meta.get(k) for k in METADATA_KEYS if meta.get(k)}
+            metadata["encrypted"] = bool(doc.is_encrypted)
+            selected = parse_page_spec(pages, total)
+            signatures = None
+            sampled = cached is not None or layout.DISABLED
+            for index in selected:
+                if max_pages is not None and emitted >= max_pages:
+                    return
+                if max_chars is not None and chars >= max_chars:
+                    return
+                if cached is not None:
+                    page = cached["pages"][index]
+                elif index < len(prefix):
+                    page = prefix[index]
+                else:
+                    if not sampled:
+                        step = max(1, len(selected) // LAYOUT_SAMPLE_PAGES)
+                        sample = selected[::step][:LAYOUT_SAMPLE_PAGES]
+                        signatures = layout.furniture_signatures(page_blocks(doc.load_page(i)) for i in sample)
+                        sampled = True
+                    fz_page = doc.load_page(index)
+                    page = _page_entry(fz_page, index, blocks=signatures is not None)
+                    if signatures is not None:
+                        layout.strip_furniture([page], signatures)
+                    text = page["text"]
+                    if do_ocr and ocr.needs_ocr(text, fz_page):
+                        text = ocr.ocr_image(ocr.render_page(fz_page))
+                        if text:
+                            page.update(text=text, chars=len(text), ocr=True)
+                if cached is None and index == len(read):
+                    read.append(page)
+                emitted += 1
+                chars += page["chars"]
+                yield page
+    finally:
+        if len(read) > len(prefix):
+            _cache_lazy_read(kind, digest, read, total, metadata)
+
+
+def _cache_lazy_read(kind, digest, pages, total, metadata):
+    result = {"pages": pages, "page_count": total, "metadata": metadata, "workers": 1,
+              "ocr_pages": sum(1 for p in pages if p.get("ocr")), "sha256": digest}
+    try:
+        if len(pages) >= total:
+            extraction_cache.set(_cache_key(kind, digest), result)
+            extraction_cache.delete(_cache_key(kind, digest, PREFIX))
+        else:
+            extraction_cache.set(_cache_key(kind, digest, PREFIX), result)
+    except Exception as e:
+        logger.warning("Caching a lazy PDF read failed: %s", e)
+
+
+def join_pages(pages, separator=PAGE_SEPARATOR):
+    return separator.join(p["text"].strip() for p in pages if p["text"].strip())
+
+
+def extract_pdf_text(source, max_pages=None, max_chars=None, pages=None):
+    """Joined text of a PDF, or "" when it cannot be read.
+
+    With `max_chars` or `pages` the document is read lazily (iter_pdf_pages)
+    and the result is cut to `max_chars`; otherwise the whole document goes
+    through extract_pdf (process pool, cache).
+    """
+    try:
+        if max_chars is None and pages is None:
+            return join_pages(extract_pdf(source, max_pages=max_pages)["pages"])
+        text = join_pages(iter_pdf_pages(source, pages=pages, max_pages=max_pages, max_chars=max_chars))
+        return text[:max_chars] if max_chars else text
     except Exception as e:
         logger.error("PDF extract failed: %s", e)
         return ""
 
+
+def extract_text_from_pdf(path):
+    return extract_pdf_text(path).strip()
+
+
 def extract_text_from_image(path):
+    if not ocr.available():
+        logger.error("Image OCR unavailable: pytesseract/tesseract is not installed")
+        return ""
     try:
-        return pytesseract.image_to_string(Image.open(path)).strip()
+        with Image.open(path) as img:
+            return ocr.ocr_image(img)
     except Exception as e:
         logger.error("Image OCR failed: %s", e)
         return ""
@@ -0,0 +1,469 @@
+"""Shared Gemini REST gateway.
+
+Every app (quiz, chat, study, summarizer) sends its Gemini calls through this
+module so that:
+- one keep-alive connection pool (requests.Session) is reused per worker
+  process instead of a fresh TCP+TLS handshake per call/retry
+- response bodies are parsed by a single `extract_text` helper
+- identical requests are answered from `utils.cache.llm_cache` (memory LRU +
+  shared SQLite) unless the caller passes `cache=False`
+- concurrent identical cacheable requests are coalesced into one upstream call
+  (`utils.singleflight`), across threads and across workers
+- every HTTP outcome feeds the circuit breaker in `utils.health`; while it is
+  open calls fail fast with CircuitOpenError instead of waiting on timeouts
+- callers can pass a `Deadline` (utils.deadline) so retries and timeouts fit
+  the request's time budget
+- each call records timing: time-to-first-byte (request sent -> response
+  headers, dominated by model time) vs transfer/parse time, plus how many new
+  connections the pool had to open.
+
+Stats are available through `stats()`; `requests_sent()` counts the
+requests the current thread actually sent (not cache hits, coalesced waits or
+calls refused by the breaker), for endpoints that report their model calls.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.cache import llm_cache, make_key
+from utils.singleflight import SingleFlight
+from utils import health
+from utils.deadline import DeadlineExceeded, MIN_ATTEMPT_SECONDS, BACKOFF_CAP, backoff_delay
+
+logger = logging.getLogger("gemini-gateway")
+
+API_ROOT = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = os.getenv("GEMINI_REST_MODEL") or "gemini-2.5-flash"
+CONNECT_TIMEOUT = 5
+POOL_MAXSIZE = int(os.getenv("GEMINI_POOL_MAXSIZE", "16"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(RuntimeError):
+    """Raised when a Gemini call fails. `status_code` is set for HTTP errors."""
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class CircuitOpenError(GeminiError):
+    """Raised without calling upstream while the Gemini circuit breaker is open."""
+
+
+def model_url(model=None, method="generateContent"):
+    return f"{API_ROOT}/models/{model or DEFAULT_MODEL}:{method}"
+
+
+# ---------------- connection pool ----------------
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the per-process Session. Recreated after a fork (gunicorn workers)."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+                _session_pid = pid
+    return _session
+
+
+def _pool_connection_count():
+    """Total connections opened so far by the session's urllib3 pools."""
+    if _session is None:
+        return 0
+    total = 0
+    for adapter in {id(a): a for a in _session.adapters.values()}.values():
+        try:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                total += getattr(pool, "num_connections", 0)
+        except Exception:
+            continue
+    return total
+
+
+# ---------------- timing stats ----------------
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0,
+    "errors": 0,
+    "retries": 0,
+    "new_connections": 0,
+    "ttfb_ms": 0.0,
+    "transfer_ms": 0.0,
+    "total_ms": 0.0,
+}
+_last_body = None
+_sent = threading.local()
+flight = SingleFlight("gemini")
+
+
+def _record(ttfb_ms, transfer_ms, total_ms, new_conns, ok):
+    with _stats_lock:
+        _stats["calls"] += 1
+        if not ok:
+            _stats["errors"] += 1
+        _stats["new_connections"] += new_conns
+        _stats["ttfb_ms"] += ttfb_ms
+        _stats["transfer_ms"] += transfer_ms
+        _stats["total_ms"] += total_ms
+
+
+def requests_sent():
+    """Upstream requests sent by this thread so far. Diff it around a call to
+    tell whether that call reached Gemini."""
+    return getattr(_sent, "count", 0)
+
+
+def _note_sent():
+    _sent.count = requests_sent() + 1
+
+
+def stats():
+    """Snapshot of gateway counters with per-call averages."""
+    with _stats_lock:
+        snap = dict(_stats)
+    calls = snap["calls"] or 1
+    snap["avg_ttfb_ms"] = round(snap["ttfb_ms"] / calls, 1)
+    snap["avg_transfer_ms"] = round(snap["transfer_ms"] / calls, 1)
+    snap["avg_total_ms"] = round(snap["total_ms"] / calls, 1)
+    for k in ("ttfb_ms", "transfer_ms", "total_ms"):
+        snap[k] = round(snap[k], 1)
+    return snap
+
+
+def last_response():
+    """Raw body of the most recent Gemini response (debugging only)."""
+    return _last_body
+
+
+# ---------------- request / response shapes ----------------
+def build_payload(prompt, shape="content", generation_config=None):
+    """Build a request body. `shape` is 'content' (generateContent) or 'prompt' (legacy generateText)."""
+    if shape == "prompt":
+        body = {"prompt": {"text": prompt}, "temperature": 0.2, "maxOutputTokens": 800}
+    else:
+        body = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            body["generationConfig"] = generation_config
+    return body
+
+
+def extract_text(data):
+    """Pull the generated text out of any of the response shapes we have seen.
+
+    Handles Google `candidates[].content.parts[].text`, legacy `candidates[].output`,
+    OpenAI-like `choices`, and flat `text`/`content`/`summary` fields.
+    Returns None when nothing usable is found.
+    """
+    if isinstance(data, list):
+        # streamGenerateContent without alt=sse returns a JSON array of chunks
+        pieces = [extract_text(d) for d in data]
+        joined = "".join(p for p in pieces if p)
+        return joined or None
+    if not isinstance(data, dict):
+        return None
+    candidates = data.get("candidates") or data.get("outputs") or []
+    if isinstance(candidates, list) and candidates:
+        first = candidates[0]
+        if isinstance(first, dict):
+            content = first.get("content")
+            if isinstance(content, dict):
+                parts = content.get("parts") or []
+                texts = [p.get("text") for p in parts if isinstance(p, dict) and isinstance(p.get("text"), str)]
+                if texts:
+                    return "".join(texts)
+            elif isinstance(content, str) and content.strip():
+                return content
+            for key in ("output", "text"):
+                if isinstance(first.get(key), str) and first[key].strip():
+                    return first[key]
+    choices = data.get("choices")
+    if isinstance(choices, list) and choices and isinstance(choices[0], dict):
+        text = choices[0].get("text") or (choices[0].get("message") or {}).get("content")
+        if text:
+            return text
+    for key in ("text", "content", "summary"):
+        if isinstance(data.get(key), str) and data[key].strip():
+            return data[key]
+    return None
+
+
+def _auth(api_key, url, key_in_query=False):
+    headers = {"Content-Type": "application/json"}
+    params = {}
+    if not api_key:
+        return headers, params
+    if key_in_query:
+        params["key"] = api_key
+    elif "generativelanguage.googleapis.com" in url or api_key.startswith("AIza"):
+        headers["x-goog-api-key"] = api_key
+    else:
+        headers["Authorization"] = f"Bearer {api_key}"
+    return headers, params
+
+
+# ---------------- calls ----------------
+def _admit(label):
+    health.ensure_monitor()
+    if not health.gemini_breaker.allow_request():
+        raise CircuitOpenError(f"{label}: Gemini circuit breaker is open; skipping upstream call")
+
+
+def _report_status(status_code):
+    """Feed an HTTP status to the breaker: 429/5xx count as failures, anything
+    else proves the service is reachable."""
+    if status_code in RETRY_STATUSES:
+        health.gemini_breaker.record_failure(f"HTTP {status_code}")
+    else:
+        health.gemini_breaker.record_success()
+
+
+def post_json(url, body, api_key=None, timeout=60, key_in_query=False, label="gemini"):
+    """Single POST through the pooled session. Returns the decoded JSON body.
+
+    Raises GeminiError on HTTP errors (with status_code) or undecodable bodies.
+    Network errors propagate as requests exceptions.
+    """
+    global _last_body
+    _admit(label)
+    headers, params = _auth(api_key, url, key_in_query)
+    session = get_session()
+    conns_before = _pool_connection_count()
+    t0 = time.perf_counter()
+    ok = False
+    ttfb_ms = 0.0
+    try:
+        _note_sent()
+        try:
+            resp = session.post(url, headers=headers, params=params, json=body,
+                                timeout=(CONNECT_TIMEOUT, timeout), stream=True)
+        except requests.RequestException as e:
+            health.gemini_breaker.record_failure(type(e).__name__)
+            raise
+        _report_status(resp.status_code)
+        ttfb_ms = (time.perf_counter() - t0) * 1000
+        # decode explicitly: resp.text falls back to slow charset sniffing when
+        # the server omits a charset
+        body_text = resp.content.decode(resp.encoding or "utf-8", errors="replace")
+        _last_body = body_text
+        if resp.status_code >= 400:
+            raise GeminiError(f"HTTP {resp.status_code} from {url}: {body_text[:500]}",
+                              status_code=resp.status_code, body=body_text)
+        try:
+            data = resp.json()
+        except ValueError:
+            raise GeminiError(f"Unable to parse JSON response from Gemini: {body_text[:500]}", body=body_text)
+        ok = True
+        return data
+    finally:
+        total_ms = (time.perf_counter() - t0) * 1000
+        transfer_ms = max(0.0, total_ms - ttfb_ms) if ttfb_ms else 0.0
+        new_conns = max(0, _pool_connection_count() - conns_before)
+        _record(ttfb_ms, transfer_ms, total_ms, new_conns, ok)
+        logger.info("%s call %s in %.0f ms (ttfb %.0f ms, transfer %.0f ms, new conns %d)",
+                    label, "ok" if ok else "failed", total_ms, ttfb_ms, transfer_ms, new_conns)
+
+
+def _retryable(exc):
+    if isinstance(exc, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    if isinstance(exc, GeminiError):
+        return exc.status_code in RETRY_STATUSES or exc.status_code is None
+    return isinstance(exc, requests.RequestException)
+
+
+def cache_key(prompt, model=None, url=None, shape="content", generation_config=None):
+    """The llm_cache key generate_text() uses for this call, for callers that
+    fill or read cache entries themselves (e.g. batched explanations)."""
+    target = url or model_url(model)
+    return make_key(target, prompt, {"shape": shape, "generation_config": generation_config})
+
+
+def generate_text(prompt, api_key, model=None, url=None, shape="content", timeout=60,
+                  max_attempts=3, backoff=1.0, generation_config=None, key_in_query=False,
+                  label="gemini", cache=True, deadline=None):
+    """Send `prompt` to Gemini and return the generated text.
+
+    Retries network errors, 429 and 5xx with jittered exponential backoff;
+    other HTTP errors (401, 404, ...) are raised immediately as GeminiError so
+    callers can react to them (e.g. try another endpoint).
+
+    With a `deadline` (utils.deadline.Deadline) every attempt's timeout is
+    capped by the remaining budget and retries stop once another attempt no
+    longer fits; DeadlineExceeded is raised when the budget is spent.
+
+    Replies are cached by (endpoint, normalized prompt, generation params) and
+    concurrent identical calls share one upstream request. Pass `cache=False`
+    for calls whose answer must not be reused (chat turns, quiz generation that
+    should vary between runs); those are neither cached nor coalesced.
+    """
+    if not api_key:
+        raise GeminiError("Missing GEMINI_API_KEY")
+    target = url or model_url(model)
+    key = cache_key(prompt, url=target, shape=shape, generation_config=generation_config)
+
+    def _call():
+        return _generate_uncached(prompt, api_key, target, shape, timeout, max_attempts, backoff,
+                                  generation_config, key_in_query, label, deadline)
+
+    if not cache:
+        llm_cache.note_bypass()
+        return _call()
+    hit = llm_cache.get(key)
+    if hit is not None:
+        logger.info("%s served from cache", label)
+        return hit
+
+    def _call_and_store():
+        # a previous leader may have finished between our cache miss and now
+        text = llm_cache.peek(key)
+        if text is not None:
+            return text
+        text = _call()
+        llm_cache.set(key, text)
+        return text
+
+    # the lease must outlive every attempt the leader may make, or peers take over and call again
+    lease_ttl = retry_budget(timeout, max_attempts, backoff)
+    if deadline:
+        lease_ttl = min(lease_ttl, deadline.remaining())
+    return flight.do(key, _call_and_store, store=llm_cache, lease_ttl=lease_ttl + 5, deadline=deadline)
+
+
+def retry_budget(timeout, max_attempts, backoff):
+    """Longest a generate_text call can run without a deadline: every attempt
+    timing out (connect + read) plus the longest backoff before each retry."""
+    sleeps = sum(min(BACKOFF_CAP, backoff * 2 ** (attempt - 1)) for attempt in range(1, max_attempts))
+    return max_attempts * (CONNECT_TIMEOUT + timeout) + sleeps
+
+
+def _generate_uncached(prompt, api_key, target, shape, timeout, max_attempts, backoff,
+                       generation_config, key_in_query, label, deadline=None):
+    body = build_payload(prompt, shape=shape, generation_config=generation_config)
+    last_err = None
+    for attempt in range(1, max_attempts + 1):
+        try:
+            attempt_timeout = deadline.timeout(timeout) if deadline else timeout
+            data = post_json(target, body, api_key=api_key, timeout=attempt_timeout,
+                             key_in_query=key_in_query, label=label)
+            text = extract_text(data)
+            if not text or not text.strip():
+                raise GeminiError("Gemini returned no text in response")
+            return text
+        except Exception as exc:
+            last_err = exc
+            if attempt >= max_attempts or not _retryable(exc):
+                break
+            sleep_for = backoff_delay(attempt, base=backoff)
+            if deadline and not deadline.can_fit(sleep_for + MIN_ATTEMPT_SECONDS):
+                logger.warning("%s attempt %d failed: %s. No budget left for a retry (%s)",
+                               label, attempt, exc, deadline)
+                last_err = DeadlineExceeded(f"{label}: budget exhausted after {attempt} attempts: {exc}")
+                break
+            with _stats_lock:
+                _stats["retries"] += 1
+            logger.warning("%s attempt %d/%d failed: %s. Retrying after %.1fs",
+                           label, attempt, max_attempts, exc, sleep_for)
+            time.sleep(sleep_for)
+    if isinstance(last_err, (GeminiError, DeadlineExceeded)):
+        raise last_err
+    raise GeminiError(f"Gemini call failed after {max_attempts} attempts: {last_err}") from last_err
+
+
+def stream_url(url):
+    """streamGenerateContent counterpart of a generateContent URL."""
+    if ":generateContent" in url:
+        return url.replace(":generateContent", ":streamGenerateContent")
+    return url
+
+
+def stream_text(prompt, api_key, model=None, url=None, timeout=60, generation_config=None,
+                key_in_query=False, label="gemini-stream", cache=False, deadline=None):
+    """Yield text deltas from Gemini's streaming API (streamGenerateContent?alt=sse).
+
+    The first delta usually arrives well before the full completion would.
+    With `cache=True` a cached full reply is yielded in one piece, and a
+    completed stream is stored under the same key `generate_text` uses.
+    Raises GeminiError on HTTP errors before the first delta. A `deadline`
+    caps the read timeout by the remaining budget.
+    """
+    global _last_body
+    if not api_key:
+        raise GeminiError("Missing GEMINI_API_KEY")
+    target = url or model_url(model)
+    key = make_key(target, prompt, {"shape": "content", "generation_config": generation_config})
+    if cache:
+        hit = llm_cache.get(key)
+        if hit is not None:
+            yield hit
+            return
+    if deadline:
+        timeout = deadline.timeout(timeout)
+    _admit(label)
+    headers, params = _auth(api_key, target, key_in_query)
+    params["alt"] = "sse"
+    body = build_payload(prompt, generation_config=generation_config)
+    session = get_session()
+    conns_before = _pool_connection_count()
+    t0 = time.perf_counter()
+    ttft_ms = 0.0
+    ok = False
+    pieces = []
+    try:
+        _note_sent()
+        try:
+            resp = session.post(stream_url(target), headers=headers, params=params, json=body,
+                                timeout=(CONNECT_TIMEOUT, timeout), stream=True)
+        except requests.RequestException as e:
+            health.gemini_breaker.record_failure(type(e).__name__)
+            raise
+        _report_status(resp.status_code)
+        if resp.status_code >= 400:
+            body_text = resp.content.decode(resp.encoding or "utf-8", errors="replace")
+            _last_body = body_text
+            raise GeminiError(f"HTTP {resp.status_code} from {target}: {body_text[:500]}",
+                              status_code=resp.status_code, body=body_text)
+        with resp:
+            for line in resp.iter_lines():
+                if not line or not line.startswith(b"data:"):
+                    continue
+                try:
+                    chunk = json.loads(line[5:].strip())
+                except ValueError:
+                    continue
+                delta = extract_text(chunk)
+                if not delta:
+                    continue
+                if not pieces:
+                    ttft_ms = (time.perf_counter() - t0) * 1000
+                pieces.append(delta)
+                yield delta
+        ok = True
+    finally:
+        total_ms = (time.perf_counter() - t0) * 1000
+        new_conns = max(0, _pool_connection_count() - conns_before)
+        # for streams "ttfb" is time to first token and "transfer" the rest of the generation
+        _record(ttft_ms, max(0.0, total_ms - ttft_ms) if ttft_ms else 0.0, total_ms, new_conns, ok)
+        logger.info("%s stream %s in %.0f ms (first token %.0f ms, %d chunks)",
+                    label, "ok" if ok else "failed", total_ms, ttft_ms, len(pieces))
+    full = "".join(pieces)
+    if cache and full.strip():
+        llm_cache.set(key, full)
@@ -0,0 +1,216 @@
+"""Gemini reachability tracking: a circuit breaker fed by real calls plus a
+background probe thread.
+
+Request handlers never probe the network themselves. They ask
+`gemini_available()`, which only reads breaker state, and pick online or
+offline mode from that. The gateway reports every upstream outcome to the
+breaker:
+
+- closed: calls flow. The breaker trips to open after `failure_threshold`
+  consecutive failures, or when the error rate over the last `window` calls
+  reaches `error_rate` (once `min_calls` have been seen).
+- open: calls are refused immediately. After `cooldown` seconds, or earlier
+  if the background probe sees the host reachable again, the breaker moves
+  to half-open.
+- half-open: a single trial call is let through. Success closes the
+  breaker; failure re-opens it.
+
+The probe is a plain TCP connect to the API host with its own socket
+timeout. It runs every `HEALTH_PROBE_INTERVAL` seconds in a daemon thread,
+started lazily once per worker process. Like call failures, probe failures
+must come in a row (`HEALTH_PROBE_FAILURES`, default 3) before they trip
+the breaker, so one dropped connect does not force every request offline.
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger("gemini-health")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+PROBE_HOST = os.getenv("GEMINI_PROBE_HOST") or "generativelanguage.googleapis.com"
+PROBE_PORT = 443
+PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+PROBE_TIMEOUT = 3.0
+PROBE_FAILURE_THRESHOLD = max(1, int(os.getenv("HEALTH_PROBE_FAILURES", "3")))
+MONITOR_DISABLED = str(os.getenv("HEALTH_MONITOR_DISABLED") or "").lower() in ("1", "true", "yes")
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, error_rate=0.5, window=20, min_calls=6, cooldown=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._window = deque(maxlen=window)  # True = success
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.transitions = deque(maxlen=50)
+        self.counters = {"successes": 0, "failures": 0, "rejected": 0}
+
+    # -- state --
+    def _transition(self, new_state, reason):
+        old = self._state
+        if old == new_state:
+            return
+        self._state = new_state
+        if new_state == OPEN:
+            self._opened_at = time.monotonic()
+        if new_state != HALF_OPEN:
+            self._trial_in_flight = False
+        if new_state == CLOSED:
+            self._consecutive_failures = 0
+            self._window.clear()
+        self.transitions.append({"from": old, "to": new_state, "reason": reason, "at": time.time()})
+        logger.warning("%s breaker %s -> %s (%s)", self.name, old, new_state, reason)
+
+    def _cooldown_elapsed(self):
+        return time.monotonic() - self._opened_at >= self.cooldown
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._cooldown_elapsed():
+                self._transition(HALF_OPEN, "cooldown elapsed")
+            return self._state
+
+    def available(self):
+        """Would a call be attempted right now? Read-only; use on the request path."""
+        state = self.state
+        if state == HALF_OPEN:
+            with self._lock:
+                return not self._trial_in_flight
+        return state == CLOSED
+
+    def allow_request(self):
+        """Admit one upstream call. In half-open only a single trial is admitted."""
+        with self._lock:
+            if self._state == OPEN and self._cooldown_elapsed():
+                self._transition(HALF_OPEN, "cooldown elapsed")
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    # -- outcomes --
+    def record_success(self):
+        with self._lock:
+            self.counters["successes"] += 1
+            self._consecutive_failures = 0
+            self._window.append(True)
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED, "trial call succeeded")
+
+    def record_failure(self, reason="call failed"):
+        with self._lock:
+            self.counters["failures"] += 1
+            self._consecutive_failures += 1
+            self._window.append(False)
+            if self._state == HALF_OPEN:
+                self._transition(OPEN, f"trial failed: {reason}")
+                return
+            if self._state != CLOSED:
+                return
+            if self._consecutive_failures >= self.failure_threshold:
+                self._transition(OPEN, f"{self._consecutive_failures} consecutive failures: {reason}")
+                return
+            if len(self._window) >= self.min_calls:
+                failures = self._window.count(False)
+                if failures / len(self._window) >= self.error_rate:
+                    self._transition(OPEN, f"error rate {failures}/{len(self._window)}: {reason}")
+
+    def trip(self, reason):
+        with self._lock:
+            if self._state != OPEN:
+                self._transition(OPEN, reason)
+
+    def probe_succeeded(self):
+        """Background probe reached the host: let an open breaker try a trial call early."""
+        with self._lock:
+            if self._state == OPEN:
+                self._transition(HALF_OPEN, "probe reachable")
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            recent = list(self._window)
+            return {
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "recent_error_rate": round(recent.count(False) / len(recent), 3) if recent else 0.0,
+                **self.counters,
+                "transitions": list(self.transitions),
+            }
+
+
+gemini_breaker = CircuitBreaker("gemini")
+
+
+# ---------------- background monitor ----------------
+_monitor_state = {"reachable": None, "last_probe": None, "last_error": None, "probe_ms": None,
+                  "consecutive_failures": 0}
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+
+def probe_once(host=PROBE_HOST, port=PROBE_PORT, timeout=PROBE_TIMEOUT):
+    """TCP connect to the API host. Uses a per-socket timeout (no global socket state)."""
+    t0 = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            pass
+        ok, err = True, None
+    except OSError as e:
+        ok, err = False, str(e)
+    failures = 0 if ok else _monitor_state["consecutive_failures"] + 1
+    _monitor_state.update(reachable=ok, last_probe=time.time(), last_error=err,
+                          probe_ms=round((time.perf_counter() - t0) * 1000, 1), consecutive_failures=failures)
+    if ok:
+        gemini_breaker.probe_succeeded()
+    elif failures >= PROBE_FAILURE_THRESHOLD:
+        gemini_breaker.trip(f"{failures} consecutive probe failures: {err}")
+    return ok
+
+
+def _monitor_loop():
+    while True:
+        try:
+            probe_once()
+        except Exception:
+            logger.exception("health probe crashed")
+        time.sleep(PROBE_INTERVAL)
+
+
+def ensure_monitor():
+    """Start the probe thread once per worker process (threads do not survive fork)."""
+    global _monitor_pid
+    if MONITOR_DISABLED or _monitor_pid == os.getpid():
+        return
+    with _monitor_lock:
+        if _monitor_pid == os.getpid():
+            return
+        _monitor_pid = os.getpid()
+        threading.Thread(target=_monitor_loop, name="gemini-health", daemon=True).start()
+
+
+def gemini_available():
+    """Request-path check: no I/O, just breaker state."""
+    ensure_monitor()
+    return gemini_breaker.available()
+
+
+def stats():
+    return {"breaker": gemini_breaker.stats(), "monitor": dict(_monitor_state, enabled=not MONITOR_DISABLED)}
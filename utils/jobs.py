@@ -0,0 +1,259 @@
+"""Background job queue for the slow generation endpoints.
+
+`POST .../jobs` variants of /generate-quiz and /summarize hand their work to
+`job_queue` and return `202 {job_id, status_url}` at once, so web threads stay
+free for cheap requests. The job runs on a bounded thread pool
+(`JOB_WORKERS`). When `JOB_MAX_PENDING` jobs are already queued or running,
+submit raises QueueFull and the endpoint answers 429 with Retry-After.
+
+A job function returns `(body, http_status)`, the same pair the synchronous
+endpoint would have sent. Clients poll `GET .../jobs/<id>` or subscribe to
+`GET .../jobs/<id>/events` (SSE). An events stream holds a web thread, so it
+ends after `JOB_EVENTS_MAX_SECONDS` (default: the longest request deadline
+plus 30 s) with a `timeout` event, and the client goes on polling. Records live in memory in the worker that
+runs the job and are mirrored to a SQLite file under the cache dir, so a poll
+that lands on another gunicorn worker still finds them. Finished records
+expire after `JOB_RESULT_TTL` seconds.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify, url_for
+
+from utils.cache import CACHE_DIR, DiskCache
+from utils.deadline import BUDGETS
+from utils.sse import format_event, sse_response
+
+logger = logging.getLogger("jobs")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+class QueueFull(RuntimeError):
+    """Too many jobs queued or running; the client should retry later."""
+
+
+class UnknownJob(KeyError):
+    """No such job id (never submitted, or its result has expired)."""
+
+
+class JobQueue:
+    def __init__(self, name, workers=4, max_pending=32, ttl=600, disk_path=None):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._disk_path = disk_path
+        self._disk = None
+        self._disk_failed = False
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "expired": 0}
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    # -- plumbing --
+    def _pool(self):
+        # executor threads do not survive a fork: one pool per worker process
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-job")
+            self._pid = os.getpid()
+            self._jobs = {}
+        return self._executor
+
+    @property
+    def disk(self):
+        if self._disk is None and not self._disk_failed and self._disk_path:
+            try:
+                self._disk = DiskCache(self._disk_path, max_bytes=16 * 1024 * 1024, ttl=self.ttl)
+            except Exception as e:
+                logger.warning("%s job store unavailable (%s); polls must hit the same worker", self.name, e)
+                self._disk_failed = True
+        return self._disk
+
+    def _publish(self, job):
+        disk = self.disk
+        if disk is None:
+            return
+        try:
+            disk.set(job["id"], json.dumps(job, ensure_ascii=False, default=str).encode("utf-8"))
+        except Exception as e:
+            logger.warning("%s job store write failed: %s", self.name, e)
+
+    def _sweep(self, now):
+        expired = [jid for jid, j in self._jobs.items()
+                   if j["status"] in FINISHED and now - j["finished"] > self.ttl]
+        for jid in expired:
+            del self._jobs[jid]
+        self.counters["expired"] += len(expired)
+
+    def _pending(self):
+        return sum(1 for j in self._jobs.values() if j["status"] not in FINISHED)
+
+    # -- API --
+    def submit(self, kind, fn, *args, **kwargs):
+        """Queue `fn(*args, **kwargs)`; returns the job id. Raises QueueFull."""
+        now = time.time()
+        with self._lock:
+            pool = self._pool()
+            self._sweep(now)
+            if self._pending() >= self.max_pending:
+                self.counters["rejected"] += 1
+                raise QueueFull(f"{self.name} queue full ({self.max_pending} pending)")
+            job = {"id": uuid.uuid4().hex, "kind": kind, "status": QUEUED, "created": now,
+                   "started": None, "finished": None, "http_status": None, "result": None, "error": None}
+            self._jobs[job["id"]] = job
+            self.counters["submitted"] += 1
+        self._publish(job)
+        pool.submit(self._run, job, fn, args, kwargs)
+        return job["id"]
+
+    def _run(self, job, fn, args, kwargs):
+        job["started"] = time.time()
+        job["status"] = RUNNING
+        self._publish(job)
+        try:
+            body, status = fn(*args, **kwargs)
+            job.update(result=body, http_status=status, status=DONE if status < 400 else FAILED)
+        except Exception as e:
+            logger.exception("%s job %s crashed", self.name, job["id"])
+            job.update(error=str(e), http_status=500, status=FAILED)
+        job["finished"] = time.time()
+        with self._lock:
+            self.counters["completed" if job["status"] == DONE else "failed"] += 1
+            self._wait_total += job["started"] - job["created"]
+            self._run_total += job["finished"] - job["started"]
+        self._publish(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        disk = self.disk
+        if disk is not None:
+            try:
+                raw = disk.get(job_id)
+            except Exception:
+                raw = None
+            if raw is not None:
+                return json.loads(raw.decode("utf-8"))
+        raise UnknownJob(job_id)
+
+    def stats(self):
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j["status"] == QUEUED)
+            running = sum(1 for j in self._jobs.values() if j["status"] == RUNNING)
+            finished = self.counters["completed"] + self.counters["failed"]
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queue_depth": queued,
+                "running": running,
+                **self.counters,
+                "avg_wait_ms": round(self._wait_total / finished * 1000, 1) if finished else 0.0,
+                "avg_run_ms": round(self._run_total / finished * 1000, 1) if finished else 0.0,
+            }
+
+
+job_queue = JobQueue(
+    "generation",
+    workers=_env_int("JOB_WORKERS", 4),
+    max_pending=_env_int("JOB_MAX_PENDING", 32),
+    ttl=_env_int("JOB_RESULT_TTL", 600),
+    disk_path=os.path.join(CACHE_DIR, "jobs.sqlite3"),
+)
+
+
+# ---------------- Flask glue ----------------
+EVENTS_MAX_SECONDS = _env_int("JOB_EVENTS_MAX_SECONDS", int(max(BUDGETS.values())) + 30)
+
+
+def _public(job):
+    out = {"job_id": job["id"], "kind": job["kind"], "status": job["status"]}
+    if job["started"]:
+        out["queued_ms"] = round((job["started"] - job["created"]) * 1000, 1)
+    if job["finished"]:
+        out["run_ms"] = round((job["finished"] - job["started"]) * 1000, 1)
+        out["http_status"] = job["http_status"]
+        if job["result"] is not None:
+            out["result"] = job["result"]
+        if job["error"]:
+            out["error"] = job["error"]
+    return out
+
+
+def submit_response(kind, fn, *args, **kwargs):
+    """Submit a job from a request handler: 202 with the job id, or 429 when the queue is full."""
+    try:
+        job_id = job_queue.submit(kind, fn, *args, **kwargs)
+    except QueueFull as e:
+        resp = jsonify({"error": "Server busy, try again shortly", "details": str(e)})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = "5"
+        return resp
+    resp = jsonify({"job_id": job_id, "status": QUEUED,
+                    "status_url": url_for("job_status", job_id=job_id),
+                    "events_url": url_for("job_events", job_id=job_id)})
+    resp.status_code = 202
+    resp.headers["Location"] = url_for("job_status", job_id=job_id)
+    return resp
+
+
+def register_job_routes(app, poll_interval=0.5, max_stream=EVENTS_MAX_SECONDS):
+    """Add GET /jobs/<id> and GET /jobs/<id>/events to `app`. An events stream
+    lasts at most `max_stream` seconds, then tells the client to poll."""
+
+    def job_status(job_id):
+        try:
+            return jsonify(_public(job_queue.get(job_id)))
+        except UnknownJob:
+            return jsonify({"error": "Unknown or expired job", "job_id": job_id}), 404
+
+    def job_events(job_id):
+        status_url = url_for("job_status", job_id=job_id)
+
+        def events():
+            last = None
+            ends = time.monotonic() + max_stream
+            while True:
+                try:
+                    job = job_queue.get(job_id)
+                except UnknownJob:
+                    yield format_event({"error": "Unknown or expired job", "job_id": job_id}, event="error")
+                    return
+                if job["status"] in FINISHED:
+                    yield format_event(_public(job), event="done")
+                    return
+                if job["status"] != last:
+                    last = job["status"]
+                    yield format_event({"job_id": job_id, "status": last})
+                if time.monotonic() >= ends:
+                    # free the web thread; the job keeps running
+                    yield format_event({"job_id": job_id, "status": last, "status_url": status_url}, event="timeout")
+                    return
+                time.sleep(poll_interval)
+
+        return sse_response(events())
+
+    app.add_url_rule("/jobs/<job_id>", "job_status", job_status, methods=["GET"])
+    app.add_url_rule("/jobs/<job_id>/events", "job_events", job_events, methods=["GET"])
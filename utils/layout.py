@@ -0,0 +1,104 @@
+"""Geometric removal of running headers, footers and page numbers.
+
+Works on PyMuPDF text blocks given as [x0, y0, x1, y1, text], with the
+coordinates expressed as fractions of the page size (see
+`utils.extractors.page_blocks`). A block is only a candidate when it sits
+entirely inside the top or bottom `MARGIN_BAND` of the page. A candidate is
+dropped when either:
+
+- its text looks like a page number ("12", "xiv", "Page 3 of 40"); or
+- the same text, ignoring digits, is in the same band on at least
+  `MIN_REPEAT` pages. With digits ignored, "Chapter 2 | 41" and
+  "Chapter 2 | 42" count as the same text.
+
+Body blocks are never looked at. A definition repeated across chapters, or
+a short upper-case heading mid-page, survives. The regex and line-frequency
+cleaners in quiz_generator / static/jsonq.py only see flattened text, so
+they often drop such content.
+"""
+import os
+import re
+
+MARGIN_BAND = float(os.getenv("PDF_MARGIN_BAND", "0.1"))
+MIN_REPEAT = 3
+DISABLED = str(os.getenv("PDF_LAYOUT_CLEAN_DISABLED") or "").lower() in ("1", "true", "yes")
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACE_RE = re.compile(r"\s+")
+_ROMAN = r"(?=[ivxlcdm])m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})"
+_PAGE_NUMBER_RE = re.compile(r"^[\W_]*(?:page|pg\.?|p\.)?\s*(?:#|" + _ROMAN + r")(?:\s*(?:of|/)\s*#)?[\W_]*$")
+
+
+def band_of(block, band=MARGIN_BAND):
+    """Margin band a block [x0, y0, x1, y1, text] lies in: "top", "bottom" or None."""
+    if block[3] <= band:
+        return "top"
+    if block[1] >= 1 - band:
+        return "bottom"
+    return None
+
+
+def _normalize(text):
+    return _SPACE_RE.sub(" ", _DIGITS_RE.sub("#", text.lower())).strip()
+
+
+def _signature(block, band=MARGIN_BAND):
+    where = band_of(block, band)
+    if where is None:
+        return None
+    norm = _normalize(block[4])
+    return (where, norm) if norm else None
+
+
+def furniture_signatures(block_pages, band=MARGIN_BAND, min_repeat=MIN_REPEAT):
+    """Margin texts repeated on enough pages to be running heads/feet.
+
+    `block_pages` is an iterable of per-page block lists. A signature counts
+    once per page. The threshold is `min_repeat` pages, lowered to the page
+    count for 2-page documents (a single page can't show repetition).
+    """
+    counts = {}
+    pages = 0
+    for blocks in block_pages:
+        pages += 1
+        for sig in {_signature(b, band) for b in blocks}:
+            if sig is not None:
+                counts[sig] = counts.get(sig, 0) + 1
+    if pages < 2:
+        return set()
+    needed = min(min_repeat, pages)
+    return {sig for sig, n in counts.items() if n >= needed}
+
+
+def is_furniture(block, signatures, band=MARGIN_BAND):
+    sig = _signature(block, band)
+    if sig is None:
+        return False
+    return sig in signatures or bool(_PAGE_NUMBER_RE.match(sig[1]))
+
+
+def clean_blocks(blocks, signatures, band=MARGIN_BAND):
+    """Page text without its furniture blocks. Returns (text, dropped_chars)."""
+    kept = []
+    dropped = 0
+    for b in blocks:
+        if is_furniture(b, signatures, band):
+            dropped += len(b[4])
+        else:
+            kept.append(b[4])
+    return "".join(kept), dropped
+
+
+def strip_furniture(pages, signatures=None, band=MARGIN_BAND):
+    """Rewrite page dicts carrying "blocks" in place: "text"/"chars" lose the
+    furniture, "furniture_chars" records how much went, "blocks" is removed.
+    Signatures are learned from these pages unless given."""
+    if signatures is None:
+        signatures = furniture_signatures((p.get("blocks") or [] for p in pages), band)
+    for p in pages:
+        blocks = p.pop("blocks", None)
+        if blocks is None:
+            continue
+        text, dropped = clean_blocks(blocks, signatures, band)
+        p.update(text=text, chars=len(text), furniture_chars=dropped)
+    return pages
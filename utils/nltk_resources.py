@@ -0,0 +1,138 @@
+"""NLTK data without network access.
+
+`quiz_generator` used to call `nltk.download` for four resources on every
+import. On hosts without internet access each call waits on the network
+before failing, and that wait landed on every worker boot. Instead, the data
+is prepared once into a directory shipped with the deployment:
+
+    python -m utils.nltk_resources prepare [--dir PATH]   # on a machine with internet
+    python -m utils.nltk_resources check                  # what this host can see
+
+`NLTK_RESOURCE_DIR` (default data/nltk_data) is searched first, then the
+usual NLTK locations (`NLTK_DATA`, ~/nltk_data, /usr/share/nltk_data, ...).
+
+`verify()` only stats files, so it is safe at import time: it never imports
+nltk and never opens a socket. nltk itself (about 0.35 s to import, on top
+of scikit-learn) is imported by `load_nltk()` on first use, and callers
+check `available()` before using a corpus or model, so a missing one falls
+back immediately instead of raising LookupError on every call.
+"""
+import os
+import sys
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger("nltk_resources")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv("NLTK_RESOURCE_DIR") or os.path.join(BASE_DIR, "data", "nltk_data")
+
+# name passed to nltk.download -> path under an nltk_data directory
+RESOURCES = {
+    "punkt_tab": "tokenizers/punkt_tab",
+    "averaged_perceptron_tagger_eng": "taggers/averaged_perceptron_tagger_eng",
+    "wordnet": "corpora/wordnet",
+    "stopwords": "corpora/stopwords",
+}
+
+
+def search_paths():
+    """Directories searched for resources, in order. Mirrors nltk.data.path
+    (without importing nltk), with DATA_DIR in front."""
+    paths = [DATA_DIR]
+    paths += [p for p in os.getenv("NLTK_DATA", "").split(os.pathsep) if p]
+    home = os.path.expanduser("~/")
+    if home != "~/":
+        paths.append(os.path.join(home, "nltk_data"))
+    if sys.platform.startswith("win"):
+        appdata = os.getenv("APPDATA", "C:\\")
+        paths += [os.path.join(sys.prefix, "nltk_data"), os.path.join(sys.prefix, "share", "nltk_data"),
+                  os.path.join(sys.prefix, "lib", "nltk_data"), os.path.join(appdata, "nltk_data"),
+                  "C:\\nltk_data", "D:\\nltk_data", "E:\\nltk_data"]
+    else:
+        paths += [os.path.join(sys.prefix, "nltk_data"), os.path.join(sys.prefix, "share", "nltk_data"),
+                  os.path.join(sys.prefix, "lib", "nltk_data"), "/usr/share/nltk_data",
+                  "/usr/local/share/nltk_data", "/usr/lib/nltk_data", "/usr/local/lib/nltk_data"]
+    return list(dict.fromkeys(paths))
+
+
+def find(name, paths=None):
+    """Location of resource `name` (unpacked directory or .zip), or None."""
+    rel = RESOURCES[name]
+    for base in paths or search_paths():
+        for candidate in (os.path.join(base, rel), os.path.join(base, rel + ".zip")):
+            if os.path.exists(candidate):
+                return candidate
+    return None
+
+
+_status = None
+_nltk = None
+_lock = threading.Lock()
+
+
+def verify():
+    """{resource: location or None}, checked once per process. Logs one
+    warning naming whatever is missing. Filesystem only."""
+    global _status
+    if _status is None:
+        with _lock:
+            if _status is None:
+                status = {name: find(name) for name in RESOURCES}
+                missing = [name for name, where in status.items() if where is None]
+                if missing:
+                    logger.warning("NLTK data missing: %s; using regex fallbacks "
+                                   "(prepare it with: python -m utils.nltk_resources prepare)", ", ".join(missing))
+                _status = status
+    return _status
+
+
+def available(name):
+    return verify().get(name) is not None
+
+
+def load_nltk():
+    """The nltk module, imported on first call, with DATA_DIR on its search path."""
+    global _nltk
+    if _nltk is None:
+        with _lock:
+            if _nltk is None:
+                import nltk
+                if DATA_DIR not in nltk.data.path:
+                    nltk.data.path.insert(0, DATA_DIR)
+                _nltk = nltk
+    return _nltk
+
+
+def prepare(dest=DATA_DIR, names=None):
+    """Download resources into `dest` (needs network). Returns {name: location or None}."""
+    nltk = load_nltk()
+    os.makedirs(dest, exist_ok=True)
+    for name in names or RESOURCES:
+        nltk.download(name, download_dir=dest, quiet=True, raise_on_error=True)
+    return {name: find(name, [dest]) for name in names or RESOURCES}
+
+
+def stats():
+    return {"dir": DATA_DIR, "loaded": _nltk is not None,
+            "resources": {name: where is not None for name, where in verify().items()}}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m utils.nltk_resources", description="offline NLTK data")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("prepare", help="download the resources into a directory (needs network)")
+    p.add_argument("--dir", default=DATA_DIR)
+    sub.add_parser("check", help="show where each resource is found on this host")
+    args = ap.parse_args(argv)
+    status = prepare(args.dir) if args.cmd == "prepare" else verify()
+    for name, where in status.items():
+        print(f"{name:<32} {where or 'MISSING'}")
+    if args.cmd == "prepare":
+        print(f"copy {args.dir} to the servers (or point NLTK_RESOURCE_DIR at it)")
+    return 0 if all(status.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
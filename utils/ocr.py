@@ -0,0 +1,194 @@
+"""OCR for scanned PDFs and uploaded images.
+
+Pipeline per image:
+1. grayscale, and downscale so the longer side is at most `OCR_MAX_SIDE` px
+   (phone photos are often 4000px+; tesseract gains nothing past ~300 dpi);
+2. binarize with an Otsu threshold computed from the histogram;
+3. look the result up in `ocr_cache` (SHA-256 of the preprocessed pixels),
+   otherwise run tesseract.
+
+Tesseract runs on a bounded thread pool (`OCR_WORKERS`, default half the
+CPUs) shared by every request, and each tesseract process is limited to one
+OpenMP thread, so a single scanned book can't take every core. `extract_pdf`
+only sends pages without a text layer here (see `needs_ocr`).
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+from utils.cache import CACHE_DIR, TieredCache
+
+logger = logging.getLogger("ocr")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+OCR_WORKERS = _env_int("OCR_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+OCR_MAX_SIDE = _env_int("OCR_MAX_SIDE", 2200)
+OCR_DPI = _env_int("OCR_DPI", 200)
+OCR_LANG = os.getenv("OCR_LANG") or "eng"
+# pages with fewer extracted characters than this are treated as scans
+OCR_MIN_CHARS = _env_int("OCR_MIN_CHARS", 20)
+OCR_DISABLED = str(os.getenv("OCR_DISABLED") or "").lower() in ("1", "true", "yes")
+
+# tesseract's own OpenMP threading would multiply with our pool
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+ocr_cache = TieredCache(
+    "ocr",
+    max_entries=_env_int("OCR_CACHE_MEMORY_ENTRIES", 256),
+    disk_path=os.path.join(CACHE_DIR, "ocr_cache.sqlite3"),
+    max_bytes=_env_int("OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    ttl=_env_int("OCR_CACHE_TTL", 30 * 24 * 3600),
+)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_available = None
+counters = {"images": 0, "ocr_runs": 0, "ocr_ms": 0.0, "preprocess_ms": 0.0, "failures": 0}
+_counter_lock = threading.Lock()
+
+
+def available():
+    """True when pytesseract and the tesseract binary are both usable (checked once)."""
+    global _available
+    if _available is None:
+        if OCR_DISABLED or pytesseract is None:
+            _available = False
+        else:
+            try:
+                pytesseract.get_tesseract_version()
+                _available = True
+            except Exception as e:
+                logger.warning("OCR unavailable: %s", e)
+                _available = False
+    return _available
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _count(**deltas):
+    with _counter_lock:
+        for k, v in deltas.items():
+            counters[k] += v
+
+
+def otsu_threshold(histogram):
+    """Gray level that best separates dark and light pixels (Otsu's method) for a 256-bin histogram."""
+    total = sum(histogram)
+    if not total:
+        return 127
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg = weight_bg = 0
+    best, best_var = 127, -1.0
+    for level, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best_var:
+            best, best_var = level, between
+    return best
+
+
+def preprocess(img, max_side=OCR_MAX_SIDE):
+    """Grayscale, downscale to `max_side`, binarize. Returns a mode "1" image."""
+    img = img.convert("L")
+    longest = max(img.size)
+    if longest > max_side:
+        scale = max_side / longest
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+    threshold = otsu_threshold(img.histogram())
+    return img.point(lambda v: 255 if v > threshold else 0, mode="1")
+
+
+def _ocr_one(img, use_cache=True):
+    t0 = time.perf_counter()
+    prepared = preprocess(img)
+    key = f"v1:{OCR_LANG}:" + hashlib.sha256(prepared.tobytes()).hexdigest()
+    _count(images=1, preprocess_ms=(time.perf_counter() - t0) * 1000)
+    if use_cache:
+        hit = ocr_cache.get(key)
+        if hit is not None:
+            return hit
+    t1 = time.perf_counter()
+    try:
+        text = pytesseract.image_to_string(prepared, lang=OCR_LANG).strip()
+    except Exception as e:
+        logger.error("OCR failed: %s", e)
+        _count(failures=1)
+        return ""
+    _count(ocr_runs=1, ocr_ms=(time.perf_counter() - t1) * 1000)
+    if use_cache:
+        ocr_cache.set(key, text)
+    return text
+
+
+def ocr_images(images, use_cache=True):
+    """OCR PIL images on the shared pool; returns texts in input order ("" on failure)."""
+    if not images:
+        return []
+    if not available():
+        return [""] * len(images)
+    return list(_get_pool().map(lambda im: _ocr_one(im, use_cache), images))
+
+
+def ocr_image(img, use_cache=True):
+    return ocr_images([img], use_cache)[0]
+
+
+def needs_ocr(page_text, page):
+    """A page needs OCR when it has (almost) no text layer but carries images."""
+    if len(page_text.strip()) >= OCR_MIN_CHARS:
+        return False
+    try:
+        return bool(page.get_images(full=False))
+    except Exception:
+        return False
+
+
+def render_page(page, dpi=OCR_DPI):
+    """Rasterize a PyMuPDF page to a grayscale PIL image."""
+    pix = page.get_pixmap(dpi=dpi, colorspace="gray", alpha=False)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def stats():
+    with _counter_lock:
+        snap = dict(counters)
+    snap["ocr_ms"] = round(snap["ocr_ms"], 1)
+    snap["preprocess_ms"] = round(snap["preprocess_ms"], 1)
+    snap["workers"] = OCR_WORKERS
+    snap["available"] = bool(_available)
+    snap["cache"] = ocr_cache.stats()
+    return snap
@@ -0,0 +1,37 @@
+"""Page extraction run inside the PDF process pool (see utils.extractors).
+
+Tasks only need this module and PyMuPDF. Keep it free of app, cache and
+OCR imports: every spawned worker pays for each import here.
+"""
+try:
+    import pymupdf as fitz  # PyMuPDF >= 1.24
+except ImportError:
+    import fitz  # PyMuPDF
+
+
+def page_blocks(page):
+    """Text blocks of a PyMuPDF page as [x0, y0, x1, y1, text], in reading
+    (content stream) order, with coordinates as fractions of the page size."""
+    width = page.rect.width or 1
+    height = page.rect.height or 1
+    return [[round(b[0] / width, 4), round(b[1] / height, 4), round(b[2] / width, 4), round(b[3] / height, 4), b[4]]
+            for b in page.get_text("blocks", sort=False) if b[6] == 0]
+
+
+def page_entry(page, number, blocks=False):
+    if not blocks:
+        text = page.get_text("text")
+        return {"number": number + 1, "text": text, "chars": len(text)}
+    found = page_blocks(page)
+    text = "".join(b[4] for b in found)
+    return {"number": number + 1, "text": text, "chars": len(text), "blocks": found}
+
+
+def page_texts(doc, start, stop, blocks=False):
+    return [page_entry(doc.load_page(number), number, blocks) for number in range(start, stop)]
+
+
+def extract_range(path, start, stop, blocks=False):
+    """Process-pool task: text (and blocks) of pages [start, stop) of the PDF at `path`."""
+    with fitz.open(path) as doc:
+        return page_texts(doc, start, stop, blocks)
@@ -0,0 +1,404 @@
+"""Persistent question banks, one per document.
+
+Quizzing the same notes again (a retake, or a different `amount`) used to
+rerun the whole offline pipeline or a Gemini call. Instead, each document
+gets a bank of questions in `cache/question_bank.sqlite3`, keyed by the
+SHA-256 of its cleaned text, the difficulty and the source:
+
+- "offline" banks start with the questions the first request for a
+  document needs plus a margin for a quick retake, spread over the whole
+  text; a background job then tops the bank up to `BANK_SIZE` (`top_up`). A lease makes one worker fill
+  while the others wait for it. A fill that fails is not retried.
+- "ai" banks grow with every Gemini reply for the document, and are used
+  only while they hold `amount` questions the user has not seen yet.
+
+A request samples `amount` random rows. With a user id (the session user,
+the client id the quiz page sends, or a fingerprint of an anonymous
+caller), questions that user has already been served are skipped. The
+cost follows `amount`, not the bank size: random indices are probed in
+small batches, and one indexed query per batch drops the seen ones. When an offline bank has no unseen questions left for the
+user, a new round starts and the questions can come back.
+
+Counters (hits, misses, fills, sample and fill times) are under
+`question_bank` in /api/ai-stats.
+"""
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from utils.cache import CACHE_DIR
+
+logger = logging.getLogger("question_bank")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+BANK_SIZE = _env_int("QUESTION_BANK_SIZE", 100)
+BANK_TTL = _env_int("QUESTION_BANK_TTL", 30 * 24 * 3600)
+FILL_WAIT = _env_int("QUESTION_BANK_FILL_WAIT", 60)
+DISABLED = str(os.getenv("QUESTION_BANK_DISABLED") or "").lower() in ("1", "true", "yes")
+
+# bump when generated questions change shape, so old banks are not served
+BANK_VERSION = 1
+
+
+def bank_key(text, difficulty, source):
+    blob = f"{BANK_VERSION}\0{source}\0{difficulty}\0{text}"
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _question_hash(q):
+    return hashlib.sha256(" ".join(str(q.get("question", "")).lower().split()).encode("utf-8")).hexdigest()
+
+
+class QuestionBank:
+    EVICT_EVERY = 20  # drop banks unused for `ttl` every N fills
+    PROBE_ROUNDS = 3
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, path, ttl=BANK_TTL, enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._lock = threading.Lock()
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "short": 0, "rounds": 0, "served": 0,
+                         "fills": 0, "fill_waits": 0, "top_ups": 0, "added": 0, "errors": 0, "evicted": 0,
+                         "sample_ms": 0.0, "fill_ms": 0.0}
+
+    # -- plumbing --
+    def _conn(self):
+        # one connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            if not self._ready:
+                with self._init_lock:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS banks ("
+                    " key TEXT PRIMARY KEY, source TEXT NOT NULL, size INTEGER NOT NULL,"
+                    " target INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS banks_accessed ON banks(accessed)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS questions ("
+                    " key TEXT NOT NULL, idx INTEGER NOT NULL, qhash TEXT NOT NULL, body TEXT NOT NULL,"
+                    " PRIMARY KEY (key, idx))"
+                )
+                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS questions_hash ON questions(key, qhash)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS seen ("
+                    " user TEXT NOT NULL, key TEXT NOT NULL, idx INTEGER NOT NULL, at REAL NOT NULL,"
+                    " PRIMARY KEY (user, key, idx))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS seen_key ON seen(key)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS leases ("
+                    " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+                )
+                self._ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _seen_among(self, conn, user, key, indices):
+        marks = ",".join("?" * len(indices))
+        rows = conn.execute(f"SELECT idx FROM seen WHERE user=? AND key=? AND idx IN ({marks})",
+                            (user, key, *indices))
+        return {r[0] for r in rows}
+
+    def _pick(self, conn, key, size, user, n, exclude=(), unseen=None):
+        """n distinct indices in [0, size), outside `exclude` and not seen by `user`
+        (`unseen` of them are left, which sizes the probe batches)."""
+        picked, rejected = [], set(exclude)
+        if not user and not rejected:
+            return random.sample(range(size), n)
+        for _ in range(self.PROBE_ROUNDS):
+            need = n - len(picked)
+            if need <= 0:
+                return picked
+            batch = 2 * need * size // max(1, unseen or size) + 4
+            probe = [i for i in random.sample(range(size), min(size, batch)) if i not in rejected]
+            if not probe:
+                continue
+            seen = self._seen_among(conn, user, key, probe) if user else set()
+            for i in probe:
+                if i in seen:
+                    rejected.add(i)
+                elif len(picked) < n:
+                    picked.append(i)
+                    rejected.add(i)
+        if len(picked) < n:
+            # only a few unseen questions left: list them instead of probing
+            if user:
+                rejected.update(r[0] for r in conn.execute("SELECT idx FROM seen WHERE user=? AND key=?", (user, key)))
+            rest = [i for i in range(size) if i not in rejected]
+            picked += random.sample(rest, min(len(rest), n - len(picked)))
+        return picked
+
+    def _mark_seen(self, conn, user, key, indices):
+        now = time.time()
+        conn.executemany("INSERT OR IGNORE INTO seen(user, key, idx, at) VALUES (?,?,?,?)",
+                         [(user, key, i, now) for i in indices])
+
+    # -- public API --
+    def sample(self, key, amount, user=None, recycle=True):
+        """`amount` random questions from bank `key`, skipping those `user` has
+        seen. None (a miss) when there is no bank, when it was filled with
+        fewer than `amount` questions while the document had more, or, with
+        recycle=False, when fewer than `amount` unseen questions are left.
+        With recycle=True, running out starts a new round for the user."""
+        if not self.enabled:
+            return None
+        t0 = time.perf_counter()
+        self._count("lookups")
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT size, target FROM banks WHERE key=?", (key,)).fetchone()
+            if row is None or (amount > row[0] >= row[1]):
+                self._count("misses")
+                return None
+            size = row[0]
+            n = min(amount, size)
+            unseen = size
+            if user:
+                unseen -= conn.execute("SELECT COUNT(*) FROM seen WHERE user=? AND key=?", (user, key)).fetchone()[0]
+            if unseen >= n:
+                picked = self._pick(conn, key, size, user, n, unseen=unseen)
+            elif not recycle:
+                self._count("short")
+                return None
+            else:
+                picked = self._pick(conn, key, size, user, max(0, unseen), unseen=unseen)
+                # everything else becomes unseen again; this quiz opens the new round
+                conn.execute("DELETE FROM seen WHERE user=? AND key=?", (user, key))
+                picked += self._pick(conn, key, size, None, n - len(picked), exclude=picked)
+                self._count("rounds")
+            quiz = []
+            if picked:
+                marks = ",".join("?" * len(picked))
+                bodies = dict(conn.execute(f"SELECT idx, body FROM questions WHERE key=? AND idx IN ({marks})",
+                                           (key, *picked)))
+                for i in picked:
+                    q = json.loads(bodies[i])
+                    if isinstance(q.get("options"), list):
+                        random.shuffle(q["options"])
+                    quiz.append(q)
+                if user:
+                    self._mark_seen(conn, user, key, picked)
+            conn.execute("UPDATE banks SET accessed=? WHERE key=?", (time.time(), key))
+        except (sqlite3.Error, KeyError, ValueError) as e:
+            logger.warning("Question bank lookup failed: %s", e)
+            self._count("errors")
+            return None
+        self._count("hits")
+        self._count("served", len(quiz))
+        self._count("sample_ms", (time.perf_counter() - t0) * 1000)
+        return quiz
+
+    def store(self, key, questions, source, target):
+        """Replace bank `key` with `questions`, generated by asking for `target`
+        of them. Whatever users had seen of the old bank is forgotten."""
+        conn = self._conn()
+        now = time.time()
+        rows, hashes = [], set()
+        for q in questions:
+            h = _question_hash(q)
+            if h not in hashes:
+                hashes.add(h)
+                rows.append((key, len(rows), h, json.dumps(q, ensure_ascii=False)))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM questions WHERE key=?", (key,))
+            conn.execute("DELETE FROM seen WHERE key=?", (key,))
+            conn.executemany("INSERT INTO questions(key, idx, qhash, body) VALUES (?,?,?,?)", rows)
+            conn.execute("INSERT OR REPLACE INTO banks(key, source, size, target, created, accessed) VALUES (?,?,?,?,?,?)",
+                         (key, source, len(rows), target, now, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def add(self, key, questions, source, user=None, target=None):
+        """Append new questions to bank `key` (created if needed), skipping ones
+        it already holds; all of `questions` count as seen by `user`. With
+        `target`, the bank now counts as filled by asking for that many."""
+        if not self.enabled or not questions:
+            return 0
+        try:
+            conn = self._conn()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT size FROM banks WHERE key=?", (key,)).fetchone()
+                size = row[0] if row else 0
+                served, added = [], 0
+                for q in questions:
+                    h = _question_hash(q)
+                    hit = conn.execute("SELECT idx FROM questions WHERE key=? AND qhash=?", (key, h)).fetchone()
+                    if hit is None:
+                        conn.execute("INSERT INTO questions(key, idx, qhash, body) VALUES (?,?,?,?)",
+                                     (key, size, h, json.dumps(q, ensure_ascii=False)))
+                        hit = (size,)
+                        size += 1
+                        added += 1
+                    served.append(hit[0])
+                if row is None:
+                    conn.execute("INSERT INTO banks(key, source, size, target, created, accessed) VALUES (?,?,?,?,?,?)",
+                                 (key, source, size, target or 0, now, now))
+                elif target:
+                    conn.execute("UPDATE banks SET size=?, target=MAX(target, ?), accessed=? WHERE key=?",
+                                 (size, target, now, key))
+                else:
+                    conn.execute("UPDATE banks SET size=?, accessed=? WHERE key=?", (size, now, key))
+                if user:
+                    self._mark_seen(conn, user, key, served)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Question bank add failed: %s", e)
+            self._count("errors")
+            return 0
+        self._count("added", added)
+        return added
+
+    def serve(self, key, amount, fill, source, target, user=None):
+        """sample(), filling the bank first on a miss: `fill()` returns the
+        questions (`target` were asked for; keep it to what this request needs
+        and grow the bank later with top_up). One worker fills while the others
+        wait for it. An exception from `fill()` propagates. None if the bank is
+        disabled or unusable, so the caller generates directly."""
+        quiz = self.sample(key, amount, user)
+        if quiz is not None or not self.enabled:
+            return quiz
+        questions = None
+        try:
+            if not self._acquire_lease(key):
+                self._count("fill_waits")
+                deadline = time.monotonic() + FILL_WAIT
+                while self._lease_held(key) and time.monotonic() < deadline:
+                    time.sleep(self.POLL_INTERVAL)
+                return self.sample(key, amount, user)
+            try:
+                t0 = time.perf_counter()
+                questions = fill()
+                self.store(key, questions, source, target)
+                self._count("fills")
+                self._count("fill_ms", (time.perf_counter() - t0) * 1000)
+                if self.counters["fills"] % self.EVICT_EVERY == 0:
+                    self.evict()
+            finally:
+                self._release_lease(key)
+        except sqlite3.Error as e:
+            logger.warning("Question bank fill failed: %s", e)
+            self._count("errors")
+            # the questions were generated; serve them rather than generating again
+            return questions[:amount] if questions is not None else None
+        return self.sample(key, amount, user)
+
+    def needs_top_up(self, key, target):
+        """True when bank `key` holds everything it was filled with but was
+        filled with fewer than `target` questions, and no fill is running."""
+        if not self.enabled:
+            return False
+        try:
+            row = self._conn().execute("SELECT size, target FROM banks WHERE key=?", (key,)).fetchone()
+            return row is not None and row[0] >= row[1] < target and not self._lease_held(key)
+        except sqlite3.Error:
+            return False
+
+    def top_up(self, key, fill, source, target):
+        """Grow bank `key` towards `target` questions: `fill()` returns them, and
+        the ones already banked are skipped, so what users have seen stays
+        seen. Meant for a background job; it does nothing while another worker
+        fills the bank. Returns how many questions were added."""
+        if not self.enabled or not self._acquire_lease(key):
+            return 0
+        try:
+            row = self._conn().execute("SELECT target FROM banks WHERE key=?", (key,)).fetchone()
+            if row is None or row[0] >= target:
+                return 0
+            added = self.add(key, fill(), source, target=target)
+            self._count("top_ups")
+            return added
+        finally:
+            self._release_lease(key)
+
+    def evict(self):
+        """Drop banks nobody has sampled for `ttl` seconds."""
+        conn = self._conn()
+        stale = [r[0] for r in conn.execute("SELECT key FROM banks WHERE accessed<?", (time.time() - self.ttl,))]
+        for key in stale:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("questions", "seen", "banks"):
+                    conn.execute(f"DELETE FROM {table} WHERE key=?", (key,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._count("evicted", len(stale))
+        return len(stale)
+
+    # -- fill leases across workers (as in utils.cache.DiskCache) --
+    def _owner(self):
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def _acquire_lease(self, key):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM leases WHERE key=? AND expires<=?", (key, now))
+        cur = conn.execute("INSERT OR IGNORE INTO leases(key, owner, expires) VALUES (?,?,?)",
+                           (key, self._owner(), now + FILL_WAIT))
+        return cur.rowcount == 1
+
+    def _release_lease(self, key):
+        self._conn().execute("DELETE FROM leases WHERE key=? AND owner=?", (key, self._owner()))
+
+    def _lease_held(self, key):
+        row = self._conn().execute("SELECT 1 FROM leases WHERE key=? AND expires>?", (key, time.time())).fetchone()
+        return row is not None
+
+    def stats(self):
+        with self._lock:
+            snap = dict(self.counters)
+        snap["hit_rate"] = round(snap["hits"] / snap["lookups"], 3) if snap["lookups"] else 0.0
+        sample_ms, fill_ms = snap.pop("sample_ms"), snap.pop("fill_ms")
+        snap["avg_sample_ms"] = round(sample_ms / snap["hits"], 2) if snap["hits"] else 0.0
+        snap["avg_fill_ms"] = round(fill_ms / snap["fills"], 1) if snap["fills"] else 0.0
+        snap["enabled"] = self.enabled
+        snap["bank_size"] = BANK_SIZE
+        if self.enabled:
+            try:
+                conn = self._conn()
+                snap["banks"], snap["questions"] = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM banks").fetchone()
+            except sqlite3.Error:
+                pass
+        return snap
+
+
+question_bank = QuestionBank(os.path.join(CACHE_DIR, "question_bank.sqlite3"), enabled=not DISABLED)
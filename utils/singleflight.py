@@ -0,0 +1,114 @@
+"""Single-flight coalescing of identical in-flight calls.
+
+Concurrent callers asking for the same key share one execution of `fn`:
+- threads in the same worker wait on the leader's Event and receive its result
+  (or its exception)
+- when a shared `store` (a `utils.cache.TieredCache`) is given, workers in other
+  processes coordinate through a lease row in the store's SQLite file: the
+  worker that holds the lease calls upstream, the others poll the store until
+  the leader's result lands there or the lease goes away.
+
+`fn` must write its result to `store` itself before returning; the lease is
+released afterwards.
+
+Waiters give up with DeadlineExceeded when their own `deadline`
+(utils.deadline.Deadline) runs out before the leader finishes.
+"""
+import time
+import logging
+import threading
+
+from utils.deadline import DeadlineExceeded
+
+logger = logging.getLogger("singleflight")
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {"leaders": 0, "thread_shared": 0, "process_shared": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def do(self, key, fn, store=None, lease_ttl=60, deadline=None):
+        """Run `fn()` once per key across concurrent callers and return its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+        if not leader:
+            if not call.event.wait(deadline.remaining() if deadline else None):
+                raise DeadlineExceeded(f"{self.name}: deadline passed waiting for the in-flight call")
+            self._count("thread_shared")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._run(key, fn, store, lease_ttl, deadline)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _run(self, key, fn, store, lease_ttl, deadline=None):
+        lease = store.acquire_lease(key, lease_ttl) if store is not None else None
+        if lease is False:
+            # another worker is already calling upstream for this key
+            wait = min(lease_ttl, deadline.remaining()) if deadline else lease_ttl
+            value = self._wait_for_peer(key, store, wait)
+            if value is not None:
+                self._count("process_shared")
+                return value
+            if deadline and deadline.expired:
+                raise DeadlineExceeded(f"{self.name}: deadline passed waiting for a peer worker")
+            lease = store.acquire_lease(key, lease_ttl)
+        self._count("leaders")
+        try:
+            return fn()
+        finally:
+            if lease:
+                store.release_lease(key)
+
+    def _wait_for_peer(self, key, store, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            value = store.peek(key)
+            if value is not None:
+                return value
+            if not store.lease_held(key):
+                # leader finished without storing (error) or died; one last look
+                return store.peek(key)
+            time.sleep(self.POLL_INTERVAL)
+        logger.warning("%s: gave up waiting for peer on %s", self.name, key[:12])
+        return None
+
+    def stats(self):
+        with self._lock:
+            snap = dict(self.counters)
+            snap["in_flight"] = len(self._calls)
+        snap["saved_calls"] = snap["thread_shared"] + snap["process_shared"]
+        return snap
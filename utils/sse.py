@@ -0,0 +1,27 @@
+"""Server-Sent-Events helpers shared by the streaming endpoints.
+
+Event protocol used by /chat/stream, /ask-ai/stream and /summarize/stream:
+- `data: {"delta": "..."}`            one per model chunk
+- `event: done` + `data: {...}`       final payload (full text, doc ids, ...)
+- `event: error` + `data: {"error"}`  the stream failed; no `done` follows
+"""
+import json
+
+from flask import Response, stream_with_context
+
+
+def format_event(data, event=None):
+    out = ""
+    if event:
+        out += f"event: {event}\n"
+    out += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return out
+
+
+def sse_response(events):
+    """Wrap a generator of formatted events in a non-buffered text/event-stream response."""
+    resp = Response(stream_with_context(events), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    # stop nginx-style proxies from buffering the whole stream
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
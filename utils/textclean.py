@@ -0,0 +1,239 @@
+"""Single-pass line cleaners for the offline quiz generators.
+
+Both generators clean extracted text line by line before building questions.
+This module holds that work in one place, with precompiled patterns and
+each line normalized once:
+
+- `TextCleaner` is the cleaner behind `quiz_generator.clean_input_text`.
+  It drops lines of one or two words, page/figure labels, copyright, DOI
+  and URL lines, and lines repeated often enough to be running heads.
+- `PageCleaner` is the cleaner behind `static/jsonq.clean_and_merge_pages`.
+  It works per page (segment) and drops lines found on at least 30% of the
+  pages, page numbers, TOC lines and ranges, header-like lines and lines
+  of three words or fewer.
+
+Both stream: `feed()` (or `feed_page()`) normalizes and filters lines as
+text arrives, in pieces of any size, so a document can be cleaned while it
+is extracted page by page. Only the repetition test needs the whole
+document, and `finish()` applies it to the lines already kept. The results
+match the per-line regex loops these classes replace.
+
+Most of the old cost was unanchored alternations (`copyright|doi:|http`,
+the header keywords, `\.{3,}|contents`) searched at every position of
+every line. Here, Unicode normalization runs once per block rather than per
+line. Literal markers are found with `in` before any regex runs. An ASCII
+line is tokenized once, and that one tokenization answers the keyword,
+upper-case and short-line tests. Lines with other characters take the
+exact regexes, since case-insensitive matching and `\w` differ there.
+"""
+import re
+import unicodedata
+from collections import Counter
+
+_SPACE_RE = re.compile(r"\s+")
+
+# TextCleaner: tested against the lowercased, stripped line
+_JUNK_START_RE = re.compile(r"\s*(?:page\s*\d+\b|\d+\s*$|fig(?:ure\s*|\.\s*)\d+)")
+_COPYRIGHT_RE = re.compile(r"copyright\b")
+_THREE_WORDS_RE = re.compile(r"\S+\s+\S+\s+\S")
+
+# PageCleaner
+_EMOJI_RE = re.compile("[\U0001F300-\U0001F6FF\u2600-\u26FF\u2700-\u27BF]")
+_BULLETS_RE = re.compile(r"^[\s\-\u2022\u25CF\u25CB\u25A0\u25B2\u2023\u2043]+")
+# str.isspace() characters (what \s matches) plus the bullets above, for str.lstrip
+_LEADING = ("\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+            "\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+            "-\u2022\u25CF\u25CB\u25A0\u25B2\u2023\u2043")
+_PAGE_NUMBER_RE = re.compile(r"^\s*\d+\s*$|^\s*(?:page|pg|p)\.?\s*\d+\s*$|^\(\d+\)$", re.I)
+_TOC_RE = re.compile(r"\.{3,}|\bcontents\b|^\s*\d+(?:\.\d+){0,3}\s*[-–—]\s*\d+(?:\.\d+){0,3}\s*$", re.I)
+_RANGE_RE = re.compile(r"\s*\d+(?:\.\d+){0,3}\s*[-–—]\s*\d+(?:\.\d+){0,3}\s*$")
+_CONTENTS_RE = re.compile(r"\bcontents\b")
+_HEADER_RE = re.compile(r"\b[A-Z]{2,}\d{2,}\b"
+                        r"|(?i:\b(?:syllabus|module|chapter|textbook|contents|index|introduction|overview)\b)")
+_HEADER_WORDS = frozenset(("syllabus", "module", "chapter", "textbook", "contents", "index", "introduction",
+                           "overview"))
+_CODE_RE = re.compile(r"[A-Z]{2,}\d{2,}")
+_ALPHA_WORD_RE = re.compile(r"\b[A-Za-z]+\b")
+_UPPER_WORD_RE = re.compile(r"\b[A-Z]+\b")
+_SHORT_WORD_RE = re.compile(r"\b[a-zA-Z]{2,}\b")
+_ASCII_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def normalize_line(line):
+    """NFKC, emoji and leading bullets removed, whitespace collapsed."""
+    ln = unicodedata.normalize("NFKC", line)
+    stripped = _EMOJI_RE.sub("", ln)
+    if len(stripped) != len(ln):
+        # a removed emoji can leave a composable pair behind
+        stripped = unicodedata.normalize("NFKC", stripped)
+    ln = _BULLETS_RE.sub("", stripped.replace("\xa0", " ")).strip()
+    return _SPACE_RE.sub(" ", ln)
+
+
+def looks_like_page_number(line):
+    return _PAGE_NUMBER_RE.match(line) is not None
+
+
+def looks_like_toc_or_range(line):
+    return _TOC_RE.search(line) is not None
+
+
+def looks_like_header_token(line):
+    """Course codes, syllabus/chapter words, or mostly upper-case words."""
+    if _HEADER_RE.search(line):
+        return True
+    words = len(_ALPHA_WORD_RE.findall(line))
+    return bool(words) and len(_UPPER_WORD_RE.findall(line)) >= max(1, words // 2)
+
+
+def _normalize_lines(lines):
+    """normalize_line for many lines: NFKC and emoji removal over the joined
+    block (a newline never composes with its neighbours), the rest per line."""
+    block = unicodedata.normalize("NFKC", "\n".join(lines))
+    stripped = block if block.isascii() else _EMOJI_RE.sub("", block)
+    if len(stripped) != len(block):
+        stripped = unicodedata.normalize("NFKC", stripped)
+    # NFKC already turned no-break spaces into spaces
+    return [" ".join(ln.lstrip(_LEADING).split()) for ln in stripped.split("\n")]
+
+
+def _drop_ascii_line(line, headers):
+    """PageCleaner's line tests for an ASCII line from one tokenization. For
+    ASCII text a `\\b[A-Za-z]+\\b` match is exactly an all-letter [A-Za-z0-9_] run."""
+    if "..." in line:
+        return True
+    low = line.lower()
+    if "contents" in low and _CONTENTS_RE.search(low):
+        return True
+    if _RANGE_RE.match(line):
+        return True
+    words = list(filter(str.isalpha, _ASCII_TOKEN_RE.findall(line)))
+    if headers:
+        if _CODE_RE.search(line) and _HEADER_RE.search(line):
+            return True
+        if words:
+            if (any(k in low for k in _HEADER_WORDS)
+                    and not _HEADER_WORDS.isdisjoint(w.lower() for w in words)):
+                return True
+            if sum(map(str.isupper, words)) >= max(1, len(words) // 2):
+                return True
+    return len(words) <= 3 or len(words) - list(map(len, words)).count(1) <= 3
+
+
+class _Stream:
+    """Splits fed text into complete lines; a partial last line waits for more."""
+
+    def __init__(self):
+        self._pending = []
+
+    def feed(self, text):
+        cut = max(text.rfind("\n"), text.rfind("\r"))
+        if cut < 0:
+            self._pending.append(text)
+            return self
+        block = "".join(self._pending) + text[:cut + 1]
+        self._pending = [text[cut + 1:]]
+        self._lines(block)
+        return self
+
+    def _flush(self):
+        block = "".join(self._pending)
+        self._pending = []
+        if block:
+            self._lines(block)
+
+    def _lines(self, block):
+        raise NotImplementedError
+
+
+class TextCleaner(_Stream):
+    """Streaming form of quiz_generator.clean_input_text (see module docstring)."""
+
+    def __init__(self):
+        super().__init__()
+        self.kept = []
+        self.counts = Counter()
+
+    def _lines(self, block):
+        kept, counts = self.kept, self.counts
+        for ln in unicodedata.normalize("NFKC", block).splitlines():
+            ln = ln.strip()
+            # more than two words, and no junk marker
+            if not _THREE_WORDS_RE.search(ln):
+                continue
+            low = ln.lower()
+            if (_JUNK_START_RE.match(low) or "doi:" in low or "http://" in low or "https://" in low
+                    or ("copyright" in low and _COPYRIGHT_RE.search(low))):
+                continue
+            kept.append(ln)
+            counts[ln] += 1
+
+    def finish(self):
+        self._flush()
+        limit = max(3, len(self.kept) // 30)
+        counts = self.counts
+        out = " ".join(ln for ln in self.kept if counts[ln] < limit)
+        # same as collapsing \s+ runs and stripping, without a regex over the whole text
+        return " ".join(out.split())
+
+
+class PageCleaner:
+    """Streaming form of static/jsonq.clean_and_merge_pages: feed_page() once
+    per page. With layout_cleaned=True (headers and footers already removed
+    geometrically, see utils/layout.py) only TOC and short lines are dropped."""
+
+    def __init__(self, layout_cleaned=False, threshold_frac=0.30):
+        self.layout_cleaned = layout_cleaned
+        self.threshold_frac = threshold_frac
+        self.pages = 0
+        self.kept = []
+        self.seen = Counter()
+
+    def feed_page(self, page):
+        page = page.replace("\r", "\n")
+        if "\n" in page:
+            lines = _normalize_lines([ln for ln in page.split("\n") if ln.strip()])
+        else:
+            # NFKC can create sentence ends, so split the raw text first
+            lines = [normalize_line(ln) for ln in _SENTENCE_RE.split(page) if ln.strip()]
+        self.pages += 1
+        headers = not self.layout_cleaned
+        if headers:
+            self.seen.update(set(lines))
+        kept = self.kept
+        for line in lines:
+            if not line:
+                continue
+            if headers and _PAGE_NUMBER_RE.match(line):
+                continue
+            if line.isascii():
+                if _drop_ascii_line(line, headers):
+                    continue
+            elif (_TOC_RE.search(line) or (headers and looks_like_header_token(line))
+                  or len(_SHORT_WORD_RE.findall(line.lower())) <= 3):
+                continue
+            kept.append(line)
+        return self
+
+    def finish(self):
+        kept = self.kept
+        if not self.layout_cleaned:
+            pages = max(1, self.pages)
+            repeated = {line for line, n in self.seen.items() if n / pages >= self.threshold_frac}
+            kept = [line for line in kept if line not in repeated]
+        merged = unicodedata.normalize("NFKC", " ".join(kept))
+        return " ".join(merged.split())
+
+
+def clean_text(raw_text):
+    """quiz_generator's cleaning of one whole text."""
+    return TextCleaner().feed(raw_text or "").finish()
+
+
+def clean_pages(pages, layout_cleaned=False):
+    """jsonq's cleaning of an iterable of page texts."""
+    cleaner = PageCleaner(layout_cleaned=layout_cleaned)
+    for page in pages:
+        cleaner.feed_page(page)
+    return cleaner.finish()
@@ -0,0 +1,170 @@
+"""Upload intake for endpoints that take a file plus a few form fields.
+
+Three request shapes are accepted:
+
+- `multipart/form-data`: fields in the form, the file in part `file`;
+- raw binary (`application/pdf`, `image/*`, `application/octet-stream`,
+  `text/plain`): the body is the file, fields come from the query string
+  and the file name from `X-Filename`;
+- legacy JSON: `{"file": {"data": <base64>, "mimeType": ...}, ...}`.
+
+A multipart part is used where werkzeug spooled it, with no second copy.
+Apps that set `UploadRequest` as their request class get parts larger than
+`SPOOL_MEMORY_BYTES` spooled to a named temporary file. A raw body is copied
+in fixed-size blocks into a spool of its own. That spool stays in memory up
+to `SPOOL_MEMORY_BYTES`, then moves to a named temporary file. Either way,
+peak memory per upload is bounded by the file size (less for big files),
+instead of the ~3x of base64-in-JSON (encoded body, parsed string, decoded
+copy). A large upload also has a `path`, so extractors can open it without
+reading it into memory.
+
+Handlers close uploads when done (`with upload:` or `upload.close()`). A
+multipart file belongs to the request and is closed with it, so an upload
+handed to a background job must be `detach()`ed first.
+"""
+import io
+import os
+import base64
+import shutil
+import tempfile
+
+from flask import Request
+
+SPOOL_MEMORY_BYTES = 1024 * 1024
+COPY_BLOCK_BYTES = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+RAW_MIMETYPES = ("application/pdf", "application/octet-stream", "text/plain")
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeds MAX_UPLOAD_BYTES."""
+
+
+class UploadRequest(Request):
+    """Flask request whose multipart file parts past SPOOL_MEMORY_BYTES go to a
+    named temporary file (werkzeug's default spool has no path)."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > SPOOL_MEMORY_BYTES:
+            return tempfile.NamedTemporaryFile("wb+", prefix="upload-")
+        return io.BytesIO()
+
+
+class SpooledUpload:
+    def __init__(self, fileobj, mime_type, filename=None, size=0, owned=True):
+        self.file = fileobj
+        self.mime_type = mime_type or "application/octet-stream"
+        self.filename = filename
+        self.size = size
+        # False when the request owns the file (multipart) and closes it at its end
+        self.owned = owned
+
+    @classmethod
+    def from_stream(cls, stream, mime_type, filename=None, max_bytes=MAX_UPLOAD_BYTES):
+        spool = io.BytesIO()
+        size = 0
+        try:
+            while True:
+                block = stream.read(COPY_BLOCK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                if size > SPOOL_MEMORY_BYTES and isinstance(spool, io.BytesIO):
+                    # roll over to a named file, so extractors can open it by path
+                    on_disk = tempfile.NamedTemporaryFile("wb+", prefix="upload-")
+                    on_disk.write(spool.getbuffer())
+                    spool = on_disk
+                spool.write(block)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return cls(spool, mime_type, filename, size)
+
+    @classmethod
+    def from_storage(cls, storage, max_bytes=MAX_UPLOAD_BYTES):
+        """Wrap a werkzeug FileStorage as it is (werkzeug has already spooled it)."""
+        stream = storage.stream
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        if size > max_bytes:
+            raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+        return cls(stream, storage.mimetype, storage.filename, size, owned=False)
+
+    @classmethod
+    def from_base64(cls, data, mime_type, filename=None, max_bytes=MAX_UPLOAD_BYTES):
+        raw = base64.b64decode(data or "")
+        if len(raw) > max_bytes:
+            raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+        return cls(io.BytesIO(raw), mime_type, filename, len(raw))
+
+    @property
+    def path(self):
+        """Path of the file backing the upload, or None while it is in memory."""
+        name = getattr(self.file, "name", None)
+        return name if isinstance(name, str) and os.path.isfile(name) else None
+
+    def detach(self):
+        """This upload, or a copy the request does not own, for use after the request."""
+        if self.owned:
+            return self
+        self.file.seek(0)
+        copy = SpooledUpload.from_stream(self.file, self.mime_type, self.filename)
+        self.close()
+        return copy
+
+    def read(self):
+        """The whole file as bytes (for APIs that need a buffer, e.g. SDK file parts)."""
+        self.file.seek(0)
+        return self.file.read()
+
+    def save(self, path):
+        self.file.seek(0)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(self.file, out, COPY_BLOCK_BYTES)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f"SpooledUpload({self.filename!r}, {self.mime_type}, {self.size} bytes)"
+
+
+def is_raw_upload(mimetype):
+    return bool(mimetype) and (mimetype in RAW_MIMETYPES or mimetype.startswith("image/"))
+
+
+def read_upload_request(req, field="file"):
+    """Split a request into (fields dict, SpooledUpload or None). Raises
+    UploadTooLarge, or ValueError for a malformed legacy payload."""
+    if req.content_length and req.content_length > MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024:
+        raise UploadTooLarge(f"upload exceeds {MAX_UPLOAD_BYTES} bytes")
+    if req.mimetype == "multipart/form-data":
+        fields = req.form.to_dict()
+        storage = req.files.get(field)
+        upload = None
+        if storage is not None and storage.filename:
+            upload = SpooledUpload.from_storage(storage)
+        return fields, upload
+    if is_raw_upload(req.mimetype):
+        upload = SpooledUpload.from_stream(req.stream, req.mimetype, req.headers.get("X-Filename"))
+        return req.args.to_dict(), upload
+    data = req.get_json(silent=True) or {}
+    payload = data.pop(field, None) if isinstance(data, dict) else None
+    if not isinstance(data, dict):
+        raise ValueError("JSON body must be an object")
+    upload = None
+    if payload:
+        if not isinstance(payload, dict) or not payload.get("data"):
+            raise ValueError("file must be an object with base64 'data' and 'mimeType'")
+        upload = SpooledUpload.from_base64(payload["data"], payload.get("mimeType"), payload.get("name"))
+    return data, upload
@@ -0,0 +1,240 @@
+"""Precomputed WordNet distractor table.
+
+`wn.synsets()` loads the whole WordNet corpus on its first call, which
+takes several seconds and used to land on whichever quiz request came
+first. The quiz generators then walked synsets again for every question.
+This module answers "terms related to X" from a table built once, offline:
+
+    python -m utils.wordnet_table build [--out PATH] [--per-word 10]
+
+The build needs the NLTK wordnet corpus (see utils/nltk_resources.py). For
+every WordNet lemma it stores the other lemma names of that word's synsets,
+in synset order, which is exactly what the generators used to collect. The
+file format is little-endian:
+
+    b"WNDT", version u16, per_word u16, count u32
+    count records "<IIHH": key offset, value offset, key length, value length
+    string heap: keys (lowercase UTF-8), values (terms joined by "\\x1f")
+
+Records are sorted by key bytes. The file is mmap'd and binary-searched,
+so opening it costs almost nothing, and its pages are shared by every
+worker through the OS page cache. `related_terms` puts an LRU
+(`WORDNET_LOOKUP_CACHE` entries) in front.
+
+Without a table (`WORDNET_TABLE`, default data/wordnet_distractors.bin),
+lookups fall back to live WordNet, still memoized, or to nothing when the
+corpus is not on this host either.
+"""
+import os
+import sys
+import mmap
+import struct
+import logging
+import argparse
+import threading
+from functools import lru_cache
+
+from utils.nltk_resources import available as nltk_available, load_nltk
+
+logger = logging.getLogger("wordnet_table")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLE_PATH = os.getenv("WORDNET_TABLE") or os.path.join(BASE_DIR, "data", "wordnet_distractors.bin")
+MAGIC = b"WNDT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+RECORD = struct.Struct("<IIHH")
+SEPARATOR = "\x1f"
+PER_WORD = 10
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+LOOKUP_CACHE = _env_int("WORDNET_LOOKUP_CACHE", 4096)
+
+
+def normalize(word):
+    return " ".join((word or "").replace("_", " ").lower().split())
+
+
+class DistractorTable:
+    """Read-only view of a table file (see module docstring)."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.per_word, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} distractor table")
+        self._records = HEADER.size
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        return RECORD.unpack_from(self._mm, self._records + i * RECORD.size)
+
+    def get(self, word):
+        """Related terms of `word` (already normalized) as a tuple; () when absent."""
+        key = word.encode("utf-8")
+        mm = self._mm
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k_off, v_off, k_len, v_len = self._record(mid)
+            probe = mm[k_off:k_off + k_len]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return tuple(mm[v_off:v_off + v_len].decode("utf-8").split(SEPARATOR)) if v_len else ()
+        return ()
+
+    def close(self):
+        self._mm.close()
+
+
+def write_table(path, entries, per_word=PER_WORD):
+    """Write {normalized word: [related terms]} to `path` atomically. Returns the entry count."""
+    items = sorted((normalize(k).encode("utf-8"), SEPARATOR.join(v[:per_word]).encode("utf-8"))
+                   for k, v in entries.items() if normalize(k))
+    heap_start = HEADER.size + RECORD.size * len(items)
+    records, heap = [], bytearray()
+    for key, value in items:
+        k_off = heap_start + len(heap)
+        heap += key
+        v_off = heap_start + len(heap)
+        heap += value
+        records.append(RECORD.pack(k_off, v_off, len(key), len(value)))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, per_word, len(items)))
+        f.write(b"".join(records))
+        f.write(heap)
+    os.replace(tmp, path)
+    return len(items)
+
+
+def _synset_terms(wn, word, per_word=PER_WORD):
+    """Other lemma names of `word`'s synsets, in synset order (underscores -> spaces)."""
+    out = []
+    low = normalize(word)
+    for syn in wn.synsets(word):
+        for lemma in syn.lemmas():
+            term = lemma.name().replace("_", " ")
+            if term.lower() != low and term not in out:
+                out.append(term)
+                if len(out) >= per_word:
+                    return out
+    return out
+
+
+def build_table(path=TABLE_PATH, per_word=PER_WORD):
+    wn = load_nltk().corpus.wordnet
+    entries = {}
+    for name in wn.all_lemma_names():
+        terms = _synset_terms(wn, name, per_word)
+        if terms:
+            entries[name] = terms
+    return write_table(path, entries, per_word)
+
+
+_table = None
+_table_checked = False
+_wordnet = None
+_load_lock = threading.Lock()
+
+
+def get_table():
+    """The mmap'd table, opened once per process; None when the file is missing or invalid."""
+    global _table, _table_checked
+    if not _table_checked:
+        with _load_lock:
+            if not _table_checked:
+                try:
+                    _table = DistractorTable(TABLE_PATH)
+                except FileNotFoundError:
+                    logger.warning("WordNet distractor table %s missing; using live WordNet "
+                                   "(build it with: python -m utils.wordnet_table build)", TABLE_PATH)
+                except (OSError, ValueError, struct.error) as e:
+                    logger.warning("WordNet distractor table unusable (%s); using live WordNet", e)
+                _table_checked = True
+    return _table
+
+
+def _live_terms(word):
+    global _wordnet
+    if not nltk_available("wordnet"):
+        return ()
+    if _wordnet is None:
+        _wordnet = load_nltk().corpus.wordnet
+    return tuple(_synset_terms(_wordnet, word))
+
+
+def _candidates(word):
+    # WordNet keys are base forms; a light stand-in for morphy on plurals
+    yield word
+    if word.endswith("ies") and len(word) > 4:
+        yield word[:-3] + "y"
+    if word.endswith("es") and len(word) > 4:
+        yield word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        yield word[:-1]
+
+
+@lru_cache(maxsize=LOOKUP_CACHE)
+def related_terms(word):
+    """Terms sharing a WordNet synset with `word` (tuple, synset order, may be empty)."""
+    word = normalize(word)
+    if not word:
+        return ()
+    table = get_table()
+    if table is None:
+        try:
+            return _live_terms(word)
+        except Exception as e:
+            logger.debug("WordNet lookup failed for %r: %s", word, e)
+            return ()
+    for form in _candidates(word):
+        terms = table.get(form)
+        if terms:
+            return tuple(t for t in terms if t.lower() != word)
+    return ()
+
+
+def stats():
+    info = related_terms.cache_info()
+    table = get_table()
+    return {"table": TABLE_PATH if table is not None else None, "entries": len(table) if table is not None else 0,
+            "hits": info.hits, "misses": info.misses, "cached": info.currsize}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m utils.wordnet_table", description="WordNet distractor table")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build the table from the NLTK wordnet corpus")
+    b.add_argument("--out", default=TABLE_PATH)
+    b.add_argument("--per-word", type=int, default=PER_WORD)
+    q = sub.add_parser("lookup", help="print the related terms of words")
+    q.add_argument("words", nargs="+")
+    args = ap.parse_args(argv)
+    if args.cmd == "build":
+        count = build_table(args.out, args.per_word)
+        print(f"wrote {count} entries to {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)")
+    else:
+        for w in args.words:
+            print(f"{w}: {', '.join(related_terms(w)) or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())